@@ -1,6 +1,7 @@
 from django.contrib import admin
 from trading.models import (
     Order,
+    Position,
     Stock,
     TradeDataFile,
 )
@@ -18,6 +19,20 @@ class OrderAdmin(admin.ModelAdmin):
     )
     list_filter = ("order_type",)
 
+    def get_readonly_fields(self, request, obj=None):
+        # positions are only adjusted when orders are created or deleted
+        if obj is not None:
+            return ("user", "stock", "order_type", "quantity")
+        return super().get_readonly_fields(request, obj)
+
+
+class PositionAdmin(admin.ModelAdmin):
+    list_display = ("user", "stock", "quantity")
+    search_fields = (
+        "user__username",
+        "stock__symbol",
+    )
+
 
 class TradeDataFileAdmin(admin.ModelAdmin):
     list_display = (
@@ -29,4 +44,5 @@ class TradeDataFileAdmin(admin.ModelAdmin):
 
 admin.site.register(Stock, StockAdmin)
 admin.site.register(Order, OrderAdmin)
+admin.site.register(Position, PositionAdmin)
 admin.site.register(TradeDataFile, TradeDataFileAdmin)
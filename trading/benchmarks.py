@@ -0,0 +1,353 @@
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Iterator,
+)
+
+import factory
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import (
+    connection,
+    transaction,
+)
+from more_itertools import ichunked
+from trading.factories import (
+    StockFactory,
+    UserFactory,
+)
+from trading.models import (
+    Order,
+    StagedOrder,
+    Stock,
+    TradeDataFile,
+)
+from trading.services import (
+    CSVParser,
+    PortfolioCache,
+    StockCache,
+    TradeDataFileProcessor,
+    UserCache,
+    stock_symbols,
+)
+
+
+SYMBOL_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+class QueryCounter:
+    """Count the queries run on the default connection"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def count_queries(self) -> Iterator["QueryCounter"]:
+        with connection.execute_wrapper(self):
+            yield self
+
+
+def get_peak_rss() -> int:
+    """Peak resident set size of the current process in bytes. It never
+    decreases, stages only raise it past the peak of the stages before them.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux and in bytes on macOS
+    if sys.platform == "darwin":
+        return peak_rss
+    return peak_rss * 1024
+
+
+def get_current_rss() -> int | None:
+    """Resident set size of the current process in bytes, only available on
+    Linux
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def iter_symbols(exclude: set[str]) -> Iterator[str]:
+    """Stock symbols unused by existing stocks, symbols are at most 5
+    characters long
+    """
+    for length in range(1, 6):
+        for number in range(len(SYMBOL_CHARS) ** length):
+            symbol = ""
+            for _ in range(length):
+                number, index = divmod(number, len(SYMBOL_CHARS))
+                symbol += SYMBOL_CHARS[index]
+            if symbol not in exclude:
+                yield symbol
+
+
+def create_benchmark_users(count: int) -> list[User]:
+    prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+    users = UserFactory.build_batch(
+        count, username=factory.Sequence(lambda n: f"{prefix}-{n}")
+    )
+    return User.objects.bulk_create(users)
+
+
+def create_benchmark_stocks(count: int) -> list[Stock]:
+    symbols = iter_symbols(set(Stock.objects.values_list("symbol", flat=True)))
+    stocks = StockFactory.build_batch(
+        count, symbol=factory.LazyFunction(lambda: next(symbols))
+    )
+    stocks = Stock.objects.bulk_create(stocks)
+    # bulk_create skips the signals reloading the stock symbols
+    stock_symbols.invalidate()
+    return stocks
+
+
+def generate_trade_data_rows(
+    rows: int,
+    users: list[User],
+    stocks: list[Stock],
+    sell_ratio: float = 0.3,
+    seed: int = 0,
+) -> Iterator[list]:
+    """Random orders of the given users and stocks. A SELL is only
+    generated for a position that can cover it, so every row is valid.
+    """
+    rng = random.Random(seed)
+    balances = {}
+    for _ in range(rows):
+        user = rng.choice(users)
+        stock = rng.choice(stocks)
+        key = (user.id, stock.symbol)
+        balance = balances.get(key, 0)
+        if balance > 0 and rng.random() < sell_ratio:
+            quantity = rng.randint(1, balance)
+            balances[key] = balance - quantity
+            yield [user.id, stock.symbol, quantity, "SELL"]
+        else:
+            quantity = rng.randint(1, 100)
+            balances[key] = balance + quantity
+            yield [user.id, stock.symbol, quantity, "BUY"]
+
+
+def generate_trade_data_csv_file(
+    rows: int,
+    users: list[User],
+    stocks: list[Stock],
+    sell_ratio: float = 0.3,
+    seed: int = 0,
+) -> str:
+    """Write a synthetic trade data file to the CSV upload path and return
+    its storage name. Rows are written to a temporary file as they are
+    generated and copied to storage in chunks, so memory use doesn't grow
+    with the number of rows.
+    """
+    with tempfile.TemporaryFile() as temp_file:
+        text_file = io.TextIOWrapper(temp_file, encoding="utf-8", newline="")
+        writer = csv.writer(text_file)
+        writer.writerow(["User", "Stock", "Quantity", "Order Type"])
+        writer.writerows(
+            generate_trade_data_rows(rows, users, stocks, sell_ratio, seed)
+        )
+        text_file.flush()
+        # keep the temporary file open once the wrapper is gone
+        text_file.detach()
+        temp_file.seek(0)
+        return default_storage.save(
+            os.path.join(settings.CSV_UPLOAD_PATH, "benchmark.csv"),
+            File(temp_file),
+        )
+
+
+class IngestionBenchmark:
+    """Time the trade data file pipeline on a synthetic file. Parsing and
+    cache building are also timed on their own, then the whole file is
+    processed. Processing commits like it does in a worker, all data created
+    is deleted afterwards unless `keep` is set.
+    """
+
+    def __init__(
+        self,
+        rows: int = 100000,
+        users: int = 1000,
+        stocks: int = 100,
+        sell_ratio: float = 0.3,
+        seed: int = 0,
+        keep: bool = False,
+        **processor_kwargs,
+    ):
+        self.rows = rows
+        self.users = users
+        self.stocks = stocks
+        self.sell_ratio = sell_ratio
+        self.seed = seed
+        self.keep = keep
+        self.processor_kwargs = processor_kwargs
+        self.batch_size = 500
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str, rows: int = None) -> Iterator[dict[str, Any]]:
+        counter = QueryCounter()
+        result = {}
+        start_rss = get_current_rss()
+        start = time.perf_counter()
+        with counter.count_queries():
+            yield result
+        seconds = time.perf_counter() - start
+        end_rss = get_current_rss()
+        result["seconds"] = round(seconds, 3)
+        if rows is not None:
+            result["rows_per_second"] = round(rows / seconds) if seconds else 0
+        result["queries"] = counter.count
+        if start_rss is not None and end_rss is not None:
+            result["rss_delta"] = end_rss - start_rss
+        result["peak_rss"] = get_peak_rss()
+        self.stages[name] = result
+
+    def run(self) -> dict[str, Any]:
+        with self.stage("fixtures"):
+            with transaction.atomic():
+                users = create_benchmark_users(self.users)
+                stocks = create_benchmark_stocks(self.stocks)
+
+        csv_file = None
+        try:
+            with self.stage("generate", self.rows):
+                csv_file = generate_trade_data_csv_file(
+                    self.rows, users, stocks, self.sell_ratio, self.seed
+                )
+            self._run_stages(csv_file)
+        finally:
+            if not self.keep:
+                self.clean_up(users, stocks, csv_file)
+        return self.as_dict()
+
+    def clean_up(
+        self, users: list[User], stocks: list[Stock], csv_file: str | None
+    ):
+        """Delete the data created by the benchmark"""
+        user_ids = [user.id for user in users]
+        with transaction.atomic():
+            if csv_file is not None:
+                trade_data_files = TradeDataFile.objects.filter(
+                    uploaded_file=csv_file
+                )
+                StagedOrder.objects.filter(
+                    trade_data_file__in=trade_data_files
+                ).delete()
+                trade_data_files.delete()
+            # skips the per order signals, positions go with their users
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {Order._meta.db_table} "
+                    "WHERE user_id = ANY(%s)",
+                    [user_ids],
+                )
+            User.objects.filter(id__in=user_ids).delete()
+            Stock.objects.filter(id__in=[stock.id for stock in stocks]).delete()
+        # the deleted stocks may already be loaded
+        stock_symbols.invalidate()
+        if csv_file is not None:
+            default_storage.delete(csv_file)
+
+    def _run_stages(self, csv_file: str):
+        with self.stage("parse", self.rows):
+            parser = CSVParser(csv_file)
+            for _ in parser:
+                pass
+            parser.close()
+
+        with self.stage("cache", self.rows):
+            caches = [UserCache(), StockCache(), PortfolioCache()]
+            parser = CSVParser(csv_file)
+            for batch in ichunked(parser, self.batch_size):
+                rows = [row for row in batch]
+                for cache in caches:
+                    cache.build_cache_for_batch(rows)
+            parser.close()
+            for cache in caches:
+                cache.close()
+
+        trade_data_file = TradeDataFile.objects.create(uploaded_file=csv_file)
+        processor = TradeDataFileProcessor(
+            trade_data_file, **self.processor_kwargs
+        )
+        with self.stage("process", self.rows) as result:
+            processor.process()
+        result["stage_seconds"] = processor.progress.as_dict()["stage_seconds"]
+        result["writer"] = processor.writer.name
+        result["rows_written"] = processor.writer.rows_written
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "commit": get_git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "config": {
+                "rows": self.rows,
+                "users": self.users,
+                "stocks": self.stocks,
+                "sell_ratio": self.sell_ratio,
+                "seed": self.seed,
+                **self.processor_kwargs,
+            },
+            "stages": self.stages,
+        }
+
+
+def compare_benchmark_results(
+    baseline: dict[str, Any], result: dict[str, Any]
+) -> dict[str, float]:
+    """Change of rows/sec per stage relative to the baseline, -0.1 is a 10%
+    slowdown
+    """
+    changes = {}
+    for name, stage in result["stages"].items():
+        baseline_rate = baseline["stages"].get(name, {}).get("rows_per_second")
+        if baseline_rate and "rows_per_second" in stage:
+            changes[name] = round(
+                stage["rows_per_second"] / baseline_rate - 1, 3
+            )
+    return changes
+
+
+def load_benchmark_result(path: str) -> dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_benchmark_result(path: str, result: dict[str, Any]):
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
@@ -0,0 +1,114 @@
+import hashlib
+import uuid
+from functools import partial
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import parse_etags
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+
+RESPONSE_VERSION_KEY_PREFIX = "response-version"
+RESPONSE_KEY_PREFIX = "response"
+# stocks and their prices
+STOCKS_SCOPE = "stocks"
+# orders and positions of any user
+USERS_SCOPE = "users"
+# orders and positions written by trade data file ingestion
+FILES_SCOPE = "files"
+
+
+def get_user_scope(user_id: int) -> str:
+    """Orders and positions of a single user"""
+    return f"user:{user_id}"
+
+
+def get_response_version_key(scope: str) -> str:
+    return f"{RESPONSE_VERSION_KEY_PREFIX}:{scope}"
+
+
+def get_response_versions(scopes: list[str]) -> list[str]:
+    """Current version of each scope in one cache lookup. Versions are
+    random tokens rather than counters so a cleared version cache can't
+    bring back the versions of responses cached before it.
+    """
+    cache = caches[settings.RESPONSE_VERSIONS_CACHE]
+    keys = [get_response_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def bump_response_versions(scopes: Iterable[str]):
+    """Expire the cached responses built from the scopes"""
+    caches[settings.RESPONSE_VERSIONS_CACHE].set_many(
+        {get_response_version_key(scope): uuid.uuid4().hex for scope in scopes},
+        timeout=None,
+    )
+
+
+def bump_response_versions_on_commit(scopes: Iterable[str]):
+    """Bump right away for reads in this transaction and again after commit
+    as other processes may have cached the old data in between
+    """
+    scopes = list(scopes)
+    bump_response_versions(scopes)
+    transaction.on_commit(partial(bump_response_versions, scopes))
+
+
+def bump_user_response_versions(user_ids: Iterable[int]):
+    bump_response_versions_on_commit(
+        [USERS_SCOPE, *(get_user_scope(user_id) for user_id in set(user_ids))]
+    )
+
+
+def get_response_digest(request: Request, scopes: list[str]) -> str:
+    """Digest of the request and the versions of the scopes its response is
+    built from, used as both the ETag and the cache key
+    """
+    digest = hashlib.sha256()
+    for part in [
+        request.build_absolute_uri(),
+        request.accepted_media_type or "",
+        *scopes,
+        *get_response_versions(scopes),
+    ]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CachedListMixin:
+    """Serve list responses from the response cache keyed by the versions
+    of the data they are built from. Clients sending back the ETag of an
+    unchanged list get a 304 without the cached response being read.
+    """
+
+    def get_response_scopes(self) -> list[str]:
+        raise NotImplementedError
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        digest = get_response_digest(request, self.get_response_scopes())
+        etag = f'"{digest}"'
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = caches[settings.RESPONSE_CACHE]
+            cache_key = f"{RESPONSE_KEY_PREFIX}:{digest}"
+            data = cache.get(cache_key)
+            if data is None:
+                response = super().list(request, *args, **kwargs)
+                cache.set(cache_key, response.data, settings.RESPONSE_TIMEOUT)
+            else:
+                response = Response(data)
+        response["ETag"] = etag
+        return response
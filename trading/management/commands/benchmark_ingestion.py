@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand
+from trading.benchmarks import (
+    IngestionBenchmark,
+    compare_benchmark_results,
+    load_benchmark_result,
+    save_benchmark_result,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark trade data file ingestion on a synthetic file, reporting "
+        "rows/sec, RSS change and query counts per stage"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--stocks", type=int, default=100)
+        parser.add_argument(
+            "--sell-ratio",
+            type=float,
+            default=0.3,
+            help="Share of orders that sell an existing position",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--write-backend", choices=["copy", "bulk_create"])
+        parser.add_argument("--use-staging", action="store_true", default=None)
+        parser.add_argument("--parse-workers", type=int)
+        parser.add_argument("--columnar", action="store_true", default=None)
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the generated users, stocks, orders and file",
+        )
+        parser.add_argument("--output", help="Save the results as JSON")
+        parser.add_argument(
+            "--baseline", help="Compare rows/sec with a saved JSON result"
+        )
+
+    def handle(self, *args, **options):
+        processor_kwargs = {
+            name: options[name]
+            for name in [
+                "write_backend",
+                "use_staging",
+                "parse_workers",
+                "columnar",
+            ]
+            if options[name] is not None
+        }
+        benchmark = IngestionBenchmark(
+            rows=options["rows"],
+            users=options["users"],
+            stocks=options["stocks"],
+            sell_ratio=options["sell_ratio"],
+            seed=options["seed"],
+            keep=options["keep"],
+            **processor_kwargs,
+        )
+        result = benchmark.run()
+        if options["baseline"]:
+            result["changes"] = compare_benchmark_results(
+                load_benchmark_result(options["baseline"]), result
+            )
+        if options["output"]:
+            save_benchmark_result(options["output"], result)
+
+        self.stdout.write(json.dumps(result, indent=2))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from trading.models import Position
+
+
+class Command(BaseCommand):
+    help = "Rebuild user stock positions from the order history"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            Position.objects.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {Position.objects.count()} positions from orders."
+            )
+        )
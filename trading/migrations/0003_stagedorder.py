@@ -0,0 +1,87 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:32
+
+import django.db.models.deletion
+import trading.constants
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_staged_order_unlogged(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("ALTER TABLE trading_stagedorder SET UNLOGGED")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0002_tradedatafile"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tradedatafile",
+            name="status",
+            field=models.PositiveSmallIntegerField(
+                choices=[
+                    (0, "NEW"),
+                    (1, "Processing"),
+                    (2, "Processed"),
+                    (3, "Failed"),
+                ],
+                default=0,
+                verbose_name="Status",
+            ),
+        ),
+        migrations.CreateModel(
+            name="StagedOrder",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.BigIntegerField()),
+                (
+                    "order_type",
+                    models.PositiveSmallIntegerField(choices=[(1, "Buy"), (2, "Sell")]),
+                ),
+                (
+                    "stock",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="trading.stock",
+                    ),
+                ),
+                (
+                    "trade_data_file",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="staged_orders",
+                        to="trading.tradedatafile",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            bases=(trading.constants.OrderTypes, models.Model),
+        ),
+        migrations.RunPython(
+            set_staged_order_unlogged, migrations.RunPython.noop
+        ),
+    ]
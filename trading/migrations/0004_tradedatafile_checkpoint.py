@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0003_stagedorder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tradedatafile",
+            name="checkpoint_offset",
+            field=models.BigIntegerField(
+                default=0,
+                help_text="Bytes of the file already staged",
+                verbose_name="Checkpoint offset",
+            ),
+        ),
+        migrations.AddField(
+            model_name="tradedatafile",
+            name="checkpoint_portfolio",
+            field=models.JSONField(
+                blank=True,
+                help_text="Portfolio quantity changes of the staged rows",
+                null=True,
+                verbose_name="Checkpoint portfolio",
+            ),
+        ),
+        migrations.AddField(
+            model_name="tradedatafile",
+            name="checkpoint_row",
+            field=models.BigIntegerField(
+                default=0,
+                help_text="Rows of the file already staged",
+                verbose_name="Checkpoint row",
+            ),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:41
+
+import django.db.models.deletion
+import django_extensions.db.fields
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_positions(apps, schema_editor):
+    schema_editor.execute(
+        "INSERT INTO trading_position "
+        "(created, modified, user_id, stock_id, quantity) "
+        "SELECT MIN(created), MAX(modified), user_id, stock_id, SUM(quantity) "
+        "FROM trading_order GROUP BY user_id, stock_id"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0004_tradedatafile_checkpoint"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Position",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    django_extensions.db.fields.CreationDateTimeField(
+                        auto_now_add=True, verbose_name="created"
+                    ),
+                ),
+                (
+                    "modified",
+                    django_extensions.db.fields.ModificationDateTimeField(
+                        auto_now=True, verbose_name="modified"
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.BigIntegerField(default=0, verbose_name="Quantity"),
+                ),
+                (
+                    "stock",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="positions",
+                        to="trading.stock",
+                        verbose_name="Stock",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="positions",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "get_latest_by": "modified",
+                "abstract": False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="position",
+            constraint=models.UniqueConstraint(
+                fields=("user", "stock"), name="unique_user_stock_position"
+            ),
+        ),
+        migrations.RunPython(build_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0005_position"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stagedorder",
+            name="shard",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
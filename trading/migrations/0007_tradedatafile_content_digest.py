@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0006_stagedorder_shard"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tradedatafile",
+            name="content_digest",
+            field=models.CharField(
+                blank=True,
+                help_text="SHA-256 of the file content",
+                max_length=64,
+                null=True,
+                verbose_name="Content digest",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="tradedatafile",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", 3), _negated=True),
+                fields=("content_digest",),
+                name="unique_trade_data_file_content",
+            ),
+        ),
+    ]
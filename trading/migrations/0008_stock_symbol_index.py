@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-16 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0007_tradedatafile_content_digest"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="stock",
+            name="symbol",
+            field=models.CharField(db_index=True, max_length=5, verbose_name="Symbol"),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-16 21:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0008_stock_symbol_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="idempotency_key",
+            field=models.CharField(
+                blank=True,
+                help_text="Client key making retries of the order safe",
+                max_length=64,
+                null=True,
+                verbose_name="Idempotency key",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="order",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("idempotency_key__isnull", False)),
+                fields=("user", "idempotency_key"),
+                name="unique_user_order_idempotency_key",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-16 21:11
+
+from django.db import migrations, models
+
+
+def fill_position_values(apps, schema_editor):
+    schema_editor.execute(
+        "UPDATE trading_position SET value = trading_position.quantity * "
+        "trading_stock.price FROM trading_stock "
+        "WHERE trading_stock.id = trading_position.stock_id"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0010_order_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="position",
+            name="value",
+            field=models.DecimalField(
+                decimal_places=5,
+                default=0,
+                help_text="Quantity times the stock price in USD",
+                max_digits=32,
+                verbose_name="Value",
+            ),
+        ),
+        migrations.RunPython(fill_position_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.0.6 on 2026-10-16 21:17
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0011_position_value"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HoldingsSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "taken_at",
+                    models.DateTimeField(unique=True, verbose_name="Taken at"),
+                ),
+            ],
+            options={
+                "ordering": ["-taken_at"],
+            },
+        ),
+        migrations.CreateModel(
+            name="SnapshotHolding",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=django.contrib.postgres.indexes.BrinIndex(
+                fields=["created"], name="order_created_brin_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="snapshotholding",
+            name="snapshot",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="holdings",
+                to="trading.holdingssnapshot",
+            ),
+        ),
+        migrations.AddField(
+            model_name="snapshotholding",
+            name="stock",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="trading.stock",
+            ),
+        ),
+        migrations.AddField(
+            model_name="snapshotholding",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="snapshotholding",
+            constraint=models.UniqueConstraint(
+                fields=("snapshot", "user", "stock"),
+                name="unique_snapshot_user_stock_holding",
+            ),
+        ),
+    ]
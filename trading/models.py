@@ -1,9 +1,30 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterable
+
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Sum
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import (
+    IntegrityError,
+    connection,
+    models,
+    transaction,
+)
+from django.db.models import (
+    F,
+    Min,
+    Q,
+    Sum,
+    Value,
+)
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_extensions.db.models import TimeStampedModel
+from more_itertools import chunked
+from trading.caching import bump_user_response_versions
 from trading.constants import (
     OrderTypes,
     TradeDataFileStatuses,
@@ -12,7 +33,9 @@ from trading.constants import (
 
 class Stock(TimeStampedModel):
     name = models.CharField(verbose_name=_("Name"), max_length=255)
-    symbol = models.CharField(verbose_name=_("Symbol"), max_length=5)
+    symbol = models.CharField(
+        verbose_name=_("Symbol"), max_length=5, db_index=True
+    )
     price = models.DecimalField(
         verbose_name=_("Price"),
         max_digits=settings.TRANSACTION_MAX_DIGITS,
@@ -24,6 +47,14 @@ class Stock(TimeStampedModel):
         return f"{self.name} ({self.symbol})"
 
 
+class InsufficientBalance(Exception):
+    def __init__(self, available: int):
+        super().__init__(
+            f"Not enough stock balance. Stock available: {available}"
+        )
+        self.available = available
+
+
 class OrderQuerySet(models.QuerySet):
     def annotate_total_quantity_user_stock(self):
         return self.values("user_id", "stock__symbol").annotate(
@@ -37,10 +68,145 @@ class OrderManager(models.Manager):
 
     def get_available_balance(self, stock: Stock, user: User) -> int:
         return (
-            self.get_queryset()
-            .filter(stock=stock, user=user)
-            .aggregate(Sum("quantity"))["quantity__sum"]
+            Position.objects.filter(stock=stock, user=user)
+            .values_list("quantity", flat=True)
+            .first()
+        ) or 0
+
+    def get_idempotent(
+        self, user: User, idempotency_keys: Iterable[str]
+    ) -> dict[str, "Order"]:
+        """Orders already created by the user for the idempotency keys"""
+        keys = {key for key in idempotency_keys if key}
+        if not keys:
+            return {}
+        return {
+            order.idempotency_key: order
+            for order in self.filter(user=user, idempotency_key__in=keys)
+        }
+
+    def create_order(
+        self,
+        user: User,
+        stock: Stock,
+        quantity: int,
+        order_type: int,
+        idempotency_key: str = None,
+    ) -> "Order":
+        """Create an order, or return the order already created with the
+        same idempotency key. Raises `InsufficientBalance` for a SELL the
+        position can't cover.
+        """
+        existing = self.get_idempotent(user, [idempotency_key])
+        if existing:
+            return existing[idempotency_key]
+        try:
+            if order_type == self.model.SELL:
+                return self.create_sell(user, stock, quantity, idempotency_key)
+            with transaction.atomic():
+                return self.create(
+                    user=user,
+                    stock=stock,
+                    quantity=quantity,
+                    order_type=order_type,
+                    idempotency_key=idempotency_key,
+                )
+        except IntegrityError:
+            # created concurrently by a retry of the same request
+            existing = self.get_idempotent(user, [idempotency_key])
+            if not existing:
+                raise
+            return existing[idempotency_key]
+
+    def create_sell(
+        self,
+        user: User,
+        stock: Stock,
+        quantity: int,
+        idempotency_key: str = None,
+    ) -> "Order":
+        """Withdraw the quantity from the user's position and create the SELL
+        order in one transaction. Raises `InsufficientBalance` if the
+        position can't cover it.
+        """
+        with transaction.atomic():
+            if Position.objects.withdraw(user.pk, stock.pk, quantity) is None:
+                raise InsufficientBalance(
+                    self.get_available_balance(stock=stock, user=user)
+                )
+            order = self.model(
+                user=user,
+                stock=stock,
+                quantity=-quantity,
+                order_type=self.model.SELL,
+                idempotency_key=idempotency_key,
+            )
+            # the position is already updated
+            order.position_applied = True
+            order.save()
+        return order
+
+    def create_batch(
+        self, user: User, orders: list[dict]
+    ) -> list["Order | InsufficientBalance"]:
+        """Create the user's orders with one bulk insert, checking SELLs
+        against the balances left by the orders before them. Returns the
+        created order, or the error for a rejected SELL, per item. Orders
+        with an idempotency key that was already used return that order.
+        """
+        existing = self.get_idempotent(
+            user, (values.get("idempotency_key") for values in orders)
         )
+        with transaction.atomic():
+            sell_stock_ids = sorted(
+                {
+                    values["stock"].pk
+                    for values in orders
+                    if values["order_type"] == self.model.SELL
+                }
+            )
+            # locked so concurrent orders wait for this batch
+            balances = dict(
+                Position.objects.select_for_update()
+                .filter(user=user, stock_id__in=sell_stock_ids)
+                .order_by("stock_id")
+                .values_list("stock_id", "quantity")
+            )
+            results = []
+            created = []
+            deltas = defaultdict(int)
+            for values in orders:
+                idempotency_key = values.get("idempotency_key")
+                if idempotency_key in existing:
+                    results.append(existing[idempotency_key])
+                    continue
+                stock_id = values["stock"].pk
+                quantity = values["quantity"]
+                available = balances.get(stock_id, 0)
+                if values["order_type"] == self.model.SELL:
+                    if available < quantity:
+                        results.append(InsufficientBalance(available))
+                        continue
+                    quantity = -quantity
+                balances[stock_id] = available + quantity
+                deltas[(user.pk, stock_id)] += quantity
+                order = self.model(
+                    user=user,
+                    stock_id=stock_id,
+                    quantity=quantity,
+                    order_type=values["order_type"],
+                    idempotency_key=idempotency_key,
+                )
+                if idempotency_key:
+                    # repeated within the batch
+                    existing[idempotency_key] = order
+                results.append(order)
+                created.append(order)
+            # bulk_create skips the signals updating positions
+            self.bulk_create(created)
+            Position.objects.apply_deltas(deltas)
+            bump_user_response_versions([user.pk])
+        return results
 
 
 class Order(OrderTypes, TimeStampedModel):
@@ -48,6 +214,8 @@ class Order(OrderTypes, TimeStampedModel):
         User,
         related_name="orders",
         on_delete=models.CASCADE,
+        # covered by the composite indexes starting with the user
+        db_index=False,
     )
     stock = models.ForeignKey(
         Stock,
@@ -62,9 +230,346 @@ class Order(OrderTypes, TimeStampedModel):
         verbose_name=_("Order Type"),
         choices=OrderTypes.CHOICES,
     )
+    idempotency_key = models.CharField(
+        verbose_name=_("Idempotency key"),
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text=_("Client key making retries of the order safe"),
+    )
 
     objects = OrderManager()
 
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            # keyset pagination of order listings and their filters
+            models.Index(
+                fields=["user", "-created", "-id"],
+                name="order_user_created_idx",
+            ),
+            models.Index(
+                fields=["user", "stock", "-created", "-id"],
+                name="order_user_stock_created_idx",
+            ),
+            models.Index(
+                fields=["user", "order_type", "-created", "-id"],
+                name="order_user_type_created_idx",
+            ),
+            # orders created since the last holdings snapshot, orders are
+            # appended so a block range index stays small
+            BrinIndex(fields=["created"], name="order_created_brin_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "idempotency_key"],
+                condition=Q(idempotency_key__isnull=False),
+                name="unique_user_order_idempotency_key",
+            )
+        ]
+
+
+class PositionManager(models.Manager):
+    upsert_batch_size = 1000
+
+    def apply_deltas(self, deltas: dict[tuple[int, int], int]):
+        """Add quantity changes keyed by (user_id, stock_id), creating
+        missing positions. The value is recomputed from the stock price in
+        the same statement.
+        """
+        table = self.model._meta.db_table
+        price = f"(SELECT price FROM {Stock._meta.db_table} WHERE id = %s)"
+        now = timezone.now()
+        # sorted so concurrent updates lock rows in the same order
+        items = sorted(item for item in deltas.items() if item[1])
+        for batch in chunked(items, self.upsert_batch_size):
+            values = ", ".join(
+                [f"(%s, %s, %s, %s, %s, %s * {price})"] * len(batch)
+            )
+            params = []
+            for (user_id, stock_id), quantity in batch:
+                params.extend(
+                    [now, now, user_id, stock_id, quantity, quantity, stock_id]
+                )
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} "
+                    "(created, modified, user_id, stock_id, quantity, value) "
+                    f"VALUES {values} "
+                    "ON CONFLICT (user_id, stock_id) DO UPDATE SET "
+                    f"quantity = {table}.quantity + EXCLUDED.quantity, "
+                    f"value = ({table}.quantity + EXCLUDED.quantity) * "
+                    f"(SELECT price FROM {Stock._meta.db_table} "
+                    "WHERE id = EXCLUDED.stock_id), "
+                    "modified = EXCLUDED.modified",
+                    params,
+                )
+
+    def withdraw(
+        self, user_id: int, stock_id: int, quantity: int
+    ) -> int | None:
+        """Subtract the quantity if the position covers it and return the
+        new quantity, or None if it doesn't. A single conditional UPDATE
+        only locks this position, concurrent withdrawals wait for it and
+        recheck the balance.
+        """
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET quantity = quantity - %s, "
+                "value = (quantity - %s) * "
+                f"(SELECT price FROM {Stock._meta.db_table} WHERE id = %s), "
+                "modified = %s "
+                "WHERE user_id = %s AND stock_id = %s AND quantity >= %s "
+                "RETURNING quantity",
+                [
+                    quantity,
+                    quantity,
+                    stock_id,
+                    timezone.now(),
+                    user_id,
+                    stock_id,
+                    quantity,
+                ],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def rebuild(self):
+        """Recreate all positions from the order history"""
+        table = self.model._meta.db_table
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # block new orders until the positions are rebuilt
+                cursor.execute(
+                    f"LOCK TABLE {Order._meta.db_table} IN SHARE MODE"
+                )
+            self.all().delete()
+            cursor.execute(
+                f"INSERT INTO {table} "
+                "(created, modified, user_id, stock_id, quantity, value) "
+                "SELECT %s, %s, o.user_id, o.stock_id, SUM(o.quantity), "
+                "SUM(o.quantity) * s.price "
+                f"FROM {Order._meta.db_table} o "
+                f"JOIN {Stock._meta.db_table} s ON s.id = o.stock_id "
+                "GROUP BY o.user_id, o.stock_id, s.price",
+                [now, now],
+            )
+
+    def refresh_values(self, stock_id: int, price: Decimal):
+        """Recompute the value of the positions of a stock after a price
+        change, rows already at the price are left untouched
+        """
+        value = F("quantity") * Value(price)
+        self.filter(stock_id=stock_id).exclude(value=value).update(
+            value=value, modified=timezone.now()
+        )
+
+
+class Position(TimeStampedModel):
+    """Quantity and value of a stock held by a user. Kept up to date on order
+    creation, trade data file ingestion and stock price changes so balances
+    and investments don't need to sum orders.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name="positions",
+        on_delete=models.CASCADE,
+    )
+    stock = models.ForeignKey(
+        Stock,
+        verbose_name=_("Stock"),
+        related_name="positions",
+        on_delete=models.CASCADE,
+    )
+    quantity = models.BigIntegerField(verbose_name=_("Quantity"), default=0)
+    value = models.DecimalField(
+        verbose_name=_("Value"),
+        max_digits=settings.TRANSACTION_MAX_DIGITS,
+        decimal_places=settings.TRANSACTION_DECIMAL_PLACES,
+        default=0,
+        help_text=_("Quantity times the stock price in USD"),
+    )
+
+    objects = PositionManager()
+
+    class Meta(TimeStampedModel.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "stock"], name="unique_user_stock_position"
+            )
+        ]
+
+
+class HoldingsSnapshotManager(models.Manager):
+    def take(self, taken_at: datetime) -> "HoldingsSnapshot":
+        """Snapshot the holdings of every user from the previous snapshot
+        and the orders created since, so the cost depends on the orders of
+        one interval rather than on the whole history
+        """
+        holdings_table = SnapshotHolding._meta.db_table
+        order_table = Order._meta.db_table
+        with transaction.atomic():
+            previous = self.filter(taken_at__lt=taken_at).first()
+            snapshot = self.create(taken_at=taken_at)
+            if previous:
+                changes = (
+                    "SELECT user_id, stock_id, quantity "
+                    f"FROM {holdings_table} WHERE snapshot_id = %s "
+                    "UNION ALL SELECT user_id, stock_id, quantity "
+                    f"FROM {order_table} WHERE created > %s AND created <= %s"
+                )
+                params = [snapshot.pk, previous.pk, previous.taken_at, taken_at]
+            else:
+                changes = (
+                    "SELECT user_id, stock_id, quantity "
+                    f"FROM {order_table} WHERE created <= %s"
+                )
+                params = [snapshot.pk, taken_at]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {holdings_table} "
+                    "(snapshot_id, user_id, stock_id, quantity) "
+                    "SELECT %s, user_id, stock_id, SUM(quantity) "
+                    f"FROM ({changes}) AS changes "
+                    "GROUP BY user_id, stock_id HAVING SUM(quantity) <> 0",
+                    params,
+                )
+        return snapshot
+
+    def prune(self, before: datetime):
+        """Only keep the first snapshot of each day before the given time"""
+        snapshots = self.filter(taken_at__lt=before)
+        first_of_day = (
+            snapshots.annotate(day=TruncDate("taken_at"))
+            .values("day")
+            .annotate(first=Min("taken_at"))
+            .values("first")
+        )
+        snapshots.exclude(taken_at__in=first_of_day).delete()
+
+    def get_holdings(self, user_id: int, at: datetime) -> dict[int, int]:
+        """Quantity of each stock held by a user at a point in time, read
+        from the nearest snapshot and the orders created after it
+        """
+        snapshot = self.filter(taken_at__lte=at).first()
+        holdings = defaultdict(int)
+        orders = Order.objects.filter(user_id=user_id, created__lte=at)
+        if snapshot:
+            holdings.update(
+                snapshot.holdings.filter(user_id=user_id).values_list(
+                    "stock_id", "quantity"
+                )
+            )
+            orders = orders.filter(created__gt=snapshot.taken_at)
+        for stock_id, quantity in orders.values_list("stock_id").annotate(
+            Sum("quantity")
+        ):
+            holdings[stock_id] += quantity
+        return {
+            stock_id: quantity
+            for stock_id, quantity in sorted(holdings.items())
+            if quantity
+        }
+
+    def get_history(
+        self, user_id: int, start: datetime, end: datetime
+    ) -> list[tuple[datetime, dict[int, int]]]:
+        """Holdings of a user at the start and end of a time range and at
+        every snapshot taken within it
+        """
+        snapshots = list(
+            self.filter(taken_at__gt=start, taken_at__lt=end).order_by(
+                "taken_at"
+            )
+        )
+        snapshot_holdings = defaultdict(dict)
+        for snapshot_id, stock_id, quantity in (
+            SnapshotHolding.objects.filter(
+                snapshot__in=snapshots, user_id=user_id
+            )
+            .order_by("stock_id")
+            .values_list("snapshot_id", "stock_id", "quantity")
+        ):
+            snapshot_holdings[snapshot_id][stock_id] = quantity
+        return [
+            (start, self.get_holdings(user_id, start)),
+            *(
+                (snapshot.taken_at, snapshot_holdings[snapshot.pk])
+                for snapshot in snapshots
+            ),
+            (end, self.get_holdings(user_id, end)),
+        ]
+
+
+class HoldingsSnapshot(models.Model):
+    """Holdings of every user at a point in time, taken periodically so past
+    holdings can be answered from the nearest snapshot. Orders are never
+    updated, deleting one afterwards is not reflected in older snapshots.
+    """
+
+    taken_at = models.DateTimeField(verbose_name=_("Taken at"), unique=True)
+
+    objects = HoldingsSnapshotManager()
+
+    class Meta:
+        ordering = ["-taken_at"]
+
+
+class SnapshotHolding(models.Model):
+    """Non zero quantity of a stock held by a user in a snapshot"""
+
+    snapshot = models.ForeignKey(
+        HoldingsSnapshot,
+        related_name="holdings",
+        on_delete=models.CASCADE,
+    )
+    user = models.ForeignKey(
+        User,
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    stock = models.ForeignKey(
+        Stock,
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    quantity = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["snapshot", "user", "stock"],
+                name="unique_snapshot_user_stock_holding",
+            )
+        ]
+
+
+class TradeDataFileManager(models.Manager):
+    def get_duplicate(self, content_digest: str) -> "TradeDataFile | None":
+        """Return a file with the same content that is not failed"""
+        return (
+            self.exclude(status=TradeDataFileStatuses.FAILED)
+            .filter(content_digest=content_digest)
+            .first()
+        )
+
+    def claim(self, pk: int) -> bool:
+        """Mark a new or processing file as processing with one conditional
+        update, returns whether it was claimed. Processed and failed files are
+        never claimed again.
+        """
+        return bool(
+            self.filter(
+                pk=pk,
+                status__in=[
+                    TradeDataFileStatuses.NEW,
+                    TradeDataFileStatuses.PROCESSING,
+                ],
+            ).update(status=TradeDataFileStatuses.PROCESSING)
+        )
+
 
 class TradeDataFile(TradeDataFileStatuses, TimeStampedModel):
     uploaded_file = models.FileField(
@@ -95,3 +600,68 @@ class TradeDataFile(TradeDataFileStatuses, TimeStampedModel):
         related_name="uploaded_trade_data_files",
         on_delete=models.CASCADE,
     )
+    checkpoint_offset = models.BigIntegerField(
+        verbose_name=_("Checkpoint offset"),
+        default=0,
+        help_text=_("Bytes of the file already staged"),
+    )
+    checkpoint_row = models.BigIntegerField(
+        verbose_name=_("Checkpoint row"),
+        default=0,
+        help_text=_("Rows of the file already staged"),
+    )
+    checkpoint_portfolio = models.JSONField(
+        verbose_name=_("Checkpoint portfolio"),
+        null=True,
+        blank=True,
+        help_text=_("Portfolio quantity changes of the staged rows"),
+    )
+    content_digest = models.CharField(
+        verbose_name=_("Content digest"),
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text=_("SHA-256 of the file content"),
+    )
+
+    objects = TradeDataFileManager()
+
+    class Meta(TimeStampedModel.Meta):
+        constraints = [
+            # failed files can be uploaded again
+            models.UniqueConstraint(
+                fields=["content_digest"],
+                condition=~models.Q(status=TradeDataFileStatuses.FAILED),
+                name="unique_trade_data_file_content",
+            )
+        ]
+
+
+class StagedOrder(OrderTypes, models.Model):
+    """Orders of a trade data file written in committed chunks before being
+    published to `Order` in a single statement. The table is unlogged on
+    PostgreSQL since rows can always be rebuilt from the uploaded file.
+    """
+
+    trade_data_file = models.ForeignKey(
+        TradeDataFile,
+        related_name="staged_orders",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    user = models.ForeignKey(
+        User,
+        related_name="+",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    stock = models.ForeignKey(
+        Stock,
+        related_name="+",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    quantity = models.BigIntegerField()
+    order_type = models.PositiveSmallIntegerField(choices=OrderTypes.CHOICES)
+    # user id shard that staged the order when the file is sharded
+    shard = models.PositiveSmallIntegerField(default=0)
@@ -0,0 +1,114 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import (
+    Q,
+    QuerySet,
+)
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    Cursor,
+    CursorPagination,
+)
+from trading.models import Order
+
+
+class OrderCursorPagination(CursorPagination):
+    """Keyset pagination on the newest orders first. Pages continue from
+    the (created, id) position of the previous page using the composite
+    order indexes, so deep pages cost the same as the first one. Orders of
+    a trade data file share their creation time, the id keeps the position
+    unique without the offsets of `CursorPagination`.
+    """
+
+    ordering = ("-created", "-id")
+    page_size = settings.ORDER_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.ORDER_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            reverse, current_position = (
+                self.cursor.reverse,
+                self.cursor.position,
+            )
+
+        # previous pages are read oldest first from the cursor
+        if reverse:
+            queryset = queryset.order_by("created", "id")
+        else:
+            queryset = queryset.order_by("-created", "-id")
+        if current_position is not None:
+            created, pk = self.parse_position(current_position)
+            if reverse:
+                keyset = Q(created__gt=created) | Q(created=created, id__gt=pk)
+            else:
+                keyset = Q(created__lt=created) | Q(created=created, id__lt=pk)
+            queryset = queryset.filter(keyset)
+
+        # one extra order tells whether a following page exists
+        results = list(queryset[: self.page_size + 1])
+        self.page = results[: self.page_size]
+        has_following = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = current_position is not None
+
+        # an empty page continues from the cursor it was read from
+        self.next_position = (
+            self.get_position(self.page[-1]) if self.page else current_position
+        )
+        self.previous_position = (
+            self.get_position(self.page[0]) if self.page else current_position
+        )
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_position(self, order: Order) -> str:
+        return f"{order.created.isoformat()}|{order.id}"
+
+    def parse_position(self, position: str) -> tuple[datetime, int]:
+        try:
+            created, pk = position.rsplit("|", 1)
+            return datetime.fromisoformat(created), int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=self.next_position)
+        )
+
+    def get_previous_link(self) -> str | None:
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=self.previous_position)
+        )
+
+
+class InvestmentCursorPagination(CursorPagination):
+    """Keyset pagination on the position id, the rollup rows are served in
+    a stable order as they are updated in place
+    """
+
+    ordering = "id"
+    page_size = settings.INVESTMENT_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.INVESTMENT_MAX_PAGE_SIZE
@@ -1,15 +1,40 @@
 from django.conf import settings
-from django.db import transaction
+from django.contrib.auth.models import User
+from django.db import (
+    IntegrityError,
+    transaction,
+)
 from django.utils.translation import gettext_lazy as _
-from rest_framework import serializers
+from rest_framework import (
+    exceptions,
+    serializers,
+    status,
+)
+from rest_framework.settings import api_settings
 from trading.models import (
+    HoldingsSnapshot,
+    InsufficientBalance,
     Order,
     Stock,
     TradeDataFile,
 )
+from trading.services import (
+    OrderIntakeUnavailable,
+    ProcessingProgress,
+    compute_content_digest,
+    dry_run_trade_data_file,
+    get_group_commit_writer,
+    stock_symbols,
+)
 from trading.tasks import process_trade_data_file
 
 
+class ServiceUnavailable(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Service temporarily unavailable, try again later.")
+    default_code = "service_unavailable"
+
+
 class AuthenticatedUserOrNone(serializers.CurrentUserDefault):
     def __call__(self, serializer_field):
         user = super().__call__(serializer_field)
@@ -30,8 +55,27 @@ class StockSerializer(serializers.ModelSerializer):
         fields = ["id", "name", "symbol", "price"]
 
 
+class StockPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """Stock primary key resolved from `stock_symbols` instead of the
+    database. `OrderViewSet` refreshes the symbols once per request.
+    """
+
+    def to_internal_value(self, data) -> Stock:
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            stock_id = int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        stock = stock_symbols.get_by_id(stock_id)
+        if stock is None:
+            self.fail("does_not_exist", pk_value=data)
+        return Stock(id=stock.id, symbol=stock.symbol, price=stock.price)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    stock = StockPrimaryKeyField(queryset=Stock.objects.all())
     quantity = serializers.IntegerField(min_value=1)
 
     class Meta:
@@ -42,23 +86,86 @@ class OrderSerializer(serializers.ModelSerializer):
             "quantity",
             "order_type",
             "user",
+            "idempotency_key",
         ]
+        # a repeated idempotency key returns the order created with it
+        validators = []
+        extra_kwargs = {"idempotency_key": {"default": None}}
+
+    def get_extra_kwargs(self) -> dict:
+        extra_kwargs = super().get_extra_kwargs()
+        if settings.ORDER_GROUP_COMMIT and not self.context.get("in_batch"):
+            # a timed out order is only safe to retry with the same key
+            extra_kwargs["idempotency_key"] = {
+                "required": True,
+                "allow_null": False,
+            }
+        return extra_kwargs
 
     def create(self, validated_data: dict) -> Order:
-        order_type = validated_data.get("order_type")
-        if order_type == Order.SELL:
-            available_quantity = Order.objects.get_available_balance(
-                stock=validated_data["stock"],
-                user=validated_data["user"],
-            )
-            if available_quantity < validated_data["quantity"]:
-                raise serializers.ValidationError(
-                    _("Not enough stock balance. Stock available: {}").format(
-                        available_quantity
-                    )
+        user = validated_data.pop("user")
+        try:
+            if settings.ORDER_GROUP_COMMIT:
+                return get_group_commit_writer().place(user, validated_data)
+            return Order.objects.create_order(user, **validated_data)
+        except InsufficientBalance as e:
+            raise serializers.ValidationError(
+                _("Not enough stock balance. Stock available: {}").format(
+                    e.available
                 )
-            validated_data["quantity"] = -validated_data["quantity"]
-        return super().create(validated_data)
+            )
+        except OrderIntakeUnavailable as e:
+            raise ServiceUnavailable(str(e) or None)
+
+
+class OrderBatchSerializer(serializers.Serializer):
+    """Place a list of orders at once. Invalid orders are rejected on their
+    own, the result of every order is returned in the same order.
+    """
+
+    orders = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.ORDER_BATCH_MAX_SIZE,
+        write_only=True,
+    )
+    results = serializers.ListField(
+        child=serializers.DictField(), read_only=True
+    )
+
+    def create(self, validated_data: dict) -> dict:
+        orders = validated_data["orders"]
+        results = [None] * len(orders)
+        valid_indexes = []
+        valid_orders = []
+        for index, data in enumerate(orders):
+            serializer = OrderSerializer(
+                data=data, context={**self.context, "in_batch": True}
+            )
+            if serializer.is_valid():
+                valid_indexes.append(index)
+                valid_orders.append(serializer.validated_data)
+            else:
+                results[index] = {"errors": serializer.errors}
+
+        created = Order.objects.create_batch(
+            self.context["request"].user, valid_orders
+        )
+        for index, order in zip(valid_indexes, created):
+            if isinstance(order, InsufficientBalance):
+                results[index] = {
+                    "errors": {
+                        api_settings.NON_FIELD_ERRORS_KEY: [
+                            _(
+                                "Not enough stock balance. "
+                                "Stock available: {}"
+                            ).format(order.available)
+                        ]
+                    }
+                }
+            else:
+                results[index] = OrderSerializer(order).data
+        return {"results": results}
 
 
 class TradeDataFileSerializer(serializers.ModelSerializer):
@@ -72,19 +179,146 @@ class TradeDataFileSerializer(serializers.ModelSerializer):
 
     @transaction.atomic
     def create(self, validated_data: dict) -> TradeDataFile:
-        instance = super().create(validated_data)
+        content_digest = compute_content_digest(validated_data["uploaded_file"])
+        duplicate = TradeDataFile.objects.get_duplicate(content_digest)
+        if duplicate:
+            # already uploaded, return it instead of processing it again
+            return duplicate
+
+        validated_data["content_digest"] = content_digest
+        try:
+            with transaction.atomic():
+                instance = super().create(validated_data)
+        except IntegrityError:
+            # same content uploaded concurrently
+            return TradeDataFile.objects.get_duplicate(content_digest)
         process_trade_data_file.delay_on_commit(instance.pk)
         return instance
 
 
+class TradeDataFileStatusSerializer(serializers.ModelSerializer):
+    status = serializers.CharField(source="get_status_display")
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TradeDataFile
+        fields = [
+            "id",
+            "status",
+            "created",
+            "completed_at",
+            "errors",
+            "progress",
+        ]
+
+    def get_progress(self, instance: TradeDataFile) -> dict | None:
+        return ProcessingProgress.get(instance.pk)
+
+
+class TradeDataFileDryRunSerializer(serializers.Serializer):
+    uploaded_file = serializers.FileField(write_only=True)
+    rows = serializers.IntegerField(read_only=True)
+    error_count = serializers.IntegerField(read_only=True)
+    errors = serializers.ListField(
+        child=serializers.DictField(), read_only=True
+    )
+
+    def create(self, validated_data: dict) -> dict:
+        return dry_run_trade_data_file(validated_data["uploaded_file"])
+
+
 class InvestmentSerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
     stock_symbol = serializers.CharField(source="stock__symbol")
+    quantity = serializers.IntegerField()
     total_value = serializers.DecimalField(
+        source="value",
         normalize_output=True,
         max_digits=settings.TRANSACTION_MAX_DIGITS,
         decimal_places=settings.TRANSACTION_DECIMAL_PLACES,
     )
 
     class Meta:
-        fields = ["user_id", "stock_symbol", "total_value"]
+        fields = ["user_id", "stock_symbol", "quantity", "total_value"]
+
+
+class HoldingSerializer(serializers.Serializer):
+    stock_id = serializers.IntegerField()
+    stock_symbol = serializers.CharField(allow_null=True)
+    quantity = serializers.IntegerField()
+
+
+class HoldingsPointSerializer(serializers.Serializer):
+    at = serializers.DateTimeField()
+    holdings = HoldingSerializer(many=True)
+
+
+class InvestmentHistorySerializer(serializers.Serializer):
+    """Holdings of a user at a point in time given `at`, or over a time
+    range given `start` and `end`
+    """
+
+    user = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.all(), write_only=True
+    )
+    at = serializers.DateTimeField(write_only=True, required=False)
+    start = serializers.DateTimeField(write_only=True, required=False)
+    end = serializers.DateTimeField(write_only=True, required=False)
+    points = HoldingsPointSerializer(many=True, read_only=True)
+
+    def validate(self, attrs: dict) -> dict:
+        if "at" in attrs:
+            if "start" in attrs or "end" in attrs:
+                raise serializers.ValidationError(
+                    _("Query either a point in time or a time range")
+                )
+            return attrs
+        if "start" not in attrs or "end" not in attrs:
+            raise serializers.ValidationError(
+                _("Either at or both start and end are required")
+            )
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError(
+                {"end": _("End must not be before start")}
+            )
+        # the start and end are points too
+        max_snapshots = settings.HOLDINGS_HISTORY_MAX_POINTS - 2
+        snapshots = HoldingsSnapshot.objects.filter(
+            taken_at__gt=attrs["start"], taken_at__lt=attrs["end"]
+        )
+        if snapshots[: max_snapshots + 1].count() > max_snapshots:
+            raise serializers.ValidationError(
+                _("Time range spans more than %(count)d snapshots")
+                % {"count": max_snapshots}
+            )
+        return attrs
+
+    def create(self, validated_data: dict) -> dict:
+        user_id = validated_data["user"].pk
+        if "at" in validated_data:
+            at = validated_data["at"]
+            history = [(at, HoldingsSnapshot.objects.get_holdings(user_id, at))]
+        else:
+            history = HoldingsSnapshot.objects.get_history(
+                user_id, validated_data["start"], validated_data["end"]
+            )
+        return {
+            "points": [
+                {
+                    "at": at,
+                    "holdings": [
+                        {
+                            "stock_id": stock_id,
+                            "stock_symbol": self.get_stock_symbol(stock_id),
+                            "quantity": quantity,
+                        }
+                        for stock_id, quantity in holdings.items()
+                    ],
+                }
+                for at, holdings in history
+            ]
+        }
+
+    def get_stock_symbol(self, stock_id: int) -> str | None:
+        stock = stock_symbols.get_by_id(stock_id)
+        return stock.symbol if stock else None
@@ -1,24 +1,84 @@
+import bz2
 import csv
-from collections import defaultdict
+import gzip
+import hashlib
+import io
+import logging
+import mmap
+import os
+import pathlib
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from collections import (
+    OrderedDict,
+    defaultdict,
+    deque,
+    namedtuple,
+)
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+)
+from contextlib import (
+    ExitStack,
+    contextmanager,
+)
+from functools import partial
+from itertools import islice
+from operator import itemgetter
 from typing import (
     Any,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Iterator,
+    Sequence,
     Tuple,
 )
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files import File
 from django.core.files.storage import default_storage
-from django.db import transaction
-from django.db.models import QuerySet
+from django.db import (
+    IntegrityError,
+    close_old_connections,
+    connection,
+    transaction,
+)
+from django.db.models import (
+    QuerySet,
+    Sum,
+)
 from django.utils import timezone
 from more_itertools import ichunked
+from trading.caching import (
+    FILES_SCOPE,
+    USERS_SCOPE,
+    bump_response_versions,
+)
 from trading.constants import OrderTypes
 from trading.models import (
+    InsufficientBalance,
     Order,
+    Position,
+    StagedOrder,
     Stock,
     TradeDataFile,
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 class ParserException(Exception):
     pass
 
@@ -31,45 +91,130 @@ class EmptyImportFile(ParserException):
     pass
 
 
-class CSVParser:
+# raised while reading files that are invalid, truncated or corrupt
+FILE_READ_ERRORS = (
+    ParserException,
+    IndexError,
+    UnicodeDecodeError,
+    EOFError,
+    OSError,
+    csv.Error,
+    zstandard.ZstdError,
+    pa.ArrowException,
+)
+
+
+def parse_value(value: str) -> int | str:
+    try:
+        return int(value.strip())
+    except ValueError:
+        return value.strip()
+
+
+def open_zstd(file: BinaryIO) -> BinaryIO:
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(file))
+
+
+# magic bytes of the supported compression formats
+DECOMPRESSORS: list[tuple[bytes, Callable[[BinaryIO], BinaryIO]]] = [
+    (b"\x1f\x8b", lambda file: gzip.GzipFile(fileobj=file, mode="rb")),
+    (b"BZh", bz2.BZ2File),
+    (b"\x28\xb5\x2f\xfd", open_zstd),
+]
+TRADE_DATA_FILE_SUFFIXES = (
+    ".csv",
+    ".csv.gz",
+    ".csv.bz2",
+    ".csv.zst",
+    ".parquet",
+    ".arrow",
+)
+CSV_FORMAT = "csv"
+PARQUET_FORMAT = "parquet"
+ARROW_FORMAT = "arrow"
+STOCK_SYMBOLS_VERSION_KEY = "stock-symbols-version"
+
+
+def open_decompressed(file: File) -> File:
+    """Wrap a binary file with a streaming decompressor chosen by its magic
+    bytes. Plain files are returned unchanged.
+    """
+    magic = file.read(4)
+    file.seek(0)
+    for prefix, decompress in DECOMPRESSORS:
+        if magic.startswith(prefix):
+            return File(decompress(file.file), name=file.name)
+    return file
+
+
+def detect_file_format(path: str) -> str:
+    """Tell Parquet and Arrow IPC files apart from CSV by their magic bytes"""
+    if not default_storage.exists(path):
+        return CSV_FORMAT
+    with default_storage.open(path, "rb") as f:
+        magic = f.read(6)
+    if magic.startswith(b"PAR1"):
+        return PARQUET_FORMAT
+    if magic == b"ARROW1":
+        return ARROW_FORMAT
+    return CSV_FORMAT
+
+
+class BaseParser:
+    """Headers and read position of a trade data file. Subclasses read the
+    rows, either one by one or in batches of columns.
+    """
+
     def __init__(self, csv_file: str):
         self.reader = None
         self.csv_file = csv_file
         self.missing_headers = []
         self.headers_indexes_dict = {}
         self.expected_headers = ["User", "Stock", "Quantity", "Order Type"]
+        # bytes consumed and data rows parsed, used for checkpoints
+        self.offset = 0
+        self.row_number = 0
+        self.start_offset = 0
+        self.start_row_number = 0
 
-    def __iter__(self):
+    def open(self):
+        """Open the file and read its headers, only done once"""
         if self.reader is None:
             self._init_reader()
 
-        return self
+    def _init_reader(self):
+        raise NotImplementedError
 
-    def __next__(self):
-        raw_row = next(self.reader)
-        return self.parse_row(raw_row)
+    def close(self):
+        pass
 
-    def _init_reader(self):
-        if not default_storage.exists(self.csv_file):
-            raise InvalidImportFile(f"Import file not found: {self.csv_file}")
-        self.reader = csv.reader(default_storage.open(self.csv_file, "rt"))
-        self.parse_header_index()
-        self.check_missing_headers()
+    def bytes_consumed(self) -> int:
+        """Bytes of the stored file read so far"""
+        return self.offset
+
+    def seek(self, offset: int, row_number: int):
+        """Start parsing data rows from the given byte offset. Headers are
+        still read from the start of the file.
+        """
+        self.start_offset = offset
+        self.start_row_number = row_number
 
     def clean_header(self, header: str):
         header = "_".join(header.split(" ")).lower()
         return header
 
-    def parse_header_index(self):
-        try:
-            headers = next(self.reader)
-        except StopIteration:
-            raise EmptyImportFile(f"No headers in `{self.csv_file}`")
-
+    def index_headers(self, headers: list[str]):
+        """Find the expected columns among the file headers"""
         for idx, raw_header in enumerate(headers):
             cleaned_header = self.clean_header(raw_header.strip())
             if cleaned_header:
                 self.headers_indexes_dict[cleaned_header] = idx
+        self.check_missing_headers()
+        # cleaned header and index of the expected columns
+        self.columns = [
+            (header, self.headers_indexes_dict[header])
+            for header in map(self.clean_header, self.expected_headers)
+        ]
 
     def check_missing_headers(self):
         for header in self.expected_headers:
@@ -84,17 +229,707 @@ class CSVParser:
             )
             raise InvalidImportFile(error_message)
 
+
+class CSVParser(BaseParser):
+    def __init__(self, csv_file: str):
+        super().__init__(csv_file)
+        self.file = None
+        self.storage_file = None
+
+    def __iter__(self):
+        self.open()
+        return self
+
+    def __next__(self):
+        raw_row = next(self.reader)
+        self.row_number += 1
+        return self.parse_row(raw_row)
+
+    def _init_reader(self):
+        if not default_storage.exists(self.csv_file):
+            raise InvalidImportFile(f"Import file not found: {self.csv_file}")
+        self.storage_file = default_storage.open(self.csv_file, "rb")
+        self.file = open_decompressed(self.storage_file)
+        self.reader = csv.reader(self._iter_lines())
+        self.parse_header_index()
+        if self.start_offset:
+            self._skip_to(self.start_offset)
+            self.offset = self.start_offset
+            self.row_number = self.start_row_number
+
+    def _skip_to(self, offset: int):
+        if self.file.seekable():
+            self.file.seek(offset)
+            return
+        # forward only decompression streams, read past the parsed bytes
+        remaining = offset - self.offset
+        while remaining > 0:
+            data = self.file.read(min(remaining, 1024 * 1024))
+            if not data:
+                break
+            remaining -= len(data)
+
+    @property
+    def compressed(self) -> bool:
+        return self.file is not self.storage_file
+
+    def bytes_consumed(self) -> int:
+        if self.compressed:
+            return self.storage_file.tell()
+        return super().bytes_consumed()
+
+    def _iter_lines(self) -> Iterator[str]:
+        # read line by line, iterating the file itself buffers whole chunks
+        for line in iter(self.file.readline, b""):
+            self.offset += len(line)
+            yield line.decode("utf-8")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.storage_file.close()
+
+    def parse_header_index(self):
+        try:
+            headers = next(self.reader)
+        except StopIteration:
+            raise EmptyImportFile(f"No headers in `{self.csv_file}`")
+
+        self.headers = headers
+        self.index_headers(headers)
+
     def parse_row(self, row: list[str]) -> dict:
-        row_data = {}
-        for header in self.expected_headers:
-            cleaned_header = self.clean_header(header)
-            idx = self.headers_indexes_dict[cleaned_header]
+        return {header: parse_value(row[idx]) for header, idx in self.columns}
+
+
+def parse_byte_range(
+    path: str, start: int, end: int, columns: list[tuple[str, int]]
+) -> tuple[list[dict], list[int]]:
+    """Parse the rows between two newline aligned byte offsets of a CSV file.
+    Returns the parsed rows and the byte offset where each row ends.
+    """
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped_file:
+        data = mapped_file[start:end]
+
+    offset = start
+
+    def iter_lines() -> Iterator[str]:
+        nonlocal offset
+        position = 0
+        while position < len(data):
+            newline = data.find(b"\n", position)
+            next_position = len(data) if newline == -1 else newline + 1
+            line = data[position:next_position].decode("utf-8")
+            offset = start + next_position
+            position = next_position
+            yield line
+
+    rows, row_ends = [], []
+    for row in csv.reader(iter_lines()):
+        rows.append({header: parse_value(row[idx]) for header, idx in columns})
+        row_ends.append(offset)
+    return rows, row_ends
+
+
+class ParallelCSVParser(CSVParser):
+    """Parse a CSV file in newline aligned byte ranges with a process pool.
+    Rows are returned in file order. Quoted values must not contain newlines.
+    Compressed files can't be split in byte ranges and are parsed serially.
+    """
+
+    def __init__(self, csv_file: str, workers: int, range_size: int = None):
+        super().__init__(csv_file)
+        self.workers = workers
+        self.range_size = (
+            range_size or settings.TRADE_DATA_FILE_PARSE_RANGE_SIZE
+        )
+        self.executor = None
+        self.pending: deque[Future] = deque()
+        self.ranges = None
+        self.rows = iter(())
+
+    def __next__(self):
+        if self.compressed:
+            return super().__next__()
+        while True:
+            for row, row_end in self.rows:
+                self.offset = row_end
+                self.row_number += 1
+                return row
+
+            self._submit_ranges()
+            if not self.pending:
+                self.close()
+                raise StopIteration
+            rows, row_ends = self.pending.popleft().result()
+            self.rows = zip(rows, row_ends)
+
+    def _init_reader(self):
+        super()._init_reader()
+        if self.compressed:
+            return
+        self.file.close()
+        self.path = default_storage.path(self.csv_file)
+        self.ranges = self._iter_ranges(self.offset)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def _iter_ranges(self, start: int) -> Iterator[tuple[int, int]]:
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if start >= size:
+                return
+            with mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped_file:
+                while start < size:
+                    newline = mapped_file.find(
+                        b"\n", min(start + self.range_size, size) - 1
+                    )
+                    end = size if newline == -1 else newline + 1
+                    yield start, end
+                    start = end
+
+    def _submit_ranges(self):
+        while len(self.pending) < self.workers * 2:
+            byte_range = next(self.ranges, None)
+            if byte_range is None:
+                break
+            self.pending.append(
+                self.executor.submit(
+                    parse_byte_range, self.path, *byte_range, self.columns
+                )
+            )
+
+    def close(self):
+        super().close()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+class ColumnarCSVParser(CSVParser):
+    """Parse a CSV file into batches of column values instead of row dicts.
+    Values are left as strings for `OrderColumnsCleaner` to convert per
+    column. Each batch is read as a block of lines, so quoted values must not
+    contain newlines.
+    """
+
+    def iter_batches(self, batch_size: int) -> Iterator[dict[str, tuple]]:
+        self.open()
+        headers = [header for header, _ in self.columns]
+        getter = itemgetter(*[idx for _, idx in self.columns])
+        while True:
+            block = b"".join(islice(self.file.file, batch_size))
+            if not block:
+                return
+            self.offset += len(block)
+            rows = list(csv.reader(io.StringIO(block.decode("utf-8"))))
+            self.row_number += len(rows)
+            yield dict(zip(headers, zip(*map(getter, rows))))
+
+
+class ArrowParser(BaseParser):
+    """Read a Parquet or Arrow IPC file as batches of typed columns for
+    `OrderColumnsCleaner`, without converting cells from text. Only the
+    expected columns are read and local files are memory mapped. Offsets are
+    row numbers since there are no lines to count.
+    """
+
+    # columns validated as integers, the others are dictionary encoded
+    integer_headers = ["user", "quantity"]
+
+    def __init__(self, csv_file: str, file_format: str):
+        super().__init__(csv_file)
+        self.file_format = file_format
+        self.source = None
+        self.num_rows = 0
+
+    def _init_reader(self):
+        if not default_storage.exists(self.csv_file):
+            raise InvalidImportFile(f"Import file not found: {self.csv_file}")
+        try:
+            self.source = pa.memory_map(default_storage.path(self.csv_file))
+        except NotImplementedError:
+            self.source = default_storage.open(self.csv_file, "rb")
+        try:
+            if self.file_format == PARQUET_FORMAT:
+                self.reader = pq.ParquetFile(self.source)
+                self.names = self.reader.schema_arrow.names
+                self.num_rows = self.reader.metadata.num_rows
+            else:
+                self.reader = pa.ipc.open_file(self.source)
+                self.names = self.reader.schema.names
+                # batches are memory mapped, counting rows reads no data
+                self.num_rows = sum(
+                    self.reader.get_batch(idx).num_rows
+                    for idx in range(self.reader.num_record_batches)
+                )
+        except pa.ArrowInvalid as e:
+            raise InvalidImportFile(f"Invalid {self.file_format} file: {e}")
+
+        self.index_headers(self.names)
+        if self.file_format == PARQUET_FORMAT:
+            # read text columns dictionary encoded instead of as strings
+            self.reader = pq.ParquetFile(
+                self.source,
+                read_dictionary=[
+                    self.names[idx]
+                    for header, idx in self.columns
+                    if header not in self.integer_headers
+                ],
+            )
+        self.row_number = self.offset = self.start_row_number
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+
+    def bytes_consumed(self) -> int:
+        # estimated from the rows read, batches are not byte aligned
+        if not self.num_rows:
+            return 0
+        return (
+            default_storage.size(self.csv_file)
+            * self.row_number
+            // self.num_rows
+        )
+
+    def _iter_record_batches(self) -> Iterator[pa.RecordBatch]:
+        """Record batches from the current row, reading only the expected
+        columns. Parquet files are read a row group at a time.
+        """
+        names = [self.names[idx] for _, idx in self.columns]
+        start = 0
+        if self.file_format == PARQUET_FORMAT:
+            metadata = self.reader.metadata
+            for idx in range(self.reader.num_row_groups):
+                num_rows = metadata.row_group(idx).num_rows
+                if start + num_rows > self.row_number:
+                    table = self.reader.read_row_group(idx, columns=names)
+                    for batch in table.to_batches():
+                        yield batch.slice(max(self.row_number - start, 0))
+                        start += batch.num_rows
+                else:
+                    start += num_rows
+            return
+
+        for idx in range(self.reader.num_record_batches):
+            batch = self.reader.get_batch(idx)
+            if start + batch.num_rows > self.row_number:
+                yield batch.select(names).slice(max(self.row_number - start, 0))
+            start += batch.num_rows
+
+    def _to_column(self, header: str, array: pa.Array) -> Sequence:
+        # other typed values of integer columns are rejected by `to_int64`
+        if header in self.integer_headers:
+            if pa.types.is_integer(array.type) and not array.null_count:
+                return array.to_numpy()
+            return array.to_pylist()
+        if pa.types.is_dictionary(array.type) and not array.null_count:
+            return array
+        return array.cast(pa.string()).fill_null("").dictionary_encode()
+
+    def iter_batches(self, batch_size: int) -> Iterator[dict[str, Sequence]]:
+        self.open()
+        headers = [header for header, _ in self.columns]
+        for batch in self._iter_record_batches():
+            for start in range(0, batch.num_rows, batch_size):
+                chunk = batch.slice(start, batch_size)
+                self.row_number += chunk.num_rows
+                self.offset = self.row_number
+                yield {
+                    header: self._to_column(header, array)
+                    for header, array in zip(headers, chunk.columns)
+                }
+
+
+def get_columnar_parser(csv_file: str) -> BaseParser:
+    file_format = detect_file_format(csv_file)
+    if file_format == CSV_FORMAT:
+        return ColumnarCSVParser(csv_file)
+    return ArrowParser(csv_file, file_format)
+
+
+def column_to_list(column: Sequence) -> list:
+    if isinstance(column, pa.Array):
+        return column.to_pylist()
+    if isinstance(column, np.ndarray):
+        return column.tolist()
+    return list(column)
+
+
+def to_int(value: Any) -> int:
+    """Convert an integer or integer text. Floats, decimals and booleans of
+    typed files are rejected instead of truncated, like in CSV files.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str, np.integer)):
+        raise TypeError(f"Not an integer: {value!r}")
+    return int(value)
+
+
+def to_int64(values: Sequence) -> tuple[np.ndarray, np.ndarray]:
+    """Convert values to an int64 array, also returning a mask of the values
+    that are valid integers
+    """
+    valid = np.ones(len(values), bool)
+    if isinstance(values, np.ndarray) and np.issubdtype(
+        values.dtype, np.integer
+    ):
+        return values.astype(np.int64, copy=False), valid
+    try:
+        converted = np.fromiter(
+            map(to_int, values), np.int64, count=len(values)
+        )
+        return converted, valid
+    except (ValueError, OverflowError, TypeError):
+        converted = np.zeros(len(values), np.int64)
+        for idx, value in enumerate(values):
             try:
-                row_data[cleaned_header] = int(row[idx].strip())
-            except ValueError:
-                row_data[cleaned_header] = row[idx].strip()
+                converted[idx] = to_int(value)
+            except (ValueError, OverflowError, TypeError):
+                valid[idx] = False
+        return converted, valid
+
+
+def get_column_value(column: Sequence, idx: int) -> Any:
+    value = column[idx]
+    if isinstance(value, pa.Scalar):
+        return value.as_py()
+    return value
+
+
+def factorize(values: Sequence) -> tuple[list, np.ndarray]:
+    """Get the distinct values in order of appearance and the index of each
+    value in them
+    """
+    if isinstance(values, pa.DictionaryArray):
+        # already encoded by arrow
+        return values.dictionary.to_pylist(), values.indices.to_numpy()
+    uniques = {value: idx for idx, value in enumerate(dict.fromkeys(values))}
+    codes = np.fromiter(
+        map(uniques.__getitem__, values), np.int64, count=len(values)
+    )
+    return list(uniques), codes
+
+
+class OrderColumnsCleaner:
+    """Vectorized version of the processor's row cleaning and balance
+    validation for a batch of columns. Raises the same error the row by row
+    validation would raise for the first invalid row.
+    """
+
+    def __init__(
+        self,
+        user_cache: "UserCache",
+        stock_cache: "StockCache",
+        portfolio_cache: "PortfolioCache",
+    ):
+        self.user_cache = user_cache
+        self.stock_cache = stock_cache
+        self.portfolio_cache = portfolio_cache
+
+    def clean(self, columns: dict[str, Sequence]) -> list[dict[str, Any]]:
+        # symbols and order types only have a handful of distinct values
+        order_type_values, order_type_codes = factorize(columns["order_type"])
+        order_types = np.array(
+            [
+                OrderTypes.CSV_MAP.get(str(value).strip(), 0)
+                for value in order_type_values
+            ],
+            np.uint8,
+        )[order_type_codes]
+        symbol_values, symbol_codes = factorize(columns["stock"])
+        symbols = [str(value).strip() for value in symbol_values]
+
+        quantities, quantity_valid = to_int64(columns["quantity"])
+        quantities = np.where(
+            order_types == Order.SELL, -quantities, quantities
+        )
+        user_ids, user_valid = to_int64(columns["user"])
+
+        unique_user_ids = np.unique(user_ids[user_valid]).tolist()
+        self.portfolio_cache.build_cache_for_values(unique_user_ids)
+        self.user_cache.build_cache_for_values(unique_user_ids)
+        self.stock_cache.build_cache_for_values(symbols)
+
+        existing_user_ids = [
+            user_id
+            for user_id in unique_user_ids
+            if self.user_cache.find(user_id)
+        ]
+        user_valid &= np.isin(user_ids, existing_user_ids)
+        symbol_stock_ids = [
+            self.stock_cache.find(symbol) or 0 for symbol in symbols
+        ]
+        stock_ids = np.array(symbol_stock_ids, np.int64)[symbol_codes]
+
+        checks = [
+            (order_types != 0, "Invalid order type: {order_type}"),
+            (quantity_valid, "Invalid quantity: {quantity}"),
+            (user_valid, "User ({user}) not found."),
+            (stock_ids != 0, "Stock (symbol={stock}) not found."),
+        ]
+        invalid = ~np.logical_and.reduce([valid for valid, _ in checks])
+        first_invalid = (
+            int(np.argmax(invalid)) if invalid.any() else len(invalid)
+        )
+
+        self._validate_balances(
+            user_ids[:first_invalid],
+            symbol_codes[:first_invalid],
+            quantities[:first_invalid],
+            symbols,
+            symbol_stock_ids,
+        )
+        if first_invalid < len(invalid):
+            values = {
+                header: parse_value(
+                    str(get_column_value(column, first_invalid))
+                )
+                for header, column in columns.items()
+            }
+            for valid, message in checks:
+                if not valid[first_invalid]:
+                    raise InvalidImportFile(message.format(**values))
+
+        return [
+            {
+                "user_id": user_id,
+                "stock_id": stock_id,
+                "quantity": quantity,
+                "order_type": order_type,
+            }
+            for user_id, stock_id, quantity, order_type in zip(
+                user_ids.tolist(),
+                stock_ids.tolist(),
+                quantities.tolist(),
+                order_types.tolist(),
+            )
+        ]
+
+    def _validate_balances(
+        self,
+        user_ids: np.ndarray,
+        symbol_codes: np.ndarray,
+        quantities: np.ndarray,
+        symbols: list[str],
+        symbol_stock_ids: list[int],
+    ):
+        """Check running balances of every (user, stock) pair with grouped
+        cumulative sums, then apply the changes to the portfolio cache
+        """
+        if not len(quantities):
+            return
+        pair_keys, pair_codes = np.unique(
+            user_ids * len(symbols) + symbol_codes, return_inverse=True
+        )
+        pairs = [divmod(key, len(symbols)) for key in pair_keys.tolist()]
+        starts = np.array(
+            [
+                self.portfolio_cache.get(user_id, symbol_stock_ids[symbol_code])
+                for user_id, symbol_code in pairs
+            ],
+            np.int64,
+        )
+
+        # running balance of each row within its pair, in file order
+        order = np.argsort(pair_codes, kind="stable")
+        sorted_codes = pair_codes[order]
+        sorted_quantities = quantities[order]
+        totals = np.cumsum(sorted_quantities)
+        group_starts = np.searchsorted(sorted_codes, np.arange(len(pairs)))
+        group_offsets = totals[group_starts] - sorted_quantities[group_starts]
+        balances = np.empty_like(totals)
+        balances[order] = (
+            totals - group_offsets[sorted_codes] + starts[sorted_codes]
+        )
+
+        insufficient = (quantities < 0) & (balances < 0)
+        if insufficient.any():
+            idx = int(np.argmax(insufficient))
+            symbol = symbols[symbol_codes[idx]]
+            available = int(balances[idx] - quantities[idx])
+            raise InvalidImportFile(
+                f"Failed to process order. Not enough stock balance "
+                f"for {symbol}. Stock available: {available}"
+            )
+
+        changes = np.zeros(len(pairs), np.int64)
+        np.add.at(changes, pair_codes, quantities)
+        for (user_id, symbol_code), change in zip(pairs, changes.tolist()):
+            self.portfolio_cache.add(
+                user_id, symbol_stock_ids[symbol_code], change
+            )
+
+
+def scan_order_keys(csv_file: str) -> set[tuple[int | str, str]]:
+    """Quick pre-scan of the (user, stock) pairs a trade data file touches.
+    Files that cannot be parsed return an empty set, they fail on their own
+    without changing any balance.
+    """
+    parser = get_columnar_parser(csv_file)
+    keys = set()
+    try:
+        for columns in parser.iter_batches(
+            settings.TRADE_DATA_FILE_COLUMNAR_BATCH_SIZE
+        ):
+            keys.update(
+                zip(
+                    map(parse_value, map(str, column_to_list(columns["user"]))),
+                    map(str.strip, map(str, column_to_list(columns["stock"]))),
+                )
+            )
+    except FILE_READ_ERRORS:
+        logger.warning("Could not scan trade data file %s", csv_file)
+        return set()
+    finally:
+        parser.close()
+    return keys
+
+
+def group_conflicting_files(
+    file_keys: dict[int, set[tuple[int | str, str]]]
+) -> list[list[int]]:
+    """Group files whose (user, stock) pairs overlap, directly or through
+    other files. Files in a group keep their given order and must run one
+    after another for SELL balance validation, groups can run concurrently.
+    """
+    parents = {pk: pk for pk in file_keys}
+
+    def find(pk: int) -> int:
+        while parents[pk] != pk:
+            parents[pk] = parents[parents[pk]]
+            pk = parents[pk]
+        return pk
+
+    owners = {}
+    for pk, keys in file_keys.items():
+        for key in keys:
+            root, other = find(pk), find(owners.setdefault(key, pk))
+            if root != other:
+                parents[other] = root
+
+    groups = defaultdict(list)
+    for pk in file_keys:
+        groups[find(pk)].append(pk)
+    return list(groups.values())
 
-        return row_data
+
+def compute_content_digest(file: File) -> str:
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def store_trade_data_csv_file(path: pathlib.Path) -> str:
+    """Hand a CSV file over to storage without reading it into memory. The
+    file is hardlinked into `CSV_UPLOAD_PATH` on the same filesystem,
+    otherwise it is streamed to storage in chunks. Returns the stored name,
+    removing the source file is left to the caller.
+    """
+    name = default_storage.get_available_name(
+        os.path.join(settings.CSV_UPLOAD_PATH, path.name)
+    )
+    try:
+        target = default_storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.link(path, target)
+        return name
+    except (NotImplementedError, OSError):
+        # storage without local paths or on another filesystem
+        pass
+    with path.open("rb") as f:
+        return default_storage.save(name, File(f, name=path.name))
+
+
+def pack_key(user_id: int, stock_id: int) -> int:
+    """Pack a (user_id, stock_id) pair into one int key"""
+    return user_id << 32 | stock_id
+
+
+def unpack_key(key: int) -> tuple[int, int]:
+    return key >> 32, key & 0xFFFFFFFF
+
+
+class SpillDict:
+    """Mapping of int keys to int values keeping at most `max_entries` in
+    memory. The least recently used entries spill to a temporary SQLite
+    database and are moved back to memory when used again.
+    """
+
+    def __init__(self, max_entries: int = None):
+        if max_entries is None:
+            max_entries = settings.TRADE_DATA_FILE_CACHE_MAX_ENTRIES
+        self.max_entries = max_entries
+        self.spilled = 0
+        self._entries: OrderedDict[int, int] = OrderedDict()
+        self._spill: sqlite3.Connection | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries) + self.spilled
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._entries or self._unspill(key)
+
+    def get(self, key: int, default: int = None) -> int | None:
+        if key not in self:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def __setitem__(self, key: int, value: int):
+        if key not in self._entries:
+            self._unspill(key)
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._spill_entries()
+
+    def _spill_entries(self):
+        """Move the coldest tenth of the entries to the spill database"""
+        if self._spill is None:
+            # an empty name creates a temporary database removed on close
+            self._spill = sqlite3.connect("")
+            self._spill.execute(
+                "CREATE TABLE entries "
+                "(key INTEGER PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+        count = len(self._entries) - max(int(self.max_entries * 0.9), 1)
+        cold = [self._entries.popitem(last=False) for _ in range(count)]
+        self._spill.executemany("INSERT INTO entries VALUES (?, ?)", cold)
+        self.spilled += len(cold)
+
+    def _unspill(self, key: int) -> bool:
+        if not self.spilled:
+            return False
+        row = self._spill.execute(
+            "DELETE FROM entries WHERE key = ? RETURNING value", (key,)
+        ).fetchone()
+        if row is None:
+            return False
+        self.spilled -= 1
+        self._entries[key] = row[0]
+        if len(self._entries) > self.max_entries:
+            self._spill_entries()
+        return True
+
+    def items(self) -> Iterator[tuple[int, int]]:
+        """Iterate over all entries, without moving spilled ones to memory"""
+        yield from self._entries.items()
+        if self.spilled:
+            yield from self._spill.execute("SELECT key, value FROM entries")
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self._entries.clear()
+        self.spilled = 0
 
 
 class BaseCache:
@@ -111,6 +946,10 @@ class BaseCache:
         self.csv_field_header = csv_field_header
         self._cache = None
 
+    def __contains__(self, value: str | int) -> bool:
+        """Whether the value was already looked up"""
+        return value in self._cache
+
     def add_items(self, items: list):
         """Query for items to cache"""
         qs = self.model.objects.filter(**{f"{self.lookup_field}__in": items})
@@ -122,59 +961,152 @@ class BaseCache:
 
     def build_cache_for_batch(self, rows: list[dict]):
         """Build cache for the given batch"""
-        items = []
-        for row_data in rows:
-            value = row_data.get(self.csv_field_header)
+        self.build_cache_for_values(
+            row_data.get(self.csv_field_header) for row_data in rows
+        )
+
+    def build_cache_for_values(self, values: Iterable):
+        """Build cache for the given lookup values"""
+        items = set()
+        for value in values:
             if (
                 value
-                and value not in self._cache.keys()
                 and type(value) == self.lookup_field_type
+                and value not in items
+                and value not in self
             ):
-                items.append(row_data[self.csv_field_header])
-        self.add_items(items)
+                items.add(value)
+        if items:
+            self.add_items(list(items))
+
+    def close(self):
+        pass
 
 
 class PortfolioCache(BaseCache):
     """Cache total quantity available for a user. Used for checking if user
-    has available quantity when placing SELL orders
+    has available quantity when placing SELL orders. Quantities are kept
+    per packed (user_id, stock_id) key.
     """
 
     def __init__(
         self,
-        model: Order = Order,
+        model: Position = Position,
         lookup_field: str = "user_id",
         lookup_field_type: str | int = int,
         csv_field_header: str = "user",
+        track_deltas: bool = True,
     ):
         super().__init__(
             model, lookup_field, lookup_field_type, csv_field_header
         )
-        self._cache: defaultdict[int, dict[str, int]] = defaultdict(
-            lambda: defaultdict(int)
-        )
+        self._cache: SpillDict = SpillDict()
+        # users whose positions were loaded
+        self._users: SpillDict = SpillDict()
+        # quantity changes applied since the cache was loaded, only needed
+        # for checkpoints
+        self.track_deltas = track_deltas
+        self._deltas: SpillDict = SpillDict()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def add_items(self, items: list):
+        super().add_items(items)
+        for user_id in items:
+            self._users[user_id] = 1
 
     def build_cache(self, queryset: QuerySet):
-        query = queryset.annotate_total_quantity_user_stock().order_by(
-            "-total_quantity"
-        )
-        for values in query:
-            self._cache[values["user_id"]][values["stock__symbol"]] = values[
-                "total_quantity"
-            ]
+        query = queryset.values_list("user_id", "stock_id", "quantity")
+        for user_id, stock_id, quantity in query.iterator():
+            self._cache[pack_key(user_id, stock_id)] = quantity
+
+    def preload(self, pairs: Iterable[tuple[int, int]]):
+        """Load the balances of all (user_id, stock_id) pairs with a single
+        query, joining the positions with the pairs copied to a temporary
+        table. Users already loaded are skipped.
+        """
+        pairs = [(user_id, stock_id) for user_id, stock_id in pairs]
+        pairs = [pair for pair in pairs if pair[0] not in self]
+        if not pairs:
+            return
+        table = connection.ops.quote_name("portfolio_cache_pairs")
+        with transaction.atomic(), connection.cursor() as cursor:
+            # dropped on rollback as well, DDL is transactional
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {table} "
+                "(user_id bigint NOT NULL, stock_id bigint NOT NULL)"
+            )
+            if connection.vendor == "postgresql":
+                buffer = io.StringIO(
+                    "".join(
+                        f"{user_id}\t{stock_id}\n"
+                        for user_id, stock_id in pairs
+                    )
+                )
+                cursor.copy_expert(f"COPY {table} FROM STDIN", buffer)
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {table} VALUES (%s, %s)", pairs
+                )
+            cursor.execute(
+                "SELECT position.user_id, position.stock_id, position.quantity "
+                f"FROM {connection.ops.quote_name(self.model._meta.db_table)} "
+                f"position JOIN {table} pair "
+                "ON pair.user_id = position.user_id "
+                "AND pair.stock_id = position.stock_id"
+            )
+            for user_id, stock_id, quantity in cursor:
+                self._cache[pack_key(user_id, stock_id)] = quantity
+            cursor.execute(f"DROP TABLE {table}")
+        for user_id in {user_id for user_id, _ in pairs}:
+            self._users[user_id] = 1
 
     def find(
-        self, user_id: int, stock_symbol: str, quantity: int
+        self, user_id: int, stock_id: int, quantity: int
     ) -> Tuple[bool, int]:
-        """From given user and stock symbol, get available quantity"""
-        if quantity < 0:
-            if -quantity > self._cache[user_id][stock_symbol]:
-                return False, self._cache[user_id][stock_symbol]
-        self._cache[user_id][stock_symbol] += quantity
-        return True, self._cache[user_id][stock_symbol]
+        """From given user and stock, get available quantity"""
+        available = self.get(user_id, stock_id)
+        if quantity < 0 and -quantity > available:
+            return False, available
+        self.add(user_id, stock_id, quantity)
+        return True, available + quantity
+
+    def get(self, user_id: int, stock_id: int) -> int:
+        return self._cache.get(pack_key(user_id, stock_id), 0)
+
+    def add(self, user_id: int, stock_id: int, quantity: int):
+        """Apply a quantity change without checking the balance"""
+        key = pack_key(user_id, stock_id)
+        self._cache[key] = self._cache.get(key, 0) + quantity
+        if self.track_deltas:
+            self._deltas[key] = self._deltas.get(key, 0) + quantity
+
+    def get_deltas(self) -> dict[str, dict[str, int]]:
+        """Quantity changes applied to the cache, in a JSON friendly format"""
+        deltas = defaultdict(dict)
+        for key, quantity in self._deltas.items():
+            user_id, stock_id = unpack_key(key)
+            deltas[str(user_id)][str(stock_id)] = quantity
+        return dict(deltas)
+
+    def restore_deltas(self, deltas: dict[str, dict[str, int]]):
+        """Load balances for the users in `deltas` and reapply the changes"""
+        self.build_cache_for_values(int(user_id) for user_id in deltas)
+        for user_id, quantities in deltas.items():
+            for stock_id, quantity in quantities.items():
+                self.add(int(user_id), int(stock_id), quantity)
+
+    def close(self):
+        self._cache.close()
+        self._users.close()
+        self._deltas.close()
 
 
 class UserCache(BaseCache):
-    """Cache for existing users"""
+    """Cache of existing user ids. Ids of missing users are cached as well
+    so they are only looked up once.
+    """
 
     def __init__(
         self,
@@ -186,18 +1118,104 @@ class UserCache(BaseCache):
         super().__init__(
             model, lookup_field, lookup_field_type, csv_field_header
         )
-        self._cache: defaultdict[int, User | None] = defaultdict(lambda: None)
+        # 1 for existing users, 0 for missing ones
+        self._cache: SpillDict = SpillDict()
+
+    def add_items(self, items: list):
+        for user_id in items:
+            self._cache[user_id] = 0
+        super().add_items(items)
 
     def build_cache(self, queryset: QuerySet):
-        for user in queryset:
-            self._cache[user.id] = user
+        for user_id in queryset.values_list("id", flat=True).iterator():
+            self._cache[user_id] = 1
+
+    def find(self, user_id: int) -> int | None:
+        """Id of the user if it exists"""
+        if self._cache.get(user_id):
+            return user_id
+        return None
+
+    def close(self):
+        self._cache.close()
+
+
+StockInfo = namedtuple("StockInfo", ["id", "symbol", "price"])
+
+
+def get_stock_symbols_version() -> int:
+    return caches[settings.STOCK_SYMBOLS_CACHE].get(
+        STOCK_SYMBOLS_VERSION_KEY, 0
+    )
+
+
+def bump_stock_symbols_version() -> int:
+    """Tell every process that stocks changed"""
+    cache = caches[settings.STOCK_SYMBOLS_CACHE]
+    cache.add(STOCK_SYMBOLS_VERSION_KEY, 0, timeout=None)
+    try:
+        return cache.incr(STOCK_SYMBOLS_VERSION_KEY)
+    except ValueError:
+        # expired between add and incr
+        cache.set(STOCK_SYMBOLS_VERSION_KEY, 1, timeout=None)
+        return 1
 
-    def find(self, user_id: int) -> User:
-        return self._cache[user_id]
+
+class StockSymbols:
+    """Process wide map of stock symbols to ids and prices. The stock table
+    is small and rarely changes, so it is loaded at once and reloaded after
+    `Stock` signals invalidate it or another process bumps the shared
+    version. Symbols are not unique, the newest stock wins.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._by_symbol: dict[str, StockInfo] | None = None
+        self._by_id: dict[int, StockInfo] = {}
+
+    def load(self):
+        # read the version first, changes made while loading reload again
+        version = get_stock_symbols_version()
+        by_symbol = {}
+        by_id = {}
+        stocks = Stock.objects.order_by("id").values_list(
+            "id", "symbol", "price"
+        )
+        for stock in map(StockInfo._make, stocks):
+            by_symbol[stock.symbol] = stock
+            by_id[stock.id] = stock
+        self._by_symbol, self._by_id = by_symbol, by_id
+        self.version = version
+
+    def invalidate(self):
+        self._by_symbol = None
+
+    def refresh(self):
+        """Reload when invalidated or changed by another process"""
+        if (
+            self._by_symbol is None
+            or self.version != get_stock_symbols_version()
+        ):
+            self.load()
+
+    def get(self, symbol: str) -> StockInfo | None:
+        if self._by_symbol is None:
+            self.load()
+        return self._by_symbol.get(symbol)
+
+    def get_by_id(self, stock_id: int) -> StockInfo | None:
+        if self._by_symbol is None:
+            self.load()
+        return self._by_id.get(stock_id)
+
+
+stock_symbols = StockSymbols()
 
 
 class StockCache(BaseCache):
-    """Cache for existing stocks"""
+    """Cache of stock ids by symbol, resolved from `stock_symbols` without
+    querying the database
+    """
 
     def __init__(
         self,
@@ -209,26 +1227,450 @@ class StockCache(BaseCache):
         super().__init__(
             model, lookup_field, lookup_field_type, csv_field_header
         )
-        self._cache: defaultdict[str, Stock | None] = defaultdict(lambda: None)
+        stock_symbols.refresh()
 
-    def build_cache(self, queryset: QuerySet):
-        for stock in queryset:
-            self._cache[stock.symbol] = stock
+    def build_cache_for_values(self, values: Iterable):
+        pass
+
+    def find(self, stock_symbol: str) -> int | None:
+        """Id of the stock with the symbol if it exists"""
+        stock = stock_symbols.get(stock_symbol)
+        return stock.id if stock else None
+
+    def get_symbol(self, stock_id: int) -> str:
+        return stock_symbols.get_by_id(stock_id).symbol
+
+
+def get_progress_cache_key(trade_data_file_pk: int) -> str:
+    return f"trade-data-file-progress-{trade_data_file_pk}"
+
+
+def get_shard_progress_cache_key(trade_data_file_pk: int, shard: int) -> str:
+    return f"{get_progress_cache_key(trade_data_file_pk)}-shard-{shard}"
+
+
+class ProcessingProgress:
+    """Rows and bytes processed and time spent per stage of a trade data
+    file. Published to the progress cache at most every
+    `TRADE_DATA_FILE_PROGRESS_INTERVAL` seconds instead of on every batch.
+    """
+
+    stages = ["parse", "cache", "validate", "write"]
+
+    def __init__(self, key: str, total_bytes: int = 0):
+        self.key = key
+        self.total_bytes = total_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.stage_seconds = dict.fromkeys(self.stages, 0.0)
+        self.started = time.perf_counter()
+        self.published = None
+        self.cache = caches[settings.TRADE_DATA_FILE_PROGRESS_CACHE]
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += time.perf_counter() - started
+
+    def update(self, rows: int, bytes_consumed: int, publish: bool = False):
+        self.rows = rows
+        self.bytes = bytes_consumed
+        now = time.perf_counter()
+        if (
+            publish
+            or self.published is None
+            or now - self.published
+            >= settings.TRADE_DATA_FILE_PROGRESS_INTERVAL
+        ):
+            self.published = now
+            self.cache.set(
+                self.key,
+                self.as_dict(),
+                settings.TRADE_DATA_FILE_PROGRESS_TIMEOUT,
+            )
+
+    def as_dict(self) -> dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        eta = None
+        if self.bytes:
+            eta = elapsed * (self.total_bytes - self.bytes) / self.bytes
+        return {
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed else 0,
+            "stage_seconds": {
+                stage: round(seconds, 3)
+                for stage, seconds in self.stage_seconds.items()
+            },
+            "eta_seconds": None if eta is None else round(max(eta, 0), 1),
+        }
+
+    @classmethod
+    def get(cls, trade_data_file_pk: int) -> dict[str, Any] | None:
+        """Progress of a file, the progress of sharded files is summed
+        over their shards
+        """
+        key = get_progress_cache_key(trade_data_file_pk)
+        shard_keys = [
+            get_shard_progress_cache_key(trade_data_file_pk, shard)
+            for shard in range(settings.TRADE_DATA_FILE_SHARDS)
+        ]
+        entries = caches[settings.TRADE_DATA_FILE_PROGRESS_CACHE].get_many(
+            [key, *shard_keys]
+        )
+        shard_entries = [entries[key] for key in shard_keys if key in entries]
+        if not shard_entries:
+            return entries.get(key)
+        return cls.combine(shard_entries)
+
+    @classmethod
+    def combine(cls, entries: list[dict[str, Any]]) -> dict[str, Any]:
+        """Sum the progress of shards processed side by side"""
+        rows = sum(entry["rows"] for entry in entries)
+        bytes_consumed = sum(entry["bytes"] for entry in entries)
+        total_bytes = sum(entry["total_bytes"] for entry in entries)
+        elapsed = max(entry["elapsed_seconds"] for entry in entries)
+        eta = None
+        if bytes_consumed:
+            eta = elapsed * (total_bytes - bytes_consumed) / bytes_consumed
+        return {
+            "rows": rows,
+            "bytes": bytes_consumed,
+            "total_bytes": total_bytes,
+            "elapsed_seconds": elapsed,
+            "rows_per_second": round(rows / elapsed, 1) if elapsed else 0,
+            "stage_seconds": {
+                stage: round(
+                    sum(entry["stage_seconds"][stage] for entry in entries), 3
+                )
+                for stage in cls.stages
+            },
+            "eta_seconds": None if eta is None else round(max(eta, 0), 1),
+        }
+
+
+class OrderWriter:
+    """Base class for writing validated order values to the database"""
+
+    name: str = None
+
+    def __init__(self, model: Any = Order, defaults: dict[str, Any] = None):
+        self.model = model
+        self.defaults = defaults or {}
+        self.rows_written = 0
+        self.elapsed = 0.0
+
+    def write(self, orders: list[dict[str, Any]]):
+        started = time.perf_counter()
+        if self.defaults:
+            orders = [{**self.defaults, **values} for values in orders]
+        self._write(orders)
+        self.elapsed += time.perf_counter() - started
+        self.rows_written += len(orders)
+
+    def _write(self, orders: list[dict[str, Any]]):
+        raise NotImplementedError
+
+    @property
+    def rows_per_second(self) -> float:
+        if not self.elapsed:
+            return 0.0
+        return self.rows_written / self.elapsed
+
+
+class BulkCreateOrderWriter(OrderWriter):
+    """Write orders with ``bulk_create``. Works on every database backend"""
+
+    name = "bulk_create"
+
+    def _write(self, orders: list[dict[str, Any]]):
+        self.model.objects.bulk_create(
+            [self.model(**values) for values in orders]
+        )
+
+
+class CopyOrderWriter(OrderWriter):
+    """Stream orders with PostgreSQL ``COPY FROM STDIN`` in text format,
+    skipping model instance construction and INSERT statement generation
+    """
+
+    name = "copy"
+
+    def __init__(self, model: Any = Order, defaults: dict[str, Any] = None):
+        super().__init__(model, defaults)
+        self.fields = [
+            field
+            for field in model._meta.concrete_fields
+            if not field.primary_key
+        ]
+        columns = ", ".join(
+            connection.ops.quote_name(field.column) for field in self.fields
+        )
+        self.copy_sql = (
+            f"COPY {connection.ops.quote_name(model._meta.db_table)} "
+            f"({columns}) FROM STDIN"
+        )
+
+    def _get_value(self, field: Any, values: dict[str, Any], now: Any):
+        if field.attname in values:
+            return values[field.attname]
+        if field.name in values:
+            value = values[field.name]
+            return value.pk if field.is_relation else value
+        if getattr(field, "auto_now", False) or getattr(
+            field, "auto_now_add", False
+        ):
+            return now
+        return field.get_default()
+
+    def _to_text(self, value: Any) -> str:
+        if value is None:
+            return "\\N"
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    def _write(self, orders: list[dict[str, Any]]):
+        now = timezone.now()
+        buffer = io.StringIO()
+        for values in orders:
+            buffer.write(
+                "\t".join(
+                    self._to_text(self._get_value(field, values, now))
+                    for field in self.fields
+                )
+            )
+            buffer.write("\n")
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(self.copy_sql, buffer)
+
+
+ORDER_WRITERS = {
+    BulkCreateOrderWriter.name: BulkCreateOrderWriter,
+    CopyOrderWriter.name: CopyOrderWriter,
+}
+
+
+def get_order_writer(
+    backend: str = None,
+    model: Any = Order,
+    defaults: dict[str, Any] = None,
+) -> OrderWriter:
+    """Get writer for the configured backend. ``COPY`` is only available on
+    PostgreSQL, other databases fall back to ``bulk_create``
+    """
+    backend = backend or settings.TRADE_DATA_FILE_WRITE_BACKEND
+    if backend == CopyOrderWriter.name and connection.vendor != "postgresql":
+        backend = BulkCreateOrderWriter.name
+    return ORDER_WRITERS[backend](model, defaults)
+
+
+class OrderIntakeUnavailable(Exception):
+    """The order was not accepted in time and will not be committed, it's
+    safe to retry with the same idempotency key
+    """
+
+
+class GroupCommitOrderWriter:
+    """Coalesce orders placed by concurrent API requests into micro-batches
+    committed by one writer thread, so many orders share a single commit.
+    A batch is committed after `ORDER_GROUP_COMMIT_MAX_BATCH` orders or
+    `ORDER_GROUP_COMMIT_MAX_DELAY` seconds, callers wait for the commit of
+    their batch.
+    """
+
+    def __init__(
+        self,
+        max_batch: int = None,
+        max_delay: float = None,
+        queue_size: int = None,
+        timeout: float = None,
+    ):
+        self.max_batch = max_batch or settings.ORDER_GROUP_COMMIT_MAX_BATCH
+        self.max_delay = max_delay or settings.ORDER_GROUP_COMMIT_MAX_DELAY
+        self.timeout = timeout or settings.ORDER_GROUP_COMMIT_TIMEOUT
+        self.queue: queue.Queue = queue.Queue(
+            queue_size or settings.ORDER_GROUP_COMMIT_QUEUE_SIZE
+        )
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="order-group-commit", daemon=True
+                )
+                self.thread.start()
 
-    def find(self, stock_symbol: str) -> Stock:
-        return self._cache[stock_symbol]
+    def submit(self, user: User, values: dict[str, Any]) -> Future:
+        """Queue an order, the bounded queue pushes back when full"""
+        self.start()
+        future = Future()
+        try:
+            self.queue.put((user, values, future), timeout=self.timeout)
+        except queue.Full:
+            raise OrderIntakeUnavailable("Order queue is full.")
+        return future
+
+    def place(self, user: User, values: dict[str, Any]) -> Order:
+        """Place an order and wait until its batch is committed. Orders
+        still queued after the timeout are cancelled, an order whose batch is
+        already being committed is waited for.
+        """
+        future = self.submit(user, values)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # cancelled orders are dropped by `commit`
+            if future.cancel():
+                raise OrderIntakeUnavailable("Order was not committed in time.")
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            close_old_connections()
+            self.commit(batch)
+
+    def commit(self, batch: list[tuple[User, dict[str, Any], Future]]):
+        batch = [
+            item for item in batch if item[2].set_running_or_notify_cancel()
+        ]
+        try:
+            try:
+                results = self.write(batch)
+            except IntegrityError:
+                # an idempotency key was committed concurrently, the retry
+                # returns the order created with it
+                results = self.write(batch)
+        except Exception as e:
+            logger.exception("Failed to commit %s orders", len(batch))
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def write(
+        self, batch: list[tuple[User, dict[str, Any], Future]]
+    ) -> list[Order | InsufficientBalance]:
+        """Create the orders of every user in the batch in one transaction"""
+        results = [None] * len(batch)
+        indexes_by_user = defaultdict(list)
+        for index, (user, _, _) in enumerate(batch):
+            indexes_by_user[user.pk].append(index)
+        with transaction.atomic():
+            # sorted so concurrent writers lock positions in the same order
+            for _, indexes in sorted(indexes_by_user.items()):
+                user = batch[indexes[0]][0]
+                orders = Order.objects.create_batch(
+                    user, [batch[index][1] for index in indexes]
+                )
+                for index, result in zip(indexes, orders):
+                    results[index] = result
+        return results
+
+
+_group_commit_writer: GroupCommitOrderWriter | None = None
+_group_commit_writer_lock = threading.Lock()
+
+
+def get_group_commit_writer() -> GroupCommitOrderWriter:
+    """Group commit writer of the process, started on first use"""
+    global _group_commit_writer
+    with _group_commit_writer_lock:
+        if _group_commit_writer is None:
+            _group_commit_writer = GroupCommitOrderWriter()
+    return _group_commit_writer
 
 
 class TradeDataFileProcessor:
-    def __init__(self, trade_data_file: TradeDataFile):
+    def __init__(
+        self,
+        trade_data_file: TradeDataFile,
+        write_backend: str = None,
+        use_staging: bool = None,
+        parse_workers: int = None,
+        columnar: bool = None,
+        csv_file: str = None,
+    ):
         self.trade_data_file = trade_data_file
-        self.parser: CSVParser = CSVParser(
-            self.trade_data_file.uploaded_file.path
-        )
-        self.portfolio_cache: PortfolioCache = PortfolioCache()
+        self.csv_file = csv_file or trade_data_file.uploaded_file.path
+        self.file_format = detect_file_format(self.csv_file)
+        if parse_workers is None:
+            parse_workers = settings.TRADE_DATA_FILE_PARSE_WORKERS
+        if columnar is None:
+            columnar = settings.TRADE_DATA_FILE_COLUMNAR
+        # typed formats are always read as columns
+        self.columnar = columnar or self.file_format != CSV_FORMAT
+        self.parser: BaseParser = self.get_parser(parse_workers)
+        if use_staging is None:
+            use_staging = settings.TRADE_DATA_FILE_USE_STAGING
+        self.use_staging = use_staging
+        self.portfolio_cache: PortfolioCache = self.get_portfolio_cache()
         self.user_cache: UserCache = UserCache()
         self.stock_cache: StockCache = StockCache()
+        if self.use_staging:
+            self.writer: OrderWriter = get_order_writer(
+                write_backend,
+                model=StagedOrder,
+                defaults=self.get_staging_defaults(),
+            )
+        else:
+            self.writer: OrderWriter = get_order_writer(write_backend)
         self.batch_size = 500
+        self.columnar_batch_size = settings.TRADE_DATA_FILE_COLUMNAR_BATCH_SIZE
+        self.staging_commit_batches = (
+            settings.TRADE_DATA_FILE_STAGING_COMMIT_BATCHES
+        )
+        self.checkpoint_fields = [
+            "checkpoint_offset",
+            "checkpoint_row",
+            "checkpoint_portfolio",
+        ]
+        self.progress = ProcessingProgress(self.get_progress_key())
+
+    def get_portfolio_cache(self) -> PortfolioCache:
+        # balance changes are only saved with staging checkpoints
+        return PortfolioCache(track_deltas=self.use_staging)
+
+    def get_parser(self, parse_workers: int) -> BaseParser:
+        if self.file_format != CSV_FORMAT:
+            return ArrowParser(self.csv_file, self.file_format)
+        if self.columnar:
+            return ColumnarCSVParser(self.csv_file)
+        if parse_workers > 1:
+            return ParallelCSVParser(self.csv_file, parse_workers)
+        return CSVParser(self.csv_file)
+
+    def get_staging_defaults(self) -> dict[str, Any]:
+        return {"trade_data_file_id": self.trade_data_file.pk}
+
+    def get_staged_orders(self) -> QuerySet:
+        return StagedOrder.objects.filter(trade_data_file=self.trade_data_file)
 
     def _clean_values(self, values: dict[str, Any]) -> dict[str, Any]:
         cleaned_values = {}
@@ -248,69 +1690,507 @@ class TradeDataFileProcessor:
             cleaned_values["quantity"] = -cleaned_values["quantity"]
 
         user_id = values.get("user")
-        user = self.user_cache.find(user_id)
-        if not user:
+        if not self.user_cache.find(user_id):
             raise InvalidImportFile(f"User ({user_id}) not found.")
         else:
-            cleaned_values["user"] = user
+            cleaned_values["user_id"] = user_id
 
         stock_symbol = values.get("stock")
-        stock = self.stock_cache.find(stock_symbol)
-        if not stock:
+        stock_id = self.stock_cache.find(stock_symbol)
+        if not stock_id:
             raise InvalidImportFile(f"Stock (symbol={stock_symbol}) not found.")
         else:
-            cleaned_values["stock"] = stock
+            cleaned_values["stock_id"] = stock_id
 
         return cleaned_values
 
     def _validate_order(self, values: dict[str, Any]):
-        symbol = values["stock"].symbol
-        user_id = values["user"].id
         allowed, quantity = self.portfolio_cache.find(
-            user_id=user_id,
-            stock_symbol=symbol,
+            user_id=values["user_id"],
+            stock_id=values["stock_id"],
             quantity=values["quantity"],
         )
         if not allowed:
+            symbol = self.stock_cache.get_symbol(values["stock_id"])
             raise InvalidImportFile(
                 f"Failed to process order. Not enough stock balance "
                 f"for {symbol}. Stock available: {quantity}"
             )
 
+    def preload_portfolio(self):
+        """Pre-pass collecting the (user, stock) pairs of the whole file to
+        load their balances at once instead of per batch
+        """
+        if not settings.TRADE_DATA_FILE_PRELOAD_PORTFOLIO:
+            return
+        with self.progress.stage("cache"):
+            pairs = set()
+            for user_id, symbol in scan_order_keys(self.csv_file):
+                stock_id = self.stock_cache.find(symbol)
+                if type(user_id) is int and stock_id:
+                    pairs.add((user_id, stock_id))
+            self.portfolio_cache.preload(pairs)
+
     def _build_caches_for_data_batch(self, rows: list):
         self.portfolio_cache.build_cache_for_batch(rows)
         self.user_cache.build_cache_for_batch(rows)
         self.stock_cache.build_cache_for_batch(rows)
 
-    def process(self):
-        self.set_to_processing()
-        with transaction.atomic():
-            for batch in ichunked(self.parser, self.batch_size):
+    def iter_order_batches(self) -> Iterator[list[dict[str, Any]]]:
+        """Parse, clean and validate the file, yielding orders per batch"""
+        progress = self.progress
+        if self.columnar:
+            cleaner = OrderColumnsCleaner(
+                self.user_cache, self.stock_cache, self.portfolio_cache
+            )
+            batches = self.parser.iter_batches(self.columnar_batch_size)
+            while True:
+                with progress.stage("parse"):
+                    columns = next(batches, None)
+                if columns is None:
+                    return
+                # caches are built inside the vectorized validation
+                with progress.stage("validate"):
+                    orders = cleaner.clean(columns)
+                yield orders
+
+        for batch in ichunked(self.parser, self.batch_size):
+            with progress.stage("parse"):
                 rows = [row for row in batch]
+            with progress.stage("cache"):
                 self._build_caches_for_data_batch(rows)
-                orders = []
+            orders = []
+            with progress.stage("validate"):
                 for values in rows:
                     cleaned_values = self._clean_values(values)
                     self._validate_order(cleaned_values)
-                    orders.append(Order(**cleaned_values))
+                    orders.append(cleaned_values)
+
+            if len(orders) > 0:
+                yield orders
+
+    def _iter_rows(self) -> Iterator[dict[str, Any] | InvalidImportFile]:
+        """Yield the values of each row, or the error of a row that can't
+        be parsed so the rows after it are still checked
+        """
+        if isinstance(self.parser, CSVParser):
+            rows = iter(self.parser)
+            while True:
+                try:
+                    yield next(rows)
+                except StopIteration:
+                    return
+                except UnicodeDecodeError:
+                    # the lines after it can't be read either
+                    raise
+                except IndexError:
+                    yield InvalidImportFile("Row is missing values")
+                except ValueError as e:
+                    yield InvalidImportFile(f"Invalid row: {e}")
+        for columns in self.parser.iter_batches(self.columnar_batch_size):
+            values = [column_to_list(column) for column in columns.values()]
+            for row in zip(*values):
+                yield dict(
+                    zip(columns, (parse_value(str(value)) for value in row))
+                )
+
+    def _iter_rows_until_file_error(
+        self, file_errors: list[str]
+    ) -> Iterator[dict[str, Any] | InvalidImportFile]:
+        """Rows of `_iter_rows` up to the first file level error, such as
+        missing headers, bytes that aren't UTF-8 or a truncated archive. The
+        error is added to `file_errors` so the rows read before it are still
+        checked.
+        """
+        try:
+            yield from self._iter_rows()
+        except UnicodeDecodeError as e:
+            file_errors.append(f"File is not UTF-8 encoded: {e}")
+        except FILE_READ_ERRORS as e:
+            file_errors.append(str(e) or e.__class__.__name__)
+
+    def dry_run(self) -> dict[str, Any]:
+        """Validate the whole file against current holdings without writing
+        anything. All invalid rows are reported, up to
+        `TRADE_DATA_FILE_DRY_RUN_MAX_ERRORS`, and don't change the balances
+        checked for the rows after them.
+        """
+        rows = 0
+        errors = []
+        error_count = 0
+        file_errors = []
+        if self.file_format == CSV_FORMAT:
+            # rows are parsed one by one so each bad row is reported alone
+            self.parser = CSVParser(self.csv_file)
+        try:
+            self.preload_portfolio()
+            rows_iter = self._iter_rows_until_file_error(file_errors)
+            for batch in ichunked(rows_iter, self.batch_size):
+                rows_batch = [row for row in batch]
+                self._build_caches_for_data_batch(
+                    [row for row in rows_batch if isinstance(row, dict)]
+                )
+                for values in rows_batch:
+                    rows += 1
+                    try:
+                        if isinstance(values, InvalidImportFile):
+                            raise values
+                        self._validate_order(self._clean_values(values))
+                    except InvalidImportFile as e:
+                        error_count += 1
+                        if (
+                            len(errors)
+                            < settings.TRADE_DATA_FILE_DRY_RUN_MAX_ERRORS
+                        ):
+                            errors.append({"row": rows, "error": str(e)})
+        finally:
+            self.close()
+        for error in file_errors:
+            error_count += 1
+            errors.append({"row": None, "error": error})
+        return {"rows": rows, "error_count": error_count, "errors": errors}
+
+    def write_orders(self, orders: list[dict[str, Any]]):
+        with self.progress.stage("write"):
+            self.writer.write(orders)
+            if not self.use_staging:
+                Position.objects.apply_deltas(self.get_position_deltas(orders))
+        self.progress.update(
+            self.parser.row_number, self.parser.bytes_consumed()
+        )
+
+    def expire_responses_on_commit(self):
+        """Expire cached lists once per file, after its orders are visible
+        to other processes
+        """
+        transaction.on_commit(
+            partial(bump_response_versions, [FILES_SCOPE, USERS_SCOPE])
+        )
+
+    def start_progress(self):
+        if default_storage.exists(self.csv_file):
+            self.progress.total_bytes = default_storage.size(self.csv_file)
+        self.progress.update(0, 0, publish=True)
+
+    def finish_progress(self):
+        if self.parser.reader is not None:
+            self.progress.update(
+                self.parser.row_number,
+                self.parser.bytes_consumed(),
+                publish=True,
+            )
+
+    def close(self):
+        self.parser.close()
+        self.portfolio_cache.close()
+        self.user_cache.close()
+        self.stock_cache.close()
+
+    def process(self):
+        if not self.set_to_processing():
+            logger.info(
+                "Trade data file %s: already finished", self.trade_data_file.pk
+            )
+            self.close()
+            return
+        self.start_progress()
+        try:
+            self.preload_portfolio()
+            if self.use_staging:
+                self.stage()
+                self.publish()
+            else:
+                with transaction.atomic():
+                    # waits for a concurrent run of the same file to finish
+                    if not self.lock_processing():
+                        logger.info(
+                            "Trade data file %s: already processed",
+                            self.trade_data_file.pk,
+                        )
+                        return
+                    for orders in self.iter_order_batches():
+                        self.write_orders(orders)
+                    self.expire_responses_on_commit()
+                    self.set_to_processed()
+        finally:
+            self.finish_progress()
+            self.close()
+        self.log_throughput()
+
+    def stage(self):
+        """Write orders to the staging table, committing every
+        `staging_commit_batches` batches together with a checkpoint so an
+        interrupted run can continue from the last commit. Staged rows are
+        dropped if the file is invalid.
+        """
+        if not self.resume_from_checkpoint():
+            self.discard_staged_orders()
+        try:
+            batches = self.iter_order_batches()
+            while True:
+                with transaction.atomic():
+                    written = 0
+                    for orders in islice(batches, self.staging_commit_batches):
+                        self.write_orders(orders)
+                        written += 1
+                    if not written:
+                        break
+                    self.save_checkpoint()
+        except ParserException:
+            self.discard_staged_orders()
+            raise
 
-                if len(orders) > 0:
-                    Order.objects.bulk_create(orders)
-            transaction.on_commit(self.set_to_processed)
+    def resume_from_checkpoint(self) -> bool:
+        if not self.trade_data_file.checkpoint_row:
+            return False
+        logger.info(
+            "Trade data file %s: resuming from row %s",
+            self.trade_data_file.pk,
+            self.trade_data_file.checkpoint_row,
+        )
+        self.parser.seek(
+            self.trade_data_file.checkpoint_offset,
+            self.trade_data_file.checkpoint_row,
+        )
+        self.portfolio_cache.restore_deltas(
+            self.trade_data_file.checkpoint_portfolio or {}
+        )
+        return True
+
+    def save_checkpoint(self):
+        self.trade_data_file.checkpoint_offset = self.parser.offset
+        self.trade_data_file.checkpoint_row = self.parser.row_number
+        self.trade_data_file.checkpoint_portfolio = (
+            self.portfolio_cache.get_deltas()
+        )
+        self.trade_data_file.save(update_fields=self.checkpoint_fields)
+
+    def clear_checkpoint(self):
+        self.trade_data_file.checkpoint_offset = 0
+        self.trade_data_file.checkpoint_row = 0
+        self.trade_data_file.checkpoint_portfolio = None
+
+    def publish(self):
+        """Move staged orders to `Order` with one set-based statement. Only
+        done once, a redelivered task finding the file already published just
+        drops its staged orders.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            if not self.lock_processing():
+                logger.info(
+                    "Trade data file %s: already published",
+                    self.trade_data_file.pk,
+                )
+                self.delete_staged_orders()
+                return
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {Order._meta.db_table} "
+                    "(created, modified, user_id, stock_id, quantity, "
+                    "order_type) "
+                    "SELECT %s, %s, user_id, stock_id, quantity, order_type "
+                    f"FROM {StagedOrder._meta.db_table} "
+                    "WHERE trade_data_file_id = %s ORDER BY id",
+                    [now, now, self.trade_data_file.pk],
+                )
+            staged_positions = (
+                self.get_staged_orders()
+                .values_list("user_id", "stock_id")
+                .annotate(Sum("quantity"))
+            )
+            Position.objects.apply_deltas(
+                {
+                    (user_id, stock_id): quantity
+                    for user_id, stock_id, quantity in staged_positions
+                }
+            )
+            self.expire_responses_on_commit()
+            self.delete_staged_orders()
+            self.set_to_processed()
+
+    def lock_processing(self) -> bool:
+        """Lock the file row, returns whether it is still processing"""
+        return (
+            TradeDataFile.objects.select_for_update()
+            .filter(pk=self.trade_data_file.pk, status=TradeDataFile.PROCESSING)
+            .exists()
+        )
+
+    def get_position_deltas(
+        self, orders: list[dict[str, Any]]
+    ) -> dict[tuple[int, int], int]:
+        deltas = defaultdict(int)
+        for values in orders:
+            deltas[(values["user_id"], values["stock_id"])] += values[
+                "quantity"
+            ]
+        return deltas
+
+    def delete_staged_orders(self):
+        self.get_staged_orders().delete()
+
+    def discard_staged_orders(self):
+        """Drop staged orders together with the checkpoint pointing to them"""
+        self.delete_staged_orders()
+        if self.trade_data_file.checkpoint_row:
+            self.clear_checkpoint()
+            self.trade_data_file.save(update_fields=self.checkpoint_fields)
+
+    def get_shard_dir(self) -> str:
+        return default_storage.path(
+            os.path.join(
+                settings.CSV_UPLOAD_PATH,
+                "shards",
+                str(self.trade_data_file.pk),
+            )
+        )
+
+    def split_into_shards(self, shards: int) -> list[str]:
+        """Partition the rows of the file by user id into shard files, all
+        rows of a user end up in the same shard. Returns the shard file paths.
+        """
+        self.set_to_processing()
+        shard_dir = self.get_shard_dir()
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_files = [
+            os.path.join(shard_dir, f"{shard}.csv") for shard in range(shards)
+        ]
+        parser = CSVParser(self.csv_file)
+        with ExitStack() as stack:
+            stack.callback(parser.close)
+            parser.open()
+            user_idx = parser.headers_indexes_dict["user"]
+            writers = [
+                csv.writer(
+                    stack.enter_context(
+                        open(path, "w", newline="", encoding="utf-8")
+                    )
+                )
+                for path in shard_files
+            ]
+            for writer in writers:
+                writer.writerow(parser.headers)
+            for row in parser.reader:
+                user_id = (
+                    parse_value(row[user_idx]) if len(row) > user_idx else None
+                )
+                # rows with invalid users fail in the first shard
+                shard = user_id % shards if isinstance(user_id, int) else 0
+                writers[shard].writerow(row)
+        return shard_files
+
+    def delete_shard_files(self):
+        shutil.rmtree(self.get_shard_dir(), ignore_errors=True)
+
+    def get_progress_key(self) -> str:
+        return get_progress_cache_key(self.trade_data_file.pk)
+
+    def log_throughput(self):
+        logger.info(
+            "Trade data file %s: wrote %s orders in %.2fs "
+            "(%.0f rows/sec) using %s writer, stage seconds: %s",
+            self.trade_data_file.pk,
+            self.writer.rows_written,
+            self.writer.elapsed,
+            self.writer.rows_per_second,
+            self.writer.name,
+            self.progress.as_dict()["stage_seconds"],
+        )
 
-    def set_to_processing(self):
+    def set_to_processing(self) -> bool:
+        """Claim the file, returns False if it is already finished"""
+        if not TradeDataFile.objects.claim(self.trade_data_file.pk):
+            return False
         self.trade_data_file.status = TradeDataFile.PROCESSING
-        self.trade_data_file.save(update_fields=["status"])
+        return True
 
     def set_to_processed(self):
         self.trade_data_file.status = TradeDataFile.PROCESSED
         self.trade_data_file.completed_at = timezone.now()
-        self.trade_data_file.save(update_fields=["status", "completed_at"])
+        self.clear_checkpoint()
+        self.trade_data_file.save(
+            update_fields=["status", "completed_at", *self.checkpoint_fields]
+        )
 
     def set_to_failed(self, errors: str):
+        if self.use_staging:
+            self.delete_staged_orders()
         self.trade_data_file.status = TradeDataFile.FAILED
         self.trade_data_file.completed_at = timezone.now()
         self.trade_data_file.errors = errors
+        self.clear_checkpoint()
         self.trade_data_file.save(
-            update_fields=["status", "errors", "completed_at"]
+            update_fields=[
+                "status",
+                "errors",
+                "completed_at",
+                *self.checkpoint_fields,
+            ]
+        )
+
+
+def dry_run_trade_data_file(file: File) -> dict[str, Any]:
+    """Validate an uploaded file without creating a `TradeDataFile`"""
+    name = default_storage.save(
+        os.path.join(
+            settings.CSV_UPLOAD_PATH, "dry_run", os.path.basename(file.name)
+        ),
+        file,
+    )
+    try:
+        processor = TradeDataFileProcessor(
+            TradeDataFile(), csv_file=default_storage.path(name)
         )
+        return processor.dry_run()
+    finally:
+        default_storage.delete(name)
+
+
+class TradeDataFileShardProcessor(TradeDataFileProcessor):
+    """Validate and stage the orders of one user id shard of a trade data
+    file. Balances only depend on rows of the same user, so shards are
+    processed independently. Publishing is done once all shards are staged.
+    """
+
+    def __init__(
+        self,
+        trade_data_file: TradeDataFile,
+        shard: int,
+        shard_file: str,
+        **kwargs,
+    ):
+        self.shard = shard
+        super().__init__(
+            trade_data_file, use_staging=True, csv_file=shard_file, **kwargs
+        )
+
+    def get_portfolio_cache(self) -> PortfolioCache:
+        # shards do not save checkpoints
+        return PortfolioCache(track_deltas=False)
+
+    def get_staging_defaults(self) -> dict[str, Any]:
+        return {**super().get_staging_defaults(), "shard": self.shard}
+
+    def get_staged_orders(self) -> QuerySet:
+        return super().get_staged_orders().filter(shard=self.shard)
+
+    def process(self):
+        self.start_progress()
+        try:
+            self.preload_portfolio()
+            self.stage()
+        finally:
+            self.finish_progress()
+            self.close()
+        self.log_throughput()
+
+    def get_progress_key(self) -> str:
+        return get_shard_progress_cache_key(self.trade_data_file.pk, self.shard)
+
+    def resume_from_checkpoint(self) -> bool:
+        # checkpoints are kept per file, a retried shard starts over
+        return False
+
+    def save_checkpoint(self):
+        pass
@@ -0,0 +1,83 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
+from django.dispatch import receiver
+from trading.caching import (
+    STOCKS_SCOPE,
+    bump_response_versions,
+    bump_user_response_versions,
+)
+from trading.models import (
+    Order,
+    Position,
+    Stock,
+)
+from trading.services import (
+    bump_stock_symbols_version,
+    stock_symbols,
+)
+
+
+@receiver(post_save, sender=Order)
+def add_order_to_position(
+    sender, instance: Order, created: bool, raw: bool, **kwargs
+):
+    if created and not raw and not getattr(instance, "position_applied", False):
+        Position.objects.apply_deltas(
+            {(instance.user_id, instance.stock_id): instance.quantity}
+        )
+
+
+def is_owner_delete(origin) -> bool:
+    """Whether a delete was started on a user or stock, whose positions are
+    deleted by the same cascade as its orders
+    """
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (User, Stock)
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_from_position(sender, instance: Order, origin=None, **kwargs):
+    if is_owner_delete(origin):
+        # adjusting would recreate a position for the deleted user or stock
+        return
+    Position.objects.apply_deltas(
+        {(instance.user_id, instance.stock_id): -instance.quantity}
+    )
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def expire_order_responses(sender, instance: Order, **kwargs):
+    if not kwargs.get("raw"):
+        bump_user_response_versions([instance.user_id])
+
+
+@receiver(post_save, sender=Stock)
+def refresh_position_values(
+    sender, instance: Stock, created: bool, raw: bool, update_fields, **kwargs
+):
+    if created or raw:
+        return
+    if update_fields is not None and "price" not in update_fields:
+        return
+    Position.objects.refresh_values(instance.pk, instance.price)
+
+
+def on_stocks_changed():
+    stock_symbols.invalidate()
+    bump_stock_symbols_version()
+    bump_response_versions([STOCKS_SCOPE])
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_stock_symbols(sender, instance: Stock, **kwargs):
+    # reload in this process right away, other processes after commit
+    stock_symbols.invalidate()
+    bump_response_versions([STOCKS_SCOPE])
+    transaction.on_commit(on_stocks_changed)
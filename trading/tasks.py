@@ -1,29 +1,174 @@
+import logging
 import pathlib
 import traceback
+from datetime import timedelta
 
 from celery import (
     chain,
+    chord,
+    group,
     shared_task,
 )
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_process_init
 from django.conf import settings
-from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db import transaction
-from trading.models import TradeDataFile
-from trading.services import TradeDataFileProcessor
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import (
+    DatabaseError,
+    IntegrityError,
+    transaction,
+)
+from django.utils import timezone
+from trading.models import (
+    HoldingsSnapshot,
+    TradeDataFile,
+)
+from trading.services import (
+    CSV_FORMAT,
+    TRADE_DATA_FILE_SUFFIXES,
+    TradeDataFileProcessor,
+    TradeDataFileShardProcessor,
+    compute_content_digest,
+    group_conflicting_files,
+    scan_order_keys,
+    stock_symbols,
+    store_trade_data_csv_file,
+)
 
 
-@shared_task
-def process_trade_data_file(trade_data_file_pk: int):
-    trade_data_file = TradeDataFile.objects.get(pk=trade_data_file_pk)
+logger = logging.getLogger(__name__)
+
+
+@worker_process_init.connect
+def load_stock_symbols(**kwargs):
+    """Load stock symbols once per worker process instead of per file"""
+    try:
+        stock_symbols.load()
+    except DatabaseError:
+        # loaded on first use instead
+        logger.warning("Could not load stock symbols", exc_info=True)
+
+
+@shared_task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=settings.TRADE_DATA_FILE_MAX_RESUMES,
+)
+def process_trade_data_file(self, trade_data_file_pk: int):
+    trade_data_file = get_unfinished_trade_data_file(trade_data_file_pk)
+    if trade_data_file is None:
+        return
     processor = TradeDataFileProcessor(trade_data_file)
+    shards = get_shard_count(processor)
+    shard_files = None
 
     try:
-        processor.process()
+        if shards > 1:
+            shard_files = processor.split_into_shards(shards)
+        else:
+            processor.process()
+    except SoftTimeLimitExceeded as e:
+        # staged processing continues from the last checkpoint on retry
+        if processor.use_staging and self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=0)
+        traceback.print_exc()
+        processor.set_to_failed(str(e) or "Time limit exceeded")
     except Exception as e:
         # catch all exceptions so we can mark as failed
         traceback.print_exc()
         processor.set_to_failed(str(e))
 
+    if shard_files:
+        # replacing keeps chains of conflicting files waiting for the chord
+        return self.replace(
+            chord(
+                [
+                    process_trade_data_file_shard.si(
+                        trade_data_file_pk, shard, shard_file
+                    )
+                    for shard, shard_file in enumerate(shard_files)
+                ],
+                publish_trade_data_file_shards.s(trade_data_file_pk),
+            )
+        )
+
+
+def get_unfinished_trade_data_file(
+    trade_data_file_pk: int,
+) -> TradeDataFile | None:
+    """Claim the file unless it is already processed or failed. Late acks
+    redeliver tasks that finished but weren't acknowledged, those must not
+    ingest the file again.
+    """
+    with transaction.atomic():
+        if not TradeDataFile.objects.claim(trade_data_file_pk):
+            logger.info(
+                "Skipping finished trade data file %s", trade_data_file_pk
+            )
+            return None
+        return TradeDataFile.objects.get(pk=trade_data_file_pk)
+
+
+def get_shard_count(processor: TradeDataFileProcessor) -> int:
+    # only CSV files are split into shards
+    if (
+        processor.file_format != CSV_FORMAT
+        or processor.trade_data_file.uploaded_file.size
+        < settings.TRADE_DATA_FILE_SHARD_MIN_SIZE
+    ):
+        return 1
+    return settings.TRADE_DATA_FILE_SHARDS
+
+
+@shared_task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    ignore_result=False,
+    max_retries=settings.TRADE_DATA_FILE_MAX_RESUMES,
+)
+def process_trade_data_file_shard(
+    self, trade_data_file_pk: int, shard: int, shard_file: str
+) -> str | None:
+    """Stage one shard of a trade data file, returns the error if any"""
+    trade_data_file = get_unfinished_trade_data_file(trade_data_file_pk)
+    if trade_data_file is None:
+        return None
+    processor = TradeDataFileShardProcessor(trade_data_file, shard, shard_file)
+
+    try:
+        processor.process()
+    except SoftTimeLimitExceeded as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=0)
+        traceback.print_exc()
+        return str(e) or "Time limit exceeded"
+    except Exception as e:
+        traceback.print_exc()
+        return str(e)
+
+
+@shared_task
+def publish_trade_data_file_shards(
+    shard_errors: list[str | None], trade_data_file_pk: int
+):
+    trade_data_file = TradeDataFile.objects.get(pk=trade_data_file_pk)
+    processor = TradeDataFileProcessor(trade_data_file, use_staging=True)
+
+    try:
+        errors = [error for error in shard_errors if error]
+        if errors:
+            processor.set_to_failed(errors[0])
+        else:
+            processor.publish()
+    except Exception as e:
+        traceback.print_exc()
+        processor.set_to_failed(str(e))
+    finally:
+        processor.delete_shard_files()
+
 
 @shared_task
 def fetch_trade_data_csv_file():
@@ -35,27 +180,81 @@ def fetch_trade_data_csv_file():
 
     processed_files: list[pathlib.Path] = []
     trade_data_files: list[TradeDataFile] = []
+    content_digests: set[str] = set()
     for file in files:
-        if file.suffix == ".csv":
+        if file.name.endswith(TRADE_DATA_FILE_SUFFIXES):
             processed_files.append(file)
             with file.open("rb") as f:
-                trade_data_files.append(
-                    TradeDataFile(
-                        uploaded_file=SimpleUploadedFile(file.name, f.read())
-                    )
+                content_digest = compute_content_digest(File(f))
+            if (
+                content_digest in content_digests
+                or TradeDataFile.objects.get_duplicate(content_digest)
+            ):
+                logger.info("Skipping duplicate trade data file %s", file)
+                continue
+            content_digests.add(content_digest)
+            trade_data_files.append(
+                TradeDataFile(
+                    uploaded_file=store_trade_data_csv_file(file),
+                    content_digest=content_digest,
                 )
+            )
 
-    with transaction.atomic():
-        trade_data_files = TradeDataFile.objects.bulk_create(trade_data_files)
-
-    transaction.on_commit(
-        lambda: chain(
-            *[
-                process_trade_data_file.si(trade_data_file.pk)
-                for trade_data_file in trade_data_files
-            ]
-        ).apply_async()
-    )
+    try:
+        with transaction.atomic():
+            trade_data_files = TradeDataFile.objects.bulk_create(
+                trade_data_files
+            )
+    except IntegrityError:
+        # same content uploaded concurrently, skipped on the next run
+        for trade_data_file in trade_data_files:
+            default_storage.delete(trade_data_file.uploaded_file.name)
+        raise
+
+    if trade_data_files:
+        pks = [trade_data_file.pk for trade_data_file in trade_data_files]
+        transaction.on_commit(lambda: schedule_trade_data_files.delay(pks))
 
     for file in processed_files:
         file.unlink()
+
+
+@shared_task
+def schedule_trade_data_files(trade_data_file_pks: list[int]):
+    """Process fetched files, only files touching the same (user, stock)
+    pairs are chained, the rest are processed concurrently across workers.
+    Files are scanned for their pairs here instead of in the fetch task, a
+    single file needs no scan. Files that can't be scanned run on their own,
+    if scanning fails altogether or runs out of time all files are chained.
+    """
+    groups = [trade_data_file_pks]
+    if len(trade_data_file_pks) > 1:
+        try:
+            names = dict(
+                TradeDataFile.objects.filter(
+                    pk__in=trade_data_file_pks
+                ).values_list("pk", "uploaded_file")
+            )
+            groups = group_conflicting_files(
+                {pk: scan_order_keys(names[pk]) for pk in trade_data_file_pks}
+            )
+        except Exception:
+            # one chain in fetch order is always safe, the files must not
+            # be left unscheduled
+            logger.exception(
+                "Could not group trade data files %s", trade_data_file_pks
+            )
+    group(
+        chain(*[process_trade_data_file.si(pk) for pk in pks]) for pks in groups
+    ).apply_async()
+
+
+@shared_task
+def take_holdings_snapshot():
+    now = timezone.now()
+    HoldingsSnapshot.objects.take(
+        now - timedelta(seconds=settings.HOLDINGS_SNAPSHOT_LAG)
+    )
+    HoldingsSnapshot.objects.prune(
+        now - timedelta(days=settings.HOLDINGS_SNAPSHOT_HOURLY_DAYS)
+    )
@@ -0,0 +1,91 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from trading.benchmarks import (
+    IngestionBenchmark,
+    compare_benchmark_results,
+    create_benchmark_stocks,
+    create_benchmark_users,
+    generate_trade_data_rows,
+    iter_symbols,
+)
+from trading.factories import StockFactory
+from trading.models import (
+    Order,
+    Position,
+    Stock,
+    TradeDataFile,
+)
+from trading.tests.test_services import CSVBuilderMixin
+
+
+class GenerateTradeDataTestCase(TestCase):
+    def test_create_fixtures(self):
+        StockFactory(symbol="A")
+        users = create_benchmark_users(3)
+        stocks = create_benchmark_stocks(3)
+
+        self.assertEqual(len({user.username for user in users}), 3)
+        self.assertEqual([stock.symbol for stock in stocks], ["B", "C", "D"])
+        self.assertEqual(Stock.objects.count(), 4)
+
+    def test_iter_symbols(self):
+        symbols = iter_symbols(set())
+        for _ in range(36):
+            next(symbols)
+        self.assertEqual(next(symbols), "AA")
+
+    def test_generate_rows(self):
+        users = create_benchmark_users(2)
+        stocks = create_benchmark_stocks(2)
+
+        rows = list(generate_trade_data_rows(1000, users, stocks, 0.5, 1))
+        self.assertEqual(len(rows), 1000)
+        self.assertEqual(
+            rows, list(generate_trade_data_rows(1000, users, stocks, 0.5, 1))
+        )
+        self.assertIn("SELL", {row[3] for row in rows})
+
+        balances = {}
+        for user_id, symbol, quantity, order_type in rows:
+            if order_type == "SELL":
+                quantity = -quantity
+            balances[user_id, symbol] = balances.get((user_id, symbol), 0)
+            balances[user_id, symbol] += quantity
+            self.assertGreaterEqual(balances[user_id, symbol], 0)
+
+
+class IngestionBenchmarkTestCase(CSVBuilderMixin, TestCase):
+    def test_run(self):
+        benchmark = IngestionBenchmark(
+            rows=200, users=5, stocks=3, write_backend="bulk_create"
+        )
+        result = benchmark.run()
+
+        self.assertEqual(result["config"]["write_backend"], "bulk_create")
+        self.assertEqual(
+            list(result["stages"]),
+            ["fixtures", "generate", "parse", "cache", "process"],
+        )
+        process = result["stages"]["process"]
+        self.assertEqual(process["rows_written"], 200)
+        self.assertGreater(process["queries"], 0)
+        self.assertGreater(process["peak_rss"], 0)
+        self.assertEqual(result["stages"]["parse"]["queries"], 0)
+        # everything is deleted
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Position.objects.exists())
+        self.assertFalse(TradeDataFile.objects.exists())
+        self.assertFalse(Stock.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_compare(self):
+        baseline = {"stages": {"parse": {"rows_per_second": 1000}}}
+        result = {
+            "stages": {
+                "parse": {"rows_per_second": 900},
+                "fixtures": {"seconds": 1},
+            }
+        }
+        self.assertEqual(
+            compare_benchmark_results(baseline, result), {"parse": -0.1}
+        )
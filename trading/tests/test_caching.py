@@ -0,0 +1,48 @@
+from django.core.cache import caches
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from trading.caching import (
+    USERS_SCOPE,
+    bump_response_versions,
+    bump_user_response_versions,
+    get_response_version_key,
+    get_response_versions,
+    get_user_scope,
+)
+
+
+@override_settings(RESPONSE_VERSIONS_CACHE="default")
+class ResponseVersionsTestCase(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_get_response_versions(self):
+        versions = get_response_versions(["a", "b"])
+        self.assertEqual(len(set(versions)), 2)
+        self.assertEqual(get_response_versions(["a", "b"]), versions)
+
+    def test_cleared_versions(self):
+        """Versions lost with the cache are not reused"""
+        versions = get_response_versions(["a"])
+        caches["default"].delete(get_response_version_key("a"))
+        self.assertNotEqual(get_response_versions(["a"]), versions)
+
+    def test_bump_response_versions(self):
+        versions = get_response_versions(["a", "b"])
+        bump_response_versions(["a"])
+        new_versions = get_response_versions(["a", "b"])
+        self.assertNotEqual(new_versions[0], versions[0])
+        self.assertEqual(new_versions[1], versions[1])
+
+    def test_bump_user_response_versions(self):
+        scopes = [USERS_SCOPE, get_user_scope(1), get_user_scope(2)]
+        versions = get_response_versions(scopes)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            bump_user_response_versions([1])
+        self.assertEqual(len(callbacks), 1)
+        new_versions = get_response_versions(scopes)
+        self.assertNotEqual(new_versions[0], versions[0])
+        self.assertNotEqual(new_versions[1], versions[1])
+        self.assertEqual(new_versions[2], versions[2])
@@ -0,0 +1,62 @@
+import json
+import os
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from trading.factories import (
+    OrderFactory,
+    StockFactory,
+    UserFactory,
+)
+from trading.models import Position
+from trading.tests.test_services import CSVBuilderMixin
+
+
+class RebuildPositionsCommandTestCase(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.stock = StockFactory()
+        OrderFactory(user=self.user, stock=self.stock, quantity=10)
+        OrderFactory(user=self.user, stock=self.stock, quantity=-4)
+
+    def test_rebuild_positions(self):
+        Position.objects.all().delete()
+
+        out = StringIO()
+        call_command("rebuild_positions", stdout=out)
+
+        self.assertIn("Rebuilt 1 positions", out.getvalue())
+        position = Position.objects.get()
+        self.assertEqual(position.user, self.user)
+        self.assertEqual(position.stock, self.stock)
+        self.assertEqual(position.quantity, 6)
+
+
+class BenchmarkIngestionCommandTestCase(CSVBuilderMixin, TestCase):
+    def test_benchmark_ingestion(self):
+        output = os.path.join(self.upload_storage_dir, "benchmark.json")
+        os.makedirs(self.upload_storage_dir, exist_ok=True)
+
+        out = StringIO()
+        call_command(
+            "benchmark_ingestion",
+            "--rows=50",
+            "--users=2",
+            "--stocks=2",
+            f"--output={output}",
+            stdout=out,
+        )
+        with open(output) as f:
+            result = json.load(f)
+        self.assertEqual(json.loads(out.getvalue()), result)
+        self.assertEqual(result["stages"]["process"]["rows_written"], 50)
+
+        call_command(
+            "benchmark_ingestion",
+            "--rows=50",
+            "--users=2",
+            "--stocks=2",
+            f"--baseline={output}",
+            stdout=out,
+        )
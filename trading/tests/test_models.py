@@ -1,10 +1,29 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import (
+    IntegrityError,
+    connection,
+)
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+)
+from django.utils import timezone
 from trading.factories import (
     OrderFactory,
     StockFactory,
+    TradeDataFileFactory,
     UserFactory,
 )
-from trading.models import Order
+from trading.models import (
+    HoldingsSnapshot,
+    InsufficientBalance,
+    Order,
+    Position,
+    TradeDataFile,
+)
 
 
 class StockTestCase(TestCase):
@@ -46,3 +65,388 @@ class OrderTestCase(TestCase):
             stock=self.stock, user=self.user
         )
         self.assertEqual(balance, order2.quantity)
+
+    def test_manager_create_sell(self):
+        order = Order.objects.create_sell(self.user, self.stock, 4)
+        self.assertEqual(order.quantity, -4)
+        self.assertEqual(order.order_type, Order.SELL)
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            6,
+        )
+
+        with self.assertRaises(InsufficientBalance) as e:
+            Order.objects.create_sell(self.user, self.stock, 7)
+        self.assertEqual(e.exception.available, 6)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_manager_create_batch(self):
+        stock2 = StockFactory()
+        results = Order.objects.create_batch(
+            self.user,
+            [
+                {"stock": self.stock, "quantity": 12, "order_type": Order.SELL},
+                {"stock": stock2, "quantity": 5, "order_type": Order.BUY},
+                {"stock": self.stock, "quantity": 6, "order_type": Order.SELL},
+                {"stock": stock2, "quantity": 5, "order_type": Order.SELL},
+                {"stock": self.stock, "quantity": 6, "order_type": Order.SELL},
+            ],
+        )
+
+        self.assertIsInstance(results[0], InsufficientBalance)
+        self.assertEqual(results[0].available, 10)
+        self.assertEqual(results[4].available, 4)
+        self.assertEqual(
+            [order.quantity for order in results[1:4]], [5, -6, -5]
+        )
+        self.assertTrue(all(order.pk for order in results[1:4]))
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            4,
+        )
+        self.assertEqual(
+            Order.objects.get_available_balance(stock=stock2, user=self.user),
+            0,
+        )
+
+    def test_manager_create_order_idempotent(self):
+        order = Order.objects.create_order(
+            self.user, self.stock, 4, Order.SELL, idempotency_key="key-1"
+        )
+        retry = Order.objects.create_order(
+            self.user, self.stock, 4, Order.SELL, idempotency_key="key-1"
+        )
+        self.assertEqual(retry, order)
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            6,
+        )
+
+        # keys are per user
+        other = Order.objects.create_order(
+            UserFactory(), self.stock, 1, Order.BUY, idempotency_key="key-1"
+        )
+        self.assertNotEqual(other, order)
+
+    def test_manager_create_batch_idempotent(self):
+        order = Order.objects.create_order(
+            self.user, self.stock, 1, Order.BUY, idempotency_key="key-1"
+        )
+        values = {"stock": self.stock, "quantity": 2, "order_type": Order.BUY}
+        results = Order.objects.create_batch(
+            self.user,
+            [
+                {**values, "idempotency_key": "key-1"},
+                {**values, "idempotency_key": "key-2"},
+                {**values, "idempotency_key": "key-2"},
+                values,
+            ],
+        )
+        self.assertEqual(results[0], order)
+        self.assertIs(results[2], results[1])
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            15,
+        )
+
+    def test_unique_idempotency_key(self):
+        OrderFactory(user=self.user, idempotency_key="key-1")
+        OrderFactory(user=self.user, idempotency_key=None)
+        OrderFactory(user=self.user, idempotency_key=None)
+        with self.assertRaises(IntegrityError):
+            OrderFactory(user=self.user, idempotency_key="key-1")
+
+
+class ConcurrentSellTestCase(TransactionTestCase):
+    def test_concurrent_sells(self):
+        """Only as many SELLs as the position covers succeed"""
+        stock = StockFactory()
+        user = UserFactory()
+        OrderFactory(stock=stock, user=user, quantity=10)
+
+        def sell(_):
+            try:
+                Order.objects.create_sell(user, stock, 3)
+                return True
+            except InsufficientBalance:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(sell, range(8)))
+
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(
+            Order.objects.get_available_balance(stock=stock, user=user), 1
+        )
+
+
+class PositionTestCase(TestCase):
+    def setUp(self):
+        self.stock = StockFactory()
+        self.user = UserFactory()
+
+    def get_quantity(self, user=None, stock=None) -> int:
+        return Position.objects.get(
+            user=user or self.user, stock=stock or self.stock
+        ).quantity
+
+    def assert_value(self, user=None, stock=None):
+        """The position value matches its quantity at the stock price"""
+        stock = stock or self.stock
+        position = Position.objects.get(user=user or self.user, stock=stock)
+        stock.refresh_from_db()
+        self.assertEqual(position.value, position.quantity * stock.price)
+
+    def test_order_updates_position(self):
+        """Creating and deleting orders updates the position"""
+        order = OrderFactory(stock=self.stock, user=self.user, quantity=10)
+        self.assertEqual(self.get_quantity(), 10)
+
+        OrderFactory(stock=self.stock, user=self.user, quantity=-4)
+        self.assertEqual(self.get_quantity(), 6)
+
+        order.delete()
+        self.assertEqual(self.get_quantity(), -4)
+        self.assertEqual(Position.objects.count(), 1)
+
+    def test_delete_user_and_stock_with_orders(self):
+        """Deleting a user or stock deletes its orders and positions"""
+        user2 = UserFactory()
+        stock2 = StockFactory()
+        OrderFactory(stock=self.stock, user=self.user, quantity=10)
+        OrderFactory(stock=stock2, user=self.user, quantity=3)
+        OrderFactory(stock=self.stock, user=user2, quantity=2)
+        user_id = self.user.id
+
+        self.user.delete()
+        self.assertFalse(Order.objects.filter(user_id=user_id).exists())
+        self.assertFalse(Position.objects.filter(user_id=user_id).exists())
+        self.assertEqual(self.get_quantity(user=user2), 2)
+
+        self.stock.delete()
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Position.objects.exists())
+        # deferred foreign key checks run at commit
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    def test_apply_deltas(self):
+        stock2 = StockFactory()
+        OrderFactory(stock=self.stock, user=self.user, quantity=10)
+
+        Position.objects.apply_deltas(
+            {
+                (self.user.id, self.stock.id): -3,
+                (self.user.id, stock2.id): 5,
+            }
+        )
+        self.assertEqual(self.get_quantity(), 7)
+        self.assertEqual(self.get_quantity(stock=stock2), 5)
+        self.assert_value()
+        self.assert_value(stock=stock2)
+
+    def test_withdraw(self):
+        OrderFactory(stock=self.stock, user=self.user, quantity=10)
+
+        self.assertEqual(
+            Position.objects.withdraw(self.user.id, self.stock.id, 4), 6
+        )
+        self.assertIsNone(
+            Position.objects.withdraw(self.user.id, self.stock.id, 7)
+        )
+        self.assertIsNone(
+            Position.objects.withdraw(self.user.id, StockFactory().id, 1)
+        )
+        self.assertEqual(self.get_quantity(), 6)
+        self.assert_value()
+
+    def test_rebuild(self):
+        user2 = UserFactory()
+        OrderFactory(stock=self.stock, user=self.user, quantity=10)
+        OrderFactory(stock=self.stock, user=self.user, quantity=-3)
+        OrderFactory(stock=self.stock, user=user2, quantity=2)
+        Position.objects.filter(user=self.user).update(quantity=100, value=0)
+
+        Position.objects.rebuild()
+        self.assertEqual(self.get_quantity(), 7)
+        self.assertEqual(self.get_quantity(user=user2), 2)
+        self.assertEqual(Position.objects.count(), 2)
+        self.assert_value()
+
+    def test_stock_price_updates_values(self):
+        """Changing the price of a stock only updates its position values"""
+        stock2 = StockFactory(price=Decimal("2.5"))
+        OrderFactory(stock=self.stock, user=self.user, quantity=10)
+        OrderFactory(stock=stock2, user=self.user, quantity=4)
+        modified = Position.objects.get(stock=stock2).modified
+
+        self.stock.price = Decimal("12.34567")
+        self.stock.save()
+        self.assert_value()
+        self.assertEqual(Position.objects.get(stock=stock2).modified, modified)
+
+        self.stock.name = "Renamed"
+        with self.assertNumQueries(1):
+            self.stock.save(update_fields=["name"])
+
+
+class HoldingsSnapshotTestCase(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.stock = StockFactory()
+        self.stock2 = StockFactory()
+        self.now = timezone.now()
+
+    def create_order(self, quantity: int, hours_ago: int, stock=None) -> Order:
+        order = OrderFactory(
+            user=self.user, stock=stock or self.stock, quantity=quantity
+        )
+        Order.objects.filter(pk=order.pk).update(
+            created=self.now - timedelta(hours=hours_ago)
+        )
+        return order
+
+    def get_snapshot_holdings(self, snapshot: HoldingsSnapshot) -> dict:
+        return dict(
+            snapshot.holdings.filter(user=self.user).values_list(
+                "stock_id", "quantity"
+            )
+        )
+
+    def test_take(self):
+        self.create_order(10, hours_ago=5)
+        self.create_order(3, hours_ago=4, stock=self.stock2)
+        first = HoldingsSnapshot.objects.take(self.now - timedelta(hours=3))
+        self.assertEqual(
+            self.get_snapshot_holdings(first),
+            {self.stock.id: 10, self.stock2.id: 3},
+        )
+
+        self.create_order(-4, hours_ago=2)
+        self.create_order(-3, hours_ago=2, stock=self.stock2)
+        # not part of the snapshot yet
+        self.create_order(7, hours_ago=0)
+        second = HoldingsSnapshot.objects.take(self.now - timedelta(hours=1))
+        self.assertEqual(self.get_snapshot_holdings(second), {self.stock.id: 6})
+
+    def test_get_holdings(self):
+        self.create_order(10, hours_ago=5)
+        HoldingsSnapshot.objects.take(self.now - timedelta(hours=4))
+        self.create_order(-4, hours_ago=3)
+        self.create_order(2, hours_ago=1, stock=self.stock2)
+
+        # nearest snapshot, its holdings and the orders since
+        with self.assertNumQueries(3):
+            holdings = HoldingsSnapshot.objects.get_holdings(
+                self.user.id, self.now - timedelta(hours=2)
+            )
+        self.assertEqual(holdings, {self.stock.id: 6})
+        self.assertEqual(
+            HoldingsSnapshot.objects.get_holdings(self.user.id, self.now),
+            {self.stock.id: 6, self.stock2.id: 2},
+        )
+        self.assertEqual(
+            HoldingsSnapshot.objects.get_holdings(
+                self.user.id, self.now - timedelta(hours=6)
+            ),
+            {},
+        )
+
+    def test_get_history(self):
+        self.create_order(10, hours_ago=5)
+        HoldingsSnapshot.objects.take(self.now - timedelta(hours=4))
+        self.create_order(-4, hours_ago=3)
+        HoldingsSnapshot.objects.take(self.now - timedelta(hours=2))
+        self.create_order(5, hours_ago=1)
+
+        start = self.now - timedelta(hours=6)
+        history = HoldingsSnapshot.objects.get_history(
+            self.user.id, start, self.now
+        )
+        self.assertEqual(
+            history,
+            [
+                (start, {}),
+                (self.now - timedelta(hours=4), {self.stock.id: 10}),
+                (self.now - timedelta(hours=2), {self.stock.id: 6}),
+                (self.now, {self.stock.id: 11}),
+            ],
+        )
+
+    def test_prune(self):
+        midnight = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for hours in [-25, -24, -23, 1, 2]:
+            HoldingsSnapshot.objects.create(
+                taken_at=midnight + timedelta(hours=hours)
+            )
+
+        HoldingsSnapshot.objects.prune(midnight + timedelta(hours=2))
+        self.assertEqual(
+            sorted(HoldingsSnapshot.objects.values_list("taken_at", flat=True)),
+            [
+                midnight + timedelta(hours=-25),
+                midnight + timedelta(hours=-24),
+                midnight + timedelta(hours=1),
+                midnight + timedelta(hours=2),
+            ],
+        )
+
+
+class TradeDataFileTestCase(TestCase):
+    def setUp(self):
+        self.content_digest = "a" * 64
+
+    def test_get_duplicate(self):
+        self.assertIsNone(
+            TradeDataFile.objects.get_duplicate(self.content_digest)
+        )
+
+        trade_data_file = TradeDataFileFactory(
+            content_digest=self.content_digest, status=TradeDataFile.PROCESSED
+        )
+        self.assertEqual(
+            TradeDataFile.objects.get_duplicate(self.content_digest),
+            trade_data_file,
+        )
+
+    def test_get_duplicate_failed(self):
+        """Failed files are not duplicates"""
+        TradeDataFileFactory(
+            content_digest=self.content_digest, status=TradeDataFile.FAILED
+        )
+        self.assertIsNone(
+            TradeDataFile.objects.get_duplicate(self.content_digest)
+        )
+        TradeDataFileFactory(content_digest=self.content_digest)
+
+    def test_claim(self):
+        trade_data_file = TradeDataFileFactory()
+        self.assertTrue(TradeDataFile.objects.claim(trade_data_file.pk))
+        trade_data_file.refresh_from_db()
+        self.assertEqual(trade_data_file.status, TradeDataFile.PROCESSING)
+        # a redelivered task may claim a file that is still processing
+        self.assertTrue(TradeDataFile.objects.claim(trade_data_file.pk))
+
+        for status in (TradeDataFile.PROCESSED, TradeDataFile.FAILED):
+            trade_data_file.status = status
+            trade_data_file.save()
+            self.assertFalse(TradeDataFile.objects.claim(trade_data_file.pk))
+            trade_data_file.refresh_from_db()
+            self.assertEqual(trade_data_file.status, status)
+
+    def test_unique_content_digest(self):
+        TradeDataFileFactory(content_digest=self.content_digest)
+        with self.assertRaises(IntegrityError):
+            TradeDataFileFactory(content_digest=self.content_digest)
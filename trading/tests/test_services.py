@@ -1,20 +1,44 @@
+import bz2
+import errno
+import gzip
+import io
 import os
 import shutil
+import threading
 import uuid
 from collections import namedtuple
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
 from pathlib import Path
 
 import mock
+import pyarrow as pa
+import pyarrow.parquet as pq
 import tablib
+import zstandard
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import (
+    DatabaseError,
+    connection,
+)
 from django.db.models import Max
 from django.test import (
     TestCase,
+    TransactionTestCase,
     override_settings,
 )
+from trading.caching import (
+    FILES_SCOPE,
+    bump_response_versions,
+    get_response_versions,
+)
 from trading.factories import (
     OrderFactory,
     StockFactory,
@@ -22,21 +46,51 @@ from trading.factories import (
     UserFactory,
 )
 from trading.models import (
+    InsufficientBalance,
     Order,
+    Position,
+    StagedOrder,
     Stock,
     TradeDataFile,
 )
 from trading.services import (
+    ARROW_FORMAT,
+    PARQUET_FORMAT,
+    ArrowParser,
+    BulkCreateOrderWriter,
+    ColumnarCSVParser,
+    CopyOrderWriter,
     CSVParser,
     EmptyImportFile,
+    GroupCommitOrderWriter,
     InvalidImportFile,
+    OrderIntakeUnavailable,
+    ParallelCSVParser,
     PortfolioCache,
+    ProcessingProgress,
+    SpillDict,
     StockCache,
+    StockSymbols,
     TradeDataFileProcessor,
+    TradeDataFileShardProcessor,
     UserCache,
+    bump_stock_symbols_version,
+    dry_run_trade_data_file,
+    get_order_writer,
+    get_progress_cache_key,
+    get_stock_symbols_version,
+    group_conflicting_files,
+    scan_order_keys,
+    stock_symbols,
+    store_trade_data_csv_file,
 )
 
 
+COMPRESSORS = {
+    ".gz": gzip.compress,
+    ".bz2": bz2.compress,
+    ".zst": zstandard.ZstdCompressor().compress,
+}
 OrderData = namedtuple("OrderData", ["user", "stock", "quantity", "order_type"])
 InvalidOrderData = namedtuple(
     "InvalidOrderData",
@@ -94,7 +148,9 @@ class CSVBuilderMixin:
 
         dir_path = Path(full_path).parent
         dir_path.mkdir(parents=True, exist_ok=True)
-        data = content.encode("utf-8")
+        data = (
+            content if isinstance(content, bytes) else content.encode("utf-8")
+        )
         default_storage.save(full_path, ContentFile(data))
 
         return full_path
@@ -129,6 +185,136 @@ class CSVParserTestCase(CSVBuilderMixin, TestCase):
             parser.__iter__()
 
 
+class CompressedCSVParserTestCase(CSVBuilderMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for idx in range(20):
+            self.add_data(OrderData(str(idx), "NVDA", str(idx), "BUY"))
+        filename, self.content = self.write_csv()
+        self.csv_file = self.save_uploaded_file(filename, self.content)
+
+    def build_compressed_csv_file(self, suffix: str) -> str:
+        return self.save_uploaded_file(
+            f"test-{uuid.uuid4()}.csv{suffix}",
+            COMPRESSORS[suffix](self.content.encode("utf-8")),
+        )
+
+    def parse(self, parser: CSVParser) -> list[tuple[dict, int, int]]:
+        return [(row, parser.offset, parser.row_number) for row in parser]
+
+    def test_compressed_csv_parser(self):
+        expected = self.parse(CSVParser(self.csv_file))
+        for suffix in COMPRESSORS:
+            with self.subTest(suffix=suffix):
+                parser = CSVParser(self.build_compressed_csv_file(suffix))
+                self.assertEqual(self.parse(parser), expected)
+                self.assertTrue(parser.compressed)
+
+    def test_compressed_csv_parser_seek(self):
+        """Checkpoint offsets are positions in the decompressed stream"""
+        expected = self.parse(CSVParser(self.csv_file))
+        _, offset, row_number = expected[9]
+        for suffix in COMPRESSORS:
+            with self.subTest(suffix=suffix):
+                parser = CSVParser(self.build_compressed_csv_file(suffix))
+                parser.seek(offset, row_number)
+                self.assertEqual(self.parse(parser), expected[10:])
+
+    def test_compressed_columnar_and_parallel_parsers(self):
+        expected = self.parse(CSVParser(self.csv_file))
+        expected_batches = list(
+            ColumnarCSVParser(self.csv_file).iter_batches(batch_size=7)
+        )
+        for suffix in COMPRESSORS:
+            with self.subTest(suffix=suffix):
+                csv_file = self.build_compressed_csv_file(suffix)
+                self.assertEqual(
+                    list(ColumnarCSVParser(csv_file).iter_batches(7)),
+                    expected_batches,
+                )
+                parser = ParallelCSVParser(csv_file, workers=2, range_size=32)
+                self.assertEqual(self.parse(parser), expected)
+                parser.close()
+
+
+class ParallelCSVParserTestCase(CSVBuilderMixin, TestCase):
+    def parse(self, parser: CSVParser) -> list[tuple[dict, int, int]]:
+        return [(row, parser.offset, parser.row_number) for row in parser]
+
+    def test_parallel_csv_parser(self):
+        for idx in range(20):
+            self.add_data(OrderData(str(idx), "NVDA", str(idx * 10), "BUY"))
+        csv_file = self.build_csv_file()
+
+        parser = ParallelCSVParser(csv_file, workers=2, range_size=32)
+        rows = self.parse(parser)
+        self.assertEqual(rows, self.parse(CSVParser(csv_file)))
+        self.assertEqual(len(rows), 20)
+        self.assertDictEqual(
+            rows[-1][0],
+            {"user": 19, "stock": "NVDA", "quantity": 190, "order_type": "BUY"},
+        )
+
+    def test_parallel_csv_parser_seek(self):
+        for idx in range(10):
+            self.add_data(OrderData(str(idx), "NVDA", "10", "SELL"))
+        csv_file = self.build_csv_file()
+        expected = self.parse(CSVParser(csv_file))
+
+        parser = ParallelCSVParser(csv_file, workers=2, range_size=16)
+        parser.seek(expected[3][1], expected[3][2])
+        self.assertEqual(self.parse(parser), expected[4:])
+
+    def test_parallel_csv_parser_errors(self):
+        parser = ParallelCSVParser("invalid_path", workers=2)
+        with self.assertRaises(InvalidImportFile):
+            parser.__iter__()
+
+        parser = ParallelCSVParser(self.build_csv_file(), workers=2)
+        with self.assertRaises(EmptyImportFile):
+            parser.__iter__()
+
+        self.add_data(InvalidOrderData("1", "NVDA", "10"))
+        parser = ParallelCSVParser(self.build_csv_file(), workers=2)
+        with self.assertRaises(InvalidImportFile):
+            parser.__iter__()
+
+
+class ColumnarCSVParserTestCase(CSVBuilderMixin, TestCase):
+    def test_columnar_csv_parser(self):
+        self.add_data(OrderData("1", " NVDA ", "10", "BUY"))
+        self.add_data(OrderData("2", "AAPL", "20", "SELL"))
+        self.add_data(OrderData("3", "MSFT", "30", "BUY"))
+
+        parser = ColumnarCSVParser(self.build_csv_file())
+        batches = list(parser.iter_batches(2))
+        self.assertEqual(
+            batches,
+            [
+                {
+                    "user": ("1", "2"),
+                    "stock": (" NVDA ", "AAPL"),
+                    "quantity": ("10", "20"),
+                    "order_type": ("BUY", "SELL"),
+                },
+                {
+                    "user": ("3",),
+                    "stock": ("MSFT",),
+                    "quantity": ("30",),
+                    "order_type": ("BUY",),
+                },
+            ],
+        )
+        self.assertEqual(parser.row_number, 3)
+
+    def test_columnar_csv_parser_missing_header_error(self):
+        self.add_data(InvalidOrderData("1", "NVDA", "10"))
+
+        parser = ColumnarCSVParser(self.build_csv_file())
+        with self.assertRaises(InvalidImportFile):
+            next(parser.iter_batches(2))
+
+
 class UserCacheTestCase(TestCase):
     csv_field = "user"
     instance_factory = UserFactory
@@ -149,12 +335,20 @@ class UserCacheTestCase(TestCase):
         )
         self.assertEqual(
             self.cache.find(getattr(self.instance, self.cache_key_lookup)),
-            self.instance,
+            self.instance.id,
         )
 
         invalid = self.get_invalid_cache_key()
+        self.cache.build_cache_for_batch([{self.csv_field: invalid}])
         self.assertIsNone(self.cache.find(invalid))
 
+    def test_missing_values_are_cached(self):
+        invalid = self.get_invalid_cache_key()
+        self.cache.build_cache_for_batch([{self.csv_field: invalid}])
+        self.assertIsNone(self.cache.find(invalid))
+        with self.assertNumQueries(0):
+            self.cache.build_cache_for_batch([{self.csv_field: invalid}])
+
 
 class StockCacheTestCase(UserCacheTestCase):
     csv_field = "stock"
@@ -167,6 +361,57 @@ class StockCacheTestCase(UserCacheTestCase):
         return "NONE"
 
 
+class StockSymbolsTestCase(TestCase):
+    def setUp(self):
+        caches[settings.STOCK_SYMBOLS_CACHE].clear()
+        self.stock = StockFactory()
+        self.symbols = StockSymbols()
+
+    def test_get(self):
+        with self.assertNumQueries(1):
+            stock = self.symbols.get(self.stock.symbol)
+            self.assertEqual(
+                self.symbols.get_by_id(self.stock.id),
+                stock,
+            )
+            self.assertIsNone(self.symbols.get("NONE"))
+        self.assertEqual(
+            stock, (self.stock.id, self.stock.symbol, self.stock.price)
+        )
+
+    def test_stock_cache_without_queries(self):
+        stock_symbols.refresh()
+        with self.assertNumQueries(0):
+            cache = StockCache()
+            cache.build_cache_for_batch([{"stock": self.stock.symbol}])
+            self.assertEqual(cache.find(self.stock.symbol), self.stock.id)
+            self.assertEqual(cache.get_symbol(self.stock.id), self.stock.symbol)
+
+    def test_invalidated_by_signals(self):
+        stock_symbols.refresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            stock = StockFactory()
+        self.assertEqual(get_stock_symbols_version(), 1)
+        self.assertEqual(stock_symbols.get(stock.symbol).id, stock.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.delete()
+        self.assertEqual(get_stock_symbols_version(), 2)
+        self.assertIsNone(stock_symbols.get(stock.symbol))
+
+    def test_version_changed_by_other_process(self):
+        self.symbols.load()
+        Stock.objects.filter(pk=self.stock.pk).update(symbol="NEW")
+        with self.assertNumQueries(0):
+            self.symbols.refresh()
+
+        bump_stock_symbols_version()
+        with self.assertNumQueries(1):
+            self.symbols.refresh()
+        self.assertEqual(self.symbols.get("NEW").id, self.stock.id)
+        self.assertIsNone(self.symbols.get(self.stock.symbol))
+
+
 class PortfolioCacheTestCase(TestCase):
     def setUp(self):
         self.user = UserFactory()
@@ -185,15 +430,239 @@ class PortfolioCacheTestCase(TestCase):
         self.cache.build_cache_for_batch(
             [{"user": self.user.id}, {"user": self.user2.id}]
         )
-        allowed, quantity = self.cache.find(self.user.id, self.stock.symbol, 15)
+        allowed, quantity = self.cache.find(self.user.id, self.stock.id, 15)
         self.assertTrue(allowed)
         self.assertEqual(self.order.quantity + 15, quantity)
 
-        allowed, quantity = self.cache.find(
-            self.user2.id, self.stock2.symbol, -30
-        )
+        allowed, quantity = self.cache.find(self.user2.id, self.stock2.id, -30)
         self.assertFalse(allowed)
-        self.assertEqual(self.order2.quantity, 20)
+        self.assertEqual(quantity, 0)
+        self.assertEqual(self.cache.get(self.user2.id, self.stock.id), 20)
+        self.assertEqual(
+            self.cache.get_deltas(),
+            {str(self.user.id): {str(self.stock.id): 15}},
+        )
+
+    def test_preload(self):
+        user3 = UserFactory()
+        self.cache.preload(
+            [
+                (self.user.id, self.stock.id),
+                (self.user2.id, self.stock2.id),
+                (user3.id, self.stock.id),
+            ]
+        )
+        with self.assertNumQueries(0):
+            self.cache.build_cache_for_batch(
+                [{"user": self.user.id}, {"user": user3.id}]
+            )
+        self.assertEqual(self.cache.get(self.user.id, self.stock.id), 10)
+        self.assertEqual(self.cache.get(self.user2.id, self.stock2.id), 0)
+        self.assertEqual(self.cache.get(user3.id, self.stock.id), 0)
+        # only pairs in the file are loaded
+        self.assertEqual(self.cache.get(self.user2.id, self.stock.id), 0)
+
+    def test_preload_skips_loaded_users(self):
+        self.cache.build_cache_for_batch([{"user": self.user.id}])
+        self.cache.add(self.user.id, self.stock.id, 5)
+        self.cache.preload([(self.user.id, self.stock.id)])
+        self.assertEqual(self.cache.get(self.user.id, self.stock.id), 15)
+
+    @override_settings(TRADE_DATA_FILE_CACHE_MAX_ENTRIES=1)
+    def test_spill(self):
+        self.cache = PortfolioCache()
+        self.cache.build_cache_for_batch(
+            [{"user": self.user.id}, {"user": self.user2.id}]
+        )
+        self.assertEqual(self.cache._cache.spilled, 1)
+        with self.assertNumQueries(0):
+            self.cache.build_cache_for_batch(
+                [{"user": self.user.id}, {"user": self.user2.id}]
+            )
+        self.assertEqual(self.cache.get(self.user.id, self.stock.id), 10)
+        self.assertEqual(self.cache.get(self.user2.id, self.stock.id), 20)
+        self.cache.add(self.user.id, self.stock.id, 5)
+        self.assertEqual(self.cache.get(self.user2.id, self.stock.id), 20)
+        self.assertEqual(self.cache.get(self.user.id, self.stock.id), 15)
+        self.assertEqual(len(self.cache._cache), 2)
+        self.cache.close()
+
+
+class SpillDictTestCase(TestCase):
+    def test_spill(self):
+        entries = SpillDict(max_entries=10)
+        for key in range(20):
+            entries[key] = key * 2
+        self.assertEqual(len(entries), 20)
+        self.assertGreater(entries.spilled, 0)
+        self.assertLessEqual(len(entries._entries), 10)
+        for key in range(20):
+            self.assertIn(key, entries)
+            self.assertEqual(entries.get(key), key * 2)
+        self.assertNotIn(20, entries)
+        self.assertIsNone(entries.get(20))
+
+        entries[0] = 1
+        self.assertEqual(entries.get(0), 1)
+        self.assertEqual(len(entries), 20)
+        self.assertEqual(
+            dict(entries.items()),
+            {key: key * 2 if key else 1 for key in range(20)},
+        )
+        entries.close()
+        self.assertEqual(len(entries), 0)
+
+
+class OrderWriterTestCase(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.stock = StockFactory()
+        self.orders = [
+            {
+                "user": self.user,
+                "stock": self.stock,
+                "quantity": 10,
+                "order_type": Order.BUY,
+            },
+            {
+                "user_id": self.user.id,
+                "stock_id": self.stock.id,
+                "quantity": -5,
+                "order_type": Order.SELL,
+            },
+        ]
+
+    def assert_orders_written(self, writer):
+        writer.write(self.orders)
+
+        self.assertEqual(writer.rows_written, 2)
+        self.assertGreater(writer.rows_per_second, 0)
+        orders = Order.objects.filter(user=self.user, stock=self.stock)
+        self.assertEqual(
+            sorted(orders.values_list("quantity", "order_type")),
+            [(-5, Order.SELL), (10, Order.BUY)],
+        )
+        for order in orders:
+            self.assertIsNotNone(order.created)
+            self.assertIsNotNone(order.modified)
+
+    def test_bulk_create_writer(self):
+        self.assert_orders_written(BulkCreateOrderWriter())
+
+    def test_copy_writer(self):
+        self.assert_orders_written(CopyOrderWriter())
+
+    def test_get_order_writer(self):
+        self.assertIsInstance(
+            get_order_writer("bulk_create"), BulkCreateOrderWriter
+        )
+        self.assertIsInstance(get_order_writer("copy"), CopyOrderWriter)
+
+    def test_get_order_writer_fallback(self):
+        with mock.patch("trading.services.connection") as mock_connection:
+            mock_connection.vendor = "sqlite"
+            writer = get_order_writer("copy")
+        self.assertIsInstance(writer, BulkCreateOrderWriter)
+
+
+class GroupCommitOrderWriterTestCase(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+        self.stock = StockFactory()
+        OrderFactory(user=self.user, stock=self.stock, quantity=10)
+        self.writer = GroupCommitOrderWriter()
+
+    def test_commit(self):
+        values = {"stock": self.stock, "order_type": Order.SELL}
+        batch = [
+            (self.user, {**values, "quantity": 4}, Future()),
+            (self.user2, {**values, "quantity": 1}, Future()),
+            (self.user, {**values, "quantity": 6}, Future()),
+            (self.user, {**values, "quantity": 1}, Future()),
+        ]
+        self.writer.commit(batch)
+
+        results = [future for _, _, future in batch]
+        self.assertEqual(results[0].result().quantity, -4)
+        self.assertEqual(results[2].result().quantity, -6)
+        with self.assertRaises(InsufficientBalance):
+            results[1].result()
+        with self.assertRaises(InsufficientBalance):
+            results[3].result()
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            0,
+        )
+
+    def test_commit_failed(self):
+        future = Future()
+        with mock.patch.object(
+            self.writer, "write", side_effect=DatabaseError("failed")
+        ):
+            self.writer.commit([(self.user, {}, future)])
+        with self.assertRaises(DatabaseError):
+            future.result()
+
+    def test_queue_full(self):
+        writer = GroupCommitOrderWriter(queue_size=1, timeout=0.01)
+        with mock.patch.object(writer, "start"):
+            writer.submit(self.user, {})
+            with self.assertRaises(OrderIntakeUnavailable):
+                writer.submit(self.user, {})
+            with self.assertRaises(OrderIntakeUnavailable):
+                writer.place(self.user, {})
+
+    def test_place_timeout(self):
+        """Orders still queued after the timeout are never committed"""
+        writer = GroupCommitOrderWriter(timeout=0.01)
+        values = {"stock": self.stock, "quantity": 1, "order_type": Order.BUY}
+        with mock.patch.object(writer, "start"):
+            with self.assertRaises(OrderIntakeUnavailable):
+                writer.place(self.user, values)
+
+        writer.commit([writer.queue.get_nowait()])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_place_timeout_committing(self):
+        """Orders whose batch is being committed are waited for"""
+        writer = GroupCommitOrderWriter(timeout=0.01)
+        future = Future()
+        future.set_running_or_notify_cancel()
+        threading.Timer(0.05, future.set_result, ["order"]).start()
+        with mock.patch.object(writer, "submit", return_value=future):
+            self.assertEqual(writer.place(self.user, {}), "order")
+
+
+class GroupCommitOrderWriterThreadTestCase(TransactionTestCase):
+    def test_concurrent_orders(self):
+        """Orders of concurrent callers are committed in shared batches"""
+        user = UserFactory()
+        stock = StockFactory()
+        writer = GroupCommitOrderWriter(max_batch=10, max_delay=0.2)
+        values = {"stock": stock, "quantity": 1, "order_type": Order.BUY}
+
+        def place(index):
+            try:
+                return writer.place(
+                    user, {**values, "idempotency_key": f"key-{index % 10}"}
+                )
+            finally:
+                connection.close()
+
+        with mock.patch.object(
+            writer, "write", wraps=writer.write
+        ) as write, ThreadPoolExecutor(max_workers=20) as executor:
+            orders = list(executor.map(place, range(20)))
+
+        self.assertLess(write.call_count, 20)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertEqual(len({order.pk for order in orders}), 10)
+        self.assertEqual(
+            Order.objects.get_available_balance(stock=stock, user=user), 10
+        )
 
 
 class TradeDataFileProcessorTestCase(CSVBuilderMixin, TestCase):
@@ -210,11 +679,30 @@ class TradeDataFileProcessorTestCase(CSVBuilderMixin, TestCase):
         )
 
     def test_process_file(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "4", "SELL"))
+        filename, content = self.write_csv()
+        self.trade_data_file.uploaded_file = SimpleUploadedFile(
+            filename, content.encode("utf-8")
+        )
+        self.trade_data_file.save()
+        versions = get_response_versions([FILES_SCOPE])
         processor = TradeDataFileProcessor(self.trade_data_file)
-        processor.process()
-
-        self.trade_data_file.refresh_from_db()
-        self.assertEqual(self.trade_data_file.status, TradeDataFile.PROCESSING)
+        processor.batch_size = 1
+        with mock.patch(
+            "trading.services.bump_response_versions",
+            wraps=bump_response_versions,
+        ) as bump, self.captureOnCommitCallbacks() as callbacks:
+            processor.process()
+            # cached lists only expire once the orders are committed
+            self.assertEqual(get_response_versions([FILES_SCOPE]), versions)
+            self.trade_data_file.refresh_from_db()
+            self.assertEqual(
+                self.trade_data_file.status, TradeDataFile.PROCESSED
+            )
+            for callback in callbacks:
+                callback()
+        self.assertNotEqual(get_response_versions([FILES_SCOPE]), versions)
+        self.assertEqual(bump.call_count, 1)
 
         self.assertTrue(
             Order.objects.filter(
@@ -224,6 +712,66 @@ class TradeDataFileProcessorTestCase(CSVBuilderMixin, TestCase):
                 order_type=Order.BUY,
             ).exists()
         )
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            6,
+        )
+
+    def test_process_finished_file(self):
+        """A finished file is not claimed and its orders aren't written again"""
+        self.trade_data_file.status = TradeDataFile.PROCESSED
+        self.trade_data_file.save()
+
+        TradeDataFileProcessor(self.trade_data_file).process()
+
+        self.assertFalse(Order.objects.exists())
+        self.trade_data_file.refresh_from_db()
+        self.assertEqual(self.trade_data_file.status, TradeDataFile.PROCESSED)
+
+    def test_process_file_preload_portfolio(self):
+        """Balances are loaded once before validation, not per batch"""
+        for _ in range(2):
+            self.add_data(
+                OrderData(self.user.id, self.stock.symbol, "5", "SELL")
+            )
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(
+                "test.csv", self.write_csv()[1].encode("utf-8")
+            ),
+        )
+        processor = TradeDataFileProcessor(trade_data_file)
+        processor.batch_size = 1
+        with mock.patch.object(
+            PortfolioCache,
+            "add_items",
+            wraps=processor.portfolio_cache.add_items,
+        ) as add_items:
+            processor.process()
+        add_items.assert_not_called()
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            0,
+        )
+
+    @override_settings(TRADE_DATA_FILE_PRELOAD_PORTFOLIO=False)
+    def test_process_file_without_preload(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(
+                "test.csv", self.write_csv()[1].encode("utf-8")
+            ),
+        )
+        TradeDataFileProcessor(trade_data_file).process()
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            5,
+        )
 
     def test_process_file_commit(self):
         with mock.patch("django.db.transaction.on_commit", lambda t: t()):
@@ -242,6 +790,155 @@ class TradeDataFileProcessorTestCase(CSVBuilderMixin, TestCase):
             ).exists()
         )
 
+    def test_process_file_bulk_create(self):
+        processor = TradeDataFileProcessor(
+            self.trade_data_file, write_backend="bulk_create"
+        )
+        processor.process()
+
+        self.assertEqual(processor.writer.rows_written, 1)
+        self.assertTrue(
+            Order.objects.filter(
+                user=self.user,
+                stock=self.stock,
+                quantity=10,
+                order_type=Order.BUY,
+            ).exists()
+        )
+
+    def test_process_file_parallel_parse(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "4", "SELL"))
+        filename, content = self.write_csv()
+        trade_data_file = TradeDataFileFactory(
+            uploaded_by_user=self.user,
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+        processor = TradeDataFileProcessor(trade_data_file, parse_workers=2)
+        self.assertIsInstance(processor.parser, ParallelCSVParser)
+        processor.process()
+
+        self.assertEqual(
+            sorted(
+                Order.objects.filter(
+                    user=self.user, stock=self.stock
+                ).values_list("quantity", flat=True)
+            ),
+            [-4, 10],
+        )
+
+    def test_process_file_staging(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "4", "SELL"))
+        filename, content = self.write_csv()
+        trade_data_file = TradeDataFileFactory(
+            uploaded_by_user=self.user,
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+        processor = TradeDataFileProcessor(trade_data_file, use_staging=True)
+        processor.batch_size = 1
+        processor.staging_commit_batches = 1
+        versions = get_response_versions([FILES_SCOPE])
+        with self.captureOnCommitCallbacks(execute=True):
+            processor.process()
+        self.assertNotEqual(get_response_versions([FILES_SCOPE]), versions)
+
+        trade_data_file.refresh_from_db()
+        self.assertEqual(trade_data_file.status, TradeDataFile.PROCESSED)
+        self.assertIsNotNone(trade_data_file.completed_at)
+        self.assertFalse(StagedOrder.objects.exists())
+        self.assertEqual(
+            sorted(
+                Order.objects.filter(
+                    user=self.user, stock=self.stock
+                ).values_list("quantity", "order_type")
+            ),
+            [(-4, Order.SELL), (10, Order.BUY)],
+        )
+        self.assertEqual(
+            Position.objects.get(user=self.user, stock=self.stock).quantity, 6
+        )
+
+    def test_process_file_staging_failed(self):
+        self.add_data(OrderData(self.user.id, "NONE", "10", "BUY"))
+        filename, content = self.write_csv()
+        trade_data_file = TradeDataFileFactory(
+            uploaded_by_user=self.user,
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+        processor = TradeDataFileProcessor(trade_data_file, use_staging=True)
+        processor.batch_size = 1
+        processor.staging_commit_batches = 1
+        with self.assertRaises(InvalidImportFile):
+            processor.process()
+
+        self.assertFalse(StagedOrder.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Position.objects.exists())
+
+    def test_process_file_staging_resume(self):
+        """An interrupted run continues from the last checkpoint and ends
+        with the same orders as an uninterrupted run
+        """
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "4", "SELL"))
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "6", "SELL"))
+        filename, content = self.write_csv()
+        trade_data_file = TradeDataFileFactory(
+            uploaded_by_user=self.user,
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+        class WorkerLost(Exception):
+            pass
+
+        processor = TradeDataFileProcessor(trade_data_file, use_staging=True)
+        processor.batch_size = 1
+        processor.staging_commit_batches = 2
+        write = processor.writer.write
+
+        def write_then_fail(orders):
+            if processor.writer.rows_written == 2:
+                raise WorkerLost
+            write(orders)
+
+        with mock.patch.object(processor.writer, "write", write_then_fail):
+            with self.assertRaises(WorkerLost):
+                processor.process()
+
+        trade_data_file.refresh_from_db()
+        self.assertEqual(trade_data_file.status, TradeDataFile.PROCESSING)
+        self.assertEqual(trade_data_file.checkpoint_row, 2)
+        self.assertGreater(trade_data_file.checkpoint_offset, 0)
+        self.assertEqual(
+            trade_data_file.checkpoint_portfolio,
+            {str(self.user.id): {str(self.stock.id): 6}},
+        )
+        self.assertEqual(StagedOrder.objects.count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+        processor = TradeDataFileProcessor(trade_data_file, use_staging=True)
+        processor.batch_size = 1
+        with mock.patch.object(
+            processor.parser, "parse_row", wraps=processor.parser.parse_row
+        ) as parse_row:
+            processor.process()
+        self.assertEqual(parse_row.call_count, 1)
+
+        trade_data_file.refresh_from_db()
+        self.assertEqual(trade_data_file.status, TradeDataFile.PROCESSED)
+        self.assertEqual(trade_data_file.checkpoint_row, 0)
+        self.assertIsNone(trade_data_file.checkpoint_portfolio)
+        self.assertFalse(StagedOrder.objects.exists())
+        self.assertEqual(
+            sorted(
+                Order.objects.filter(
+                    user=self.user, stock=self.stock
+                ).values_list("quantity", flat=True)
+            ),
+            [-6, -4, 10],
+        )
+
     def test_invalid_order_type(self):
         self.add_data(
             OrderData(self.user.id, self.stock.symbol, "10", "INVALID")
@@ -320,3 +1017,651 @@ class TradeDataFileProcessorTestCase(CSVBuilderMixin, TestCase):
         processor = TradeDataFileProcessor(trade_data_file)
         with self.assertRaises(InvalidImportFile):
             processor.process()
+
+
+class ProcessingProgressTestCase(CSVBuilderMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches[settings.TRADE_DATA_FILE_PROGRESS_CACHE].clear()
+        self.user = UserFactory()
+        self.stock = StockFactory()
+        for _ in range(5):
+            self.add_data(
+                OrderData(self.user.id, self.stock.symbol, "10", "BUY")
+            )
+        filename, content = self.write_csv()
+        self.trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+    def test_process_file_progress(self):
+        processor = TradeDataFileProcessor(self.trade_data_file)
+        processor.batch_size = 2
+        processor.process()
+
+        progress = ProcessingProgress.get(self.trade_data_file.pk)
+        self.assertEqual(progress["rows"], 5)
+        self.assertEqual(
+            progress["bytes"], self.trade_data_file.uploaded_file.size
+        )
+        self.assertEqual(progress["total_bytes"], progress["bytes"])
+        self.assertEqual(progress["eta_seconds"], 0)
+        self.assertEqual(
+            list(progress["stage_seconds"]),
+            ["parse", "cache", "validate", "write"],
+        )
+
+    @override_settings(TRADE_DATA_FILE_PROGRESS_INTERVAL=3600)
+    def test_progress_interval(self):
+        """Progress is only published once per interval"""
+        progress = ProcessingProgress(
+            get_progress_cache_key(self.trade_data_file.pk), total_bytes=100
+        )
+        progress.update(10, 20)
+        progress.update(20, 40)
+        self.assertEqual(
+            ProcessingProgress.get(self.trade_data_file.pk)["rows"], 10
+        )
+
+        progress.update(30, 50, publish=True)
+        published = ProcessingProgress.get(self.trade_data_file.pk)
+        self.assertEqual(published["rows"], 30)
+        self.assertEqual(published["bytes"], 50)
+        self.assertGreaterEqual(published["eta_seconds"], 0)
+
+    @override_settings(TRADE_DATA_FILE_SHARDS=2)
+    def test_shard_progress(self):
+        """Progress of sharded files is summed over the shards"""
+        processor = TradeDataFileProcessor(self.trade_data_file)
+        shard_files = processor.split_into_shards(2)
+        TradeDataFileShardProcessor(
+            self.trade_data_file, 0, shard_files[0]
+        ).process()
+        self.assertEqual(
+            ProcessingProgress.get(self.trade_data_file.pk)["rows"],
+            5 if self.user.id % 2 == 0 else 0,
+        )
+
+        TradeDataFileShardProcessor(
+            self.trade_data_file, 1, shard_files[1]
+        ).process()
+        progress = ProcessingProgress.get(self.trade_data_file.pk)
+        self.assertEqual(progress["rows"], 5)
+        self.assertEqual(progress["bytes"], progress["total_bytes"])
+        self.assertEqual(
+            progress["total_bytes"],
+            sum(os.path.getsize(shard_file) for shard_file in shard_files),
+        )
+        self.assertEqual(progress["eta_seconds"], 0)
+        processor.delete_shard_files()
+
+
+class TradeDataFileDryRunTestCase(CSVBuilderMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserFactory()
+        self.stock = StockFactory()
+        OrderFactory(user=self.user, stock=self.stock, quantity=10)
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        self.add_data(OrderData(self.user.id, "INVALID", "5", "BUY"))
+        # over the balance, not applied to the rows after it
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "20", "SELL"))
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "1", "SELL"))
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "x", "BUY"))
+
+    def build_uploaded_file(self) -> SimpleUploadedFile:
+        filename, content = self.write_csv()
+        return SimpleUploadedFile(filename, content.encode("utf-8"))
+
+    def assert_dry_run_result(self, result: dict):
+        self.assertEqual(result["rows"], 6)
+        self.assertEqual(result["error_count"], 4)
+        self.assertEqual(
+            [error["row"] for error in result["errors"]], [2, 3, 5, 6]
+        )
+        self.assertIn("INVALID", result["errors"][0]["error"])
+        self.assertIn("Stock available: 5", result["errors"][1]["error"])
+        self.assertIn("Stock available: 0", result["errors"][2]["error"])
+
+    def assert_nothing_written(self):
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertFalse(StagedOrder.objects.exists())
+        self.assertEqual(
+            Position.objects.get(user=self.user, stock=self.stock).quantity,
+            10,
+        )
+
+    def test_dry_run(self):
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=self.build_uploaded_file(),
+        )
+        processor = TradeDataFileProcessor(trade_data_file)
+        processor.batch_size = 2
+
+        self.assert_dry_run_result(processor.dry_run())
+        self.assert_nothing_written()
+        trade_data_file.refresh_from_db()
+        self.assertEqual(trade_data_file.status, TradeDataFile.NEW)
+
+    def test_dry_run_parquet(self):
+        labels = self.to_csv_headers(OrderData._fields)
+        table = pa.table(
+            {
+                label: pa.array([str(value) for value in values])
+                for label, values in zip(labels, zip(*self.data_list))
+            }
+        )
+        sink = io.BytesIO()
+        pq.write_table(table, sink, row_group_size=2)
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile("test.parquet", sink.getvalue()),
+        )
+
+        processor = TradeDataFileProcessor(trade_data_file)
+        self.assert_dry_run_result(processor.dry_run())
+        self.assert_nothing_written()
+
+    @override_settings(TRADE_DATA_FILE_DRY_RUN_MAX_ERRORS=1)
+    def test_dry_run_max_errors(self):
+        result = dry_run_trade_data_file(self.build_uploaded_file())
+
+        self.assertEqual(result["error_count"], 4)
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertFalse(TradeDataFile.objects.exists())
+        self.assert_nothing_written()
+
+    def test_dry_run_missing_header(self):
+        self.data_list = [InvalidOrderData(self.user.id, "AAPL", "1")]
+        result = dry_run_trade_data_file(self.build_uploaded_file())
+
+        self.assertEqual(result["rows"], 0)
+        self.assertEqual(result["errors"][0]["row"], None)
+        self.assertIn("Order Type", result["errors"][0]["error"])
+
+    def test_dry_run_short_row(self):
+        """Rows missing values are reported, the rows after them are still
+        checked
+        """
+        filename, content = self.write_csv()
+        lines = content.splitlines()
+        lines.insert(2, f"{self.user.id},{self.stock.symbol}")
+        result = dry_run_trade_data_file(
+            SimpleUploadedFile(filename, "\r\n".join(lines).encode("utf-8"))
+        )
+
+        self.assertEqual(result["rows"], 7)
+        self.assertEqual(result["error_count"], 5)
+        self.assertEqual(
+            [error["row"] for error in result["errors"]], [2, 3, 4, 6, 7]
+        )
+        self.assertIn("missing values", result["errors"][0]["error"])
+
+    def test_dry_run_not_utf8(self):
+        filename, content = self.write_csv()
+        result = dry_run_trade_data_file(
+            SimpleUploadedFile(
+                filename, content.encode("utf-8") + "é,x,1,BUY".encode("cp1252")
+            )
+        )
+
+        self.assertEqual(result["rows"], 6)
+        self.assertEqual(result["errors"][-1]["row"], None)
+        self.assertIn("UTF-8", result["errors"][-1]["error"])
+
+    def test_dry_run_truncated_gzip(self):
+        filename, content = self.write_csv()
+        compressed = gzip.compress(content.encode("utf-8"))
+        result = dry_run_trade_data_file(
+            SimpleUploadedFile(
+                f"{filename}.gz", compressed[: len(compressed) // 2]
+            )
+        )
+
+        self.assertLess(result["rows"], 6)
+        self.assertEqual(result["errors"][-1]["row"], None)
+        self.assertIn("ended", result["errors"][-1]["error"])
+        self.assert_nothing_written()
+
+    def test_dry_run_invalid_parquet(self):
+        result = dry_run_trade_data_file(
+            SimpleUploadedFile("test.parquet", b"PAR1 not a parquet file")
+        )
+
+        self.assertEqual(result["rows"], 0)
+        self.assertEqual(result["errors"][0]["row"], None)
+
+
+class TradeDataFileShardProcessorTestCase(CSVBuilderMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [UserFactory() for _ in range(3)]
+        self.stock = StockFactory()
+        for user in self.users:
+            self.add_data(OrderData(user.id, self.stock.symbol, "10", "BUY"))
+        for user in self.users:
+            self.add_data(OrderData(user.id, self.stock.symbol, "4", "SELL"))
+
+        filename, content = self.write_csv()
+        self.trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+    def read_shard(self, shard_file: str) -> list[tuple]:
+        return [(row["user"], row["quantity"]) for row in CSVParser(shard_file)]
+
+    def test_split_into_shards(self):
+        processor = TradeDataFileProcessor(self.trade_data_file)
+        shard_files = processor.split_into_shards(2)
+
+        self.assertEqual(len(shard_files), 2)
+        for shard, shard_file in enumerate(shard_files):
+            self.assertEqual(
+                self.read_shard(shard_file),
+                [
+                    (user.id, quantity)
+                    for quantity in (10, 4)
+                    for user in self.users
+                    if user.id % 2 == shard
+                ],
+            )
+
+        processor.delete_shard_files()
+        self.assertFalse(os.path.exists(processor.get_shard_dir()))
+
+    def test_process_shards(self):
+        processor = TradeDataFileProcessor(self.trade_data_file)
+        shard_files = processor.split_into_shards(2)
+
+        for shard, shard_file in enumerate(shard_files):
+            shard_processor = TradeDataFileShardProcessor(
+                self.trade_data_file, shard, shard_file
+            )
+            # shards do not save checkpoints
+            self.assertFalse(shard_processor.portfolio_cache.track_deltas)
+            shard_processor.process()
+
+        self.assertEqual(StagedOrder.objects.count(), 6)
+        self.assertFalse(Order.objects.exists())
+
+        processor.publish()
+        self.trade_data_file.refresh_from_db()
+        self.assertEqual(self.trade_data_file.status, TradeDataFile.PROCESSED)
+        self.assertFalse(StagedOrder.objects.exists())
+        for user in self.users:
+            self.assertEqual(
+                Order.objects.get_available_balance(
+                    stock=self.stock, user=user
+                ),
+                6,
+            )
+
+    def test_process_shard_failed(self):
+        """A failing shard only discards its own staged orders"""
+        self.add_data(
+            OrderData(self.users[0].id, self.stock.symbol, "9", "SELL")
+        )
+        filename, content = self.write_csv()
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+        shard_files = TradeDataFileProcessor(trade_data_file).split_into_shards(
+            2
+        )
+        failing_shard = self.users[0].id % 2
+
+        TradeDataFileShardProcessor(
+            trade_data_file, 1 - failing_shard, shard_files[1 - failing_shard]
+        ).process()
+        with self.assertRaises(InvalidImportFile):
+            TradeDataFileShardProcessor(
+                trade_data_file, failing_shard, shard_files[failing_shard]
+            ).process()
+
+        self.assertEqual(
+            set(StagedOrder.objects.values_list("shard", flat=True)),
+            {1 - failing_shard},
+        )
+
+
+class ColumnarTradeDataFileProcessorTestCase(CSVBuilderMixin, TestCase):
+    """Columnar validation must give the same orders and errors as the row
+    by row validation
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+        self.stock = StockFactory()
+        self.stock2 = StockFactory()
+        OrderFactory(user=self.user, stock=self.stock, quantity=10)
+
+    def create_trade_data_file(self, columnar: bool) -> TradeDataFile:
+        filename, content = self.write_csv()
+        return TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+    def clean_file(self, columnar: bool) -> list[dict] | str:
+        trade_data_file = self.create_trade_data_file(columnar)
+        processor = TradeDataFileProcessor(trade_data_file, columnar=columnar)
+        processor.batch_size = processor.columnar_batch_size = 2
+        orders = []
+        try:
+            for batch in processor.iter_order_batches():
+                orders.extend(batch)
+        except InvalidImportFile as e:
+            return str(e)
+        return [
+            (
+                values.get("user_id") or values["user"].id,
+                values.get("stock_id") or values["stock"].id,
+                values["quantity"],
+                values["order_type"],
+            )
+            for values in orders
+        ]
+
+    def assert_same_result(self) -> list[tuple] | str:
+        result = self.clean_file(columnar=True)
+        self.assertEqual(result, self.clean_file(columnar=False))
+        return result
+
+    def test_valid_file(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        self.add_data(OrderData(self.user2.id, self.stock.symbol, "7", "BUY"))
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        self.add_data(OrderData(self.user2.id, self.stock2.symbol, "3", "BUY"))
+        self.add_data(OrderData(self.user2.id, self.stock.symbol, "7", "SELL"))
+
+        self.assertEqual(
+            self.assert_same_result(),
+            [
+                (self.user.id, self.stock.id, -5, Order.SELL),
+                (self.user2.id, self.stock.id, 7, Order.BUY),
+                (self.user.id, self.stock.id, -5, Order.SELL),
+                (self.user2.id, self.stock2.id, 3, Order.BUY),
+                (self.user2.id, self.stock.id, -7, Order.SELL),
+            ],
+        )
+
+    def test_insufficient_balance(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "4", "SELL"))
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "4", "SELL"))
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "4", "SELL"))
+        self.add_data(OrderData(self.user.id, "NONE", "4", "SELL"))
+
+        self.assertIn("Stock available: 2", self.assert_same_result())
+
+    def test_invalid_values(self):
+        max_id = User.objects.aggregate(max=Max("id"))["max"]
+        invalid_rows = [
+            OrderData(self.user.id, self.stock.symbol, "10", "INVALID"),
+            OrderData(self.user.id, self.stock.symbol, "INVALID", "BUY"),
+            OrderData(max_id + 100, self.stock.symbol, "10", "BUY"),
+            OrderData("INVALID", self.stock.symbol, "10", "BUY"),
+            OrderData(self.user.id, "NONE", "10", "BUY"),
+            OrderData(self.user.id, "NONE", "INVALID", "INVALID"),
+        ]
+        for row in invalid_rows:
+            with self.subTest(row=row):
+                self.data_list = [
+                    OrderData(self.user.id, self.stock.symbol, "1", "BUY"),
+                    row,
+                ]
+                self.assertIsInstance(self.assert_same_result(), str)
+
+    def test_process_file(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        filename, content = self.write_csv()
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+        processor = TradeDataFileProcessor(trade_data_file, columnar=True)
+        self.assertIsInstance(processor.parser, ColumnarCSVParser)
+        processor.process()
+
+        self.assertEqual(
+            sorted(
+                Order.objects.filter(
+                    user=self.user, stock=self.stock
+                ).values_list("quantity", flat=True)
+            ),
+            [-5, 10],
+        )
+
+
+class ParquetTradeDataFileProcessorTestCase(
+    ColumnarTradeDataFileProcessorTestCase
+):
+    """Typed files must give the same orders and errors as CSV files"""
+
+    file_format = PARQUET_FORMAT
+
+    def write_typed_file(self) -> bytes:
+        columns = {}
+        labels = self.to_csv_headers(OrderData._fields)
+        for label, values in zip(labels, zip(*self.data_list)):
+            try:
+                columns[label] = pa.array([int(value) for value in values])
+            except ValueError:
+                columns[label] = pa.array([str(value) for value in values])
+        return self.write_table(pa.table(columns))
+
+    def write_table(self, table: pa.Table) -> bytes:
+        sink = io.BytesIO()
+        if self.file_format == PARQUET_FORMAT:
+            pq.write_table(table, sink, row_group_size=2)
+        else:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=2)
+        return sink.getvalue()
+
+    def create_trade_data_file(self, columnar: bool) -> TradeDataFile:
+        if not columnar:
+            return super().create_trade_data_file(columnar)
+        return TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(
+                f"test.{self.file_format}", self.write_typed_file()
+            ),
+        )
+
+    def test_process_file(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        trade_data_file = self.create_trade_data_file(columnar=True)
+
+        processor = TradeDataFileProcessor(trade_data_file)
+        self.assertIsInstance(processor.parser, ArrowParser)
+        self.assertTrue(processor.columnar)
+        processor.process()
+
+        self.assertEqual(
+            sorted(
+                Order.objects.filter(
+                    user=self.user, stock=self.stock
+                ).values_list("quantity", flat=True)
+            ),
+            [-5, 10],
+        )
+
+    def test_null_values(self):
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "SELL"))
+        table = pa.table(
+            {
+                "User": pa.array([self.user.id, None]),
+                "Stock": pa.array([self.stock.symbol, self.stock.symbol]),
+                "Quantity": pa.array([1, 1]),
+                "Order Type": pa.array(["BUY", None]),
+            }
+        )
+        sink = io.BytesIO()
+        pq.write_table(table, sink)
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile("test.parquet", sink.getvalue()),
+        )
+
+        processor = TradeDataFileProcessor(trade_data_file)
+        with self.assertRaisesMessage(InvalidImportFile, "Invalid order type"):
+            list(processor.iter_order_batches())
+
+    def test_non_integer_values(self):
+        """Typed numbers that aren't integers are rejected, not truncated"""
+        for user, quantity, error in [
+            (self.user.id, 10.7, "Invalid quantity: 10.7"),
+            (float(self.user.id), 10, f"User ({float(self.user.id)}) not"),
+            (self.user.id, True, "Invalid quantity: True"),
+        ]:
+            table = pa.table(
+                {
+                    "User": pa.array([user]),
+                    "Stock": pa.array([self.stock.symbol]),
+                    "Quantity": pa.array([quantity]),
+                    "Order Type": pa.array(["BUY"]),
+                }
+            )
+            trade_data_file = TradeDataFileFactory(
+                uploaded_file=SimpleUploadedFile(
+                    f"test.{self.file_format}", self.write_table(table)
+                ),
+            )
+
+            processor = TradeDataFileProcessor(trade_data_file)
+            with self.assertRaisesMessage(InvalidImportFile, error):
+                list(processor.iter_order_batches())
+            result = TradeDataFileProcessor(trade_data_file).dry_run()
+            self.assertIn(error, result["errors"][0]["error"])
+
+    def test_missing_header(self):
+        table = pa.table({"User": [1], "Stock": ["AAA"], "Quantity": [1]})
+        sink = io.BytesIO()
+        pq.write_table(table, sink)
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile("test.parquet", sink.getvalue()),
+        )
+
+        processor = TradeDataFileProcessor(trade_data_file)
+        with self.assertRaisesMessage(InvalidImportFile, "Order Type"):
+            list(processor.iter_order_batches())
+
+    def test_seek(self):
+        """Checkpoint offsets of typed files are row numbers"""
+        for quantity in range(1, 8):
+            self.add_data(
+                OrderData(self.user.id, self.stock.symbol, quantity, "BUY")
+            )
+        path = self.create_trade_data_file(columnar=True).uploaded_file.path
+
+        parser = ArrowParser(path, self.file_format)
+        parser.seek(3, 3)
+        quantities = [
+            quantity
+            for columns in parser.iter_batches(batch_size=3)
+            for quantity in columns["quantity"].tolist()
+        ]
+        self.assertEqual(quantities, [4, 5, 6, 7])
+        self.assertEqual(parser.offset, 7)
+        self.assertEqual(parser.row_number, 7)
+
+    def test_parser_reads_batches_only(self):
+        """Typed files are read in batches, the parser has no row iteration"""
+        self.add_data(OrderData(self.user.id, self.stock.symbol, 1, "BUY"))
+        path = self.create_trade_data_file(columnar=True).uploaded_file.path
+
+        parser = ArrowParser(path, self.file_format)
+        self.assertNotIsInstance(parser, CSVParser)
+        with self.assertRaises(TypeError):
+            iter(parser)
+        parser.open()
+        self.assertEqual(
+            [header for header, _ in parser.columns],
+            ["user", "stock", "quantity", "order_type"],
+        )
+        parser.close()
+
+
+class ArrowTradeDataFileProcessorTestCase(
+    ParquetTradeDataFileProcessorTestCase
+):
+    file_format = ARROW_FORMAT
+
+
+class ConflictingFilesTestCase(CSVBuilderMixin, TestCase):
+    def test_scan_order_keys(self):
+        self.add_data(OrderData("1", "AAA", "10", "BUY"))
+        self.add_data(OrderData(" 2 ", "BBB ", "5", "BUY"))
+        self.add_data(OrderData("1", "AAA", "-2", "SELL"))
+
+        self.assertEqual(
+            scan_order_keys(self.build_csv_file()), {(1, "AAA"), (2, "BBB")}
+        )
+
+    def test_scan_order_keys_parquet(self):
+        table = pa.table({"User": [1, 2], "Stock": ["AAA", "BBB"]})
+        table = table.append_column("Quantity", pa.array([1, 1]))
+        table = table.append_column("Order Type", pa.array(["BUY", "BUY"]))
+        sink = io.BytesIO()
+        pq.write_table(table, sink)
+        csv_file = self.save_uploaded_file("test.parquet", sink.getvalue())
+
+        self.assertEqual(scan_order_keys(csv_file), {(1, "AAA"), (2, "BBB")})
+
+    def test_scan_order_keys_invalid_file(self):
+        self.add_data(InvalidOrderData("1", "AAA", "10"))
+
+        self.assertEqual(scan_order_keys(self.build_csv_file()), set())
+
+    def test_group_conflicting_files(self):
+        groups = group_conflicting_files(
+            {
+                1: {(1, "AAA")},
+                2: {(2, "BBB")},
+                3: {(3, "CCC"), (2, "BBB")},
+                4: set(),
+                5: {(3, "CCC")},
+                6: {(1, "BBB")},
+            }
+        )
+
+        self.assertEqual(groups, [[1], [2, 3, 5], [4], [6]])
+
+
+class StoreTradeDataCsvFileTestCase(CSVBuilderMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_data(OrderData("1", "AAA", "10", "BUY"))
+        filename, content = self.write_csv()
+        self.content = content.encode("utf-8")
+
+        drop_dir = Path(self.upload_storage_dir).joinpath("drop")
+        drop_dir.mkdir(parents=True)
+        self.source = drop_dir.joinpath(filename)
+        self.source.write_bytes(self.content)
+
+    def test_store_hardlink(self):
+        name = store_trade_data_csv_file(self.source)
+
+        self.assertTrue(name.startswith(settings.CSV_UPLOAD_PATH))
+        self.assertTrue(
+            os.path.samefile(self.source, default_storage.path(name))
+        )
+
+    def test_store_stream(self):
+        """Files on another filesystem are streamed to storage"""
+        with mock.patch(
+            "trading.services.os.link", side_effect=OSError(errno.EXDEV, "")
+        ):
+            name = store_trade_data_csv_file(self.source)
+
+        self.assertFalse(
+            os.path.samefile(self.source, default_storage.path(name))
+        )
+        with default_storage.open(name, "rb") as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_store_existing_name(self):
+        first = store_trade_data_csv_file(self.source)
+        second = store_trade_data_csv_file(self.source)
+
+        self.assertNotEqual(first, second)
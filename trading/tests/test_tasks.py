@@ -1,7 +1,12 @@
+import gzip
 import pathlib
+from datetime import timedelta
 
 import mock
+from celery import chain
+from celery.exceptions import SoftTimeLimitExceeded
 from django.contrib.auth.models import User
+from django.core.files import File
 from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db.models import Max
@@ -9,6 +14,7 @@ from django.test import (
     TestCase,
     override_settings,
 )
+from django.utils import timezone
 from trading.factories import (
     OrderFactory,
     StockFactory,
@@ -16,12 +22,17 @@ from trading.factories import (
     UserFactory,
 )
 from trading.models import (
+    HoldingsSnapshot,
     Order,
+    StagedOrder,
     TradeDataFile,
 )
+from trading.services import compute_content_digest
 from trading.tasks import (
     fetch_trade_data_csv_file,
     process_trade_data_file,
+    schedule_trade_data_files,
+    take_holdings_snapshot,
 )
 from trading.tests.test_services import (
     CSVBuilderMixin,
@@ -46,8 +57,9 @@ class ProcessTradeDataFileTaskTestCase(CSVBuilderMixin, TestCase):
     def test_process_file(self):
         process_trade_data_file.delay(self.trade_data_file.id)
 
+        # set in the same transaction as the orders
         self.trade_data_file.refresh_from_db()
-        self.assertEqual(self.trade_data_file.status, TradeDataFile.PROCESSING)
+        self.assertEqual(self.trade_data_file.status, TradeDataFile.PROCESSED)
 
         self.assertTrue(
             Order.objects.filter(
@@ -74,6 +86,55 @@ class ProcessTradeDataFileTaskTestCase(CSVBuilderMixin, TestCase):
             ).exists()
         )
 
+    def assert_redelivery_ignored(self):
+        """A finished file is not ingested again when its task is
+        redelivered
+        """
+        with mock.patch("django.db.transaction.on_commit", lambda t: t()):
+            process_trade_data_file.delay(self.trade_data_file.id)
+            process_trade_data_file.delay(self.trade_data_file.id)
+
+        self.trade_data_file.refresh_from_db()
+        self.assertEqual(self.trade_data_file.status, TradeDataFile.PROCESSED)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertFalse(StagedOrder.objects.exists())
+
+    def test_process_file_redelivered(self):
+        self.assert_redelivery_ignored()
+
+    @override_settings(TRADE_DATA_FILE_USE_STAGING=True)
+    def test_process_file_redelivered_staging(self):
+        self.assert_redelivery_ignored()
+
+    def test_process_failed_file_redelivered(self):
+        self.trade_data_file.status = TradeDataFile.FAILED
+        self.trade_data_file.save()
+
+        process_trade_data_file.delay(self.trade_data_file.id)
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(TRADE_DATA_FILE_USE_STAGING=True)
+    def test_process_file_soft_time_limit_retry(self):
+        with mock.patch(
+            "trading.tasks.TradeDataFileProcessor.process",
+            side_effect=[SoftTimeLimitExceeded(), None],
+        ) as process:
+            process_trade_data_file.delay(self.trade_data_file.id)
+
+        self.assertEqual(process.call_count, 2)
+        self.trade_data_file.refresh_from_db()
+        self.assertNotEqual(self.trade_data_file.status, TradeDataFile.FAILED)
+
+    def test_process_file_soft_time_limit(self):
+        with mock.patch(
+            "trading.tasks.TradeDataFileProcessor.process",
+            side_effect=SoftTimeLimitExceeded(),
+        ):
+            process_trade_data_file.delay(self.trade_data_file.id)
+
+        self.trade_data_file.refresh_from_db()
+        self.assertEqual(self.trade_data_file.status, TradeDataFile.FAILED)
+
     def test_invalid_order_type(self):
         self.add_data(
             OrderData(self.user.id, self.stock.symbol, "10", "INVALID")
@@ -170,6 +231,62 @@ class ProcessTradeDataFileTaskTestCase(CSVBuilderMixin, TestCase):
         self.assertIn("Invalid quantity: INVALID", trade_data_file.errors)
 
 
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    TRADE_DATA_FILE_SHARDS=3,
+    TRADE_DATA_FILE_SHARD_MIN_SIZE=0,
+)
+class ProcessTradeDataFileShardsTaskTestCase(CSVBuilderMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [UserFactory() for _ in range(4)]
+        self.stock = StockFactory()
+        for user in self.users:
+            self.add_data(OrderData(user.id, self.stock.symbol, "10", "BUY"))
+            self.add_data(OrderData(user.id, self.stock.symbol, "3", "SELL"))
+
+    def create_trade_data_file(self) -> TradeDataFile:
+        filename, content = self.write_csv()
+        return TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(filename, content.encode("utf-8")),
+        )
+
+    def test_process_file_shards(self):
+        trade_data_file = self.create_trade_data_file()
+
+        # applied directly, eager delay() denies joining the replacing chord
+        process_trade_data_file.apply((trade_data_file.id,))
+
+        trade_data_file.refresh_from_db()
+        self.assertEqual(trade_data_file.status, TradeDataFile.PROCESSED)
+        self.assertIsNotNone(trade_data_file.completed_at)
+        self.assertFalse(StagedOrder.objects.exists())
+        self.assertEqual(Order.objects.count(), 8)
+        for user in self.users:
+            self.assertEqual(
+                Order.objects.get_available_balance(
+                    stock=self.stock, user=user
+                ),
+                7,
+            )
+
+    def test_process_file_shards_failed(self):
+        """The file fails as a whole when one shard fails"""
+        self.add_data(
+            OrderData(self.users[0].id, self.stock.symbol, "8", "SELL")
+        )
+        trade_data_file = self.create_trade_data_file()
+
+        # applied directly, eager delay() denies joining the replacing chord
+        process_trade_data_file.apply((trade_data_file.id,))
+
+        trade_data_file.refresh_from_db()
+        self.assertEqual(trade_data_file.status, TradeDataFile.FAILED)
+        self.assertIn("Not enough stock balance", trade_data_file.errors)
+        self.assertFalse(StagedOrder.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+
 @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 class FetchTradeDataFileTaskTestCase(CSVBuilderMixin, TestCase):
     def setUp(self):
@@ -220,3 +337,205 @@ class FetchTradeDataFileTaskTestCase(CSVBuilderMixin, TestCase):
 
         orders = Order.objects.filter(user=self.user, order_type=Order.BUY)
         self.assertEqual(orders.count(), 2)
+
+    def test_fetch_trade_data_file_task_conflicting_files(self):
+        """Files sharing a (user, stock) pair are chained, others run
+        concurrently
+        """
+        user2 = UserFactory()
+        self.data_list = []
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "BUY"))
+        self.build_csv_file()
+        self.data_list = []
+        self.add_data(OrderData(user2.id, self.stock.symbol, "7", "BUY"))
+        self.build_csv_file()
+
+        with (
+            mock.patch("django.db.transaction.on_commit", lambda t: t()),
+            mock.patch("trading.tasks.chain", wraps=chain) as chain_mock,
+        ):
+            # called directly, eager chains cannot join inside another task
+            fetch_trade_data_csv_file()
+
+        self.assertEqual(
+            sorted(len(c.args) for c in chain_mock.call_args_list), [1, 2]
+        )
+        self.assertEqual(
+            TradeDataFile.objects.filter(
+                status=TradeDataFile.PROCESSED
+            ).count(),
+            3,
+        )
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            15,
+        )
+
+    def test_fetch_trade_data_file_task_schedules(self):
+        """Fetched files are scanned by the scheduling task, not while
+        fetching
+        """
+        self.data_list = []
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "BUY"))
+        self.build_csv_file()
+
+        with (
+            mock.patch("django.db.transaction.on_commit", lambda t: t()),
+            mock.patch("trading.tasks.scan_order_keys") as scan_order_keys,
+            mock.patch(
+                "trading.tasks.schedule_trade_data_files.delay"
+            ) as schedule,
+        ):
+            fetch_trade_data_csv_file()
+
+        scan_order_keys.assert_not_called()
+        schedule.assert_called_once_with(
+            list(
+                TradeDataFile.objects.order_by("pk").values_list(
+                    "pk", flat=True
+                )
+            )
+        )
+
+    def test_schedule_single_file(self):
+        """A single file is processed without scanning it"""
+        trade_data_file = TradeDataFileFactory(
+            uploaded_file=SimpleUploadedFile(
+                "test.csv", pathlib.Path(self.file_path).read_bytes()
+            ),
+        )
+        with mock.patch("trading.tasks.scan_order_keys") as scan_order_keys:
+            schedule_trade_data_files([trade_data_file.pk])
+
+        scan_order_keys.assert_not_called()
+        trade_data_file.refresh_from_db()
+        self.assertNotEqual(trade_data_file.status, TradeDataFile.NEW)
+
+    def test_schedule_corrupt_file(self):
+        """A file that can't be scanned runs on its own, the other files
+        are still grouped
+        """
+        content = pathlib.Path(self.file_path).read_bytes()
+        trade_data_files = [
+            TradeDataFileFactory(
+                uploaded_file=SimpleUploadedFile("test.csv", content)
+            ),
+            TradeDataFileFactory(
+                uploaded_file=SimpleUploadedFile(
+                    "corrupt.csv.gz", gzip.compress(content)[:20]
+                )
+            ),
+            TradeDataFileFactory(
+                uploaded_file=SimpleUploadedFile("test.csv", content)
+            ),
+        ]
+        with mock.patch("trading.tasks.chain", wraps=chain) as chain_mock:
+            schedule_trade_data_files([f.pk for f in trade_data_files])
+
+        self.assertEqual(
+            sorted(len(c.args) for c in chain_mock.call_args_list), [1, 2]
+        )
+        self.assertFalse(
+            TradeDataFile.objects.filter(status=TradeDataFile.NEW).exists()
+        )
+
+    def test_schedule_scan_failed(self):
+        """All files are chained when they can't be grouped"""
+        trade_data_files = [
+            TradeDataFileFactory(
+                uploaded_file=SimpleUploadedFile(
+                    "test.csv", pathlib.Path(self.file_path).read_bytes()
+                )
+            )
+            for _ in range(2)
+        ]
+        with (
+            mock.patch(
+                "trading.tasks.scan_order_keys",
+                side_effect=SoftTimeLimitExceeded(),
+            ),
+            mock.patch("trading.tasks.chain", wraps=chain) as chain_mock,
+        ):
+            schedule_trade_data_files([f.pk for f in trade_data_files])
+
+        self.assertEqual([len(c.args) for c in chain_mock.call_args_list], [2])
+        self.assertFalse(
+            TradeDataFile.objects.filter(status=TradeDataFile.NEW).exists()
+        )
+
+    def test_fetch_trade_data_file_task_duplicate(self):
+        """Files with the content of an existing file are skipped"""
+        with open(self.file_path, "rb") as f:
+            content_digest = compute_content_digest(File(f))
+        TradeDataFileFactory(
+            content_digest=content_digest, status=TradeDataFile.PROCESSED
+        )
+        self.build_csv_file()
+
+        fetch_trade_data_csv_file.delay()
+
+        self.assertFalse(pathlib.Path(self.file_path).exists())
+        self.assertEqual(TradeDataFile.objects.count(), 1)
+
+    def test_fetch_trade_data_file_task_compressed(self):
+        self.data_list = []
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "5", "BUY"))
+        _, content = self.write_csv()
+        file_path = self.save_uploaded_file(
+            "compressed.csv.gz", gzip.compress(content.encode("utf-8"))
+        )
+
+        with mock.patch("django.db.transaction.on_commit", lambda t: t()):
+            fetch_trade_data_csv_file()
+
+        self.assertFalse(pathlib.Path(file_path).exists())
+        self.assertEqual(
+            TradeDataFile.objects.filter(
+                status=TradeDataFile.PROCESSED
+            ).count(),
+            2,
+        )
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            15,
+        )
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, HOLDINGS_SNAPSHOT_LAG=60)
+class TakeHoldingsSnapshotTaskTestCase(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.stock = StockFactory()
+        self.order = OrderFactory(user=self.user, stock=self.stock, quantity=5)
+        Order.objects.filter(pk=self.order.pk).update(
+            created=timezone.now() - timedelta(minutes=5)
+        )
+
+    def test_take_holdings_snapshot(self):
+        day = (timezone.now() - timedelta(days=30)).replace(
+            hour=1, minute=0, second=0, microsecond=0
+        )
+        old_snapshot = HoldingsSnapshot.objects.create(taken_at=day)
+        HoldingsSnapshot.objects.create(taken_at=day + timedelta(hours=1))
+
+        take_holdings_snapshot.delay()
+
+        snapshot = HoldingsSnapshot.objects.first()
+        self.assertLess(
+            snapshot.taken_at, timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(
+            list(
+                snapshot.holdings.values_list("user_id", "stock_id", "quantity")
+            ),
+            [(self.user.id, self.stock.id, 5)],
+        )
+        # the later one of the same day was pruned
+        self.assertEqual(
+            list(HoldingsSnapshot.objects.order_by("taken_at")),
+            [old_snapshot, snapshot],
+        )
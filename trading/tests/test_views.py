@@ -1,8 +1,11 @@
+from concurrent.futures import Future
+from datetime import timedelta
 from decimal import Decimal
 
 import mock
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
@@ -12,10 +15,16 @@ from trading.factories import (
     UserFactory,
 )
 from trading.models import (
+    HoldingsSnapshot,
     Order,
     Stock,
     TradeDataFile,
 )
+from trading.services import (
+    GroupCommitOrderWriter,
+    OrderIntakeUnavailable,
+    stock_symbols,
+)
 from trading.tests.test_services import (
     CSVBuilderMixin,
     OrderData,
@@ -40,6 +49,32 @@ class TestStockViewSet(APITestCase):
         self.assertEqual(data[0]["symbol"], self.stock.symbol)
         self.assertEqual(data[0]["price"], str(self.stock.price.normalize()))
 
+    def test_not_modified(self):
+        """Polling with the ETag of an unchanged list returns a 304"""
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+        self.stock.price = self.stock.price + 1
+        self.stock.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(
+            response.json()[0]["price"], str(self.stock.price.normalize())
+        )
+
+    def test_cached_response(self):
+        response = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(self.url)
+        self.assertEqual(cached_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached_response.json(), response.json())
+
 
 class TestOrderViewSet(APITestCase):
     def setUp(self):
@@ -48,6 +83,31 @@ class TestOrderViewSet(APITestCase):
         self.order = OrderFactory(user=self.user, stock=self.stock)
         self.url = reverse("order-list")
 
+    def test_list_expired_by_order(self):
+        """A new order of the user expires the cached list"""
+        self.client.force_authenticate(user=self.user)
+        etag = self.client.get(self.url)["ETag"]
+        other_user = UserFactory()
+        OrderFactory(user=other_user, stock=self.stock)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        order = OrderFactory(user=self.user, stock=self.stock)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"][0]["id"], order.id)
+
+    def test_list_per_user(self):
+        """Users with the same query don't share cached lists"""
+        other_user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+        self.client.get(self.url)
+
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["results"], [])
+
     def test_get_list_order(self):
         """
         Test for listing all orders for user
@@ -55,7 +115,7 @@ class TestOrderViewSet(APITestCase):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        data = response.json()
+        data = response.json()["results"]
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]["id"], self.order.id)
         self.assertEqual(data[0]["quantity"], self.order.quantity)
@@ -70,9 +130,86 @@ class TestOrderViewSet(APITestCase):
         self.client.force_authenticate(user=user)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        data = response.json()
+        data = response.json()["results"]
         self.assertEqual(len(data), 0)
 
+    def test_get_list_order_pages(self):
+        """
+        Test for following the cursor through the pages of orders
+        """
+        orders = [self.order] + [
+            OrderFactory(user=self.user, stock=self.stock) for _ in range(4)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+        ids = []
+        url = f"{self.url}?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertLessEqual(len(data["results"]), 2)
+            ids.extend(order["id"] for order in data["results"])
+            url = data["next"]
+        self.assertEqual(ids, [order.id for order in reversed(orders)])
+
+    def test_get_list_order_pages_same_created(self):
+        """
+        Test for following the cursor through orders sharing their creation
+        time, like the orders of one trade data file
+        """
+        for _ in range(6):
+            OrderFactory(user=self.user, stock=self.stock)
+        Order.objects.filter(user=self.user).update(created=timezone.now())
+        expected = list(
+            Order.objects.filter(user=self.user)
+            .order_by("-id")
+            .values_list("id", flat=True)
+        )
+        self.client.force_authenticate(user=self.user)
+
+        pages = []
+        url = f"{self.url}?page_size=2"
+        while url:
+            data = self.client.get(url).json()
+            pages.append([order["id"] for order in data["results"]])
+            url = data["next"]
+        self.assertEqual(sum(pages, []), expected)
+
+        # walking back from the last page returns the same pages
+        previous = self.client.get(data["previous"]).json()
+        self.assertEqual(
+            [order["id"] for order in previous["results"]], pages[-2]
+        )
+        while previous["previous"]:
+            previous = self.client.get(previous["previous"]).json()
+        self.assertEqual(
+            [order["id"] for order in previous["results"]], pages[0]
+        )
+
+    def test_get_list_order_filters(self):
+        """
+        Test for filtering orders by stock and order type
+        """
+        stock = StockFactory()
+        buy = OrderFactory(user=self.user, stock=stock)
+        sell = OrderFactory(
+            user=self.user, stock=stock, quantity=-1, order_type=Order.SELL
+        )
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.url, {"stock": stock.id})
+        self.assertEqual(
+            [order["id"] for order in response.json()["results"]],
+            [sell.id, buy.id],
+        )
+        response = self.client.get(
+            self.url, {"stock": stock.id, "order_type": Order.SELL}
+        )
+        self.assertEqual(
+            [order["id"] for order in response.json()["results"]], [sell.id]
+        )
+
     def test_get_list_order_non_loggedin_user(self):
         """
         Test for listing all orders for non loggedin user
@@ -95,6 +232,113 @@ class TestOrderViewSet(APITestCase):
         self.assertEqual(data["order_type"], Order.BUY)
         self.assertEqual(data["stock"], self.stock.id)
 
+    def test_create_order_idempotent(self):
+        """
+        Test for retrying an order with the same idempotency key
+        """
+        self.client.force_authenticate(user=self.user)
+        data = {
+            "stock": self.stock.id,
+            "quantity": 10,
+            "order_type": Order.SELL,
+            "idempotency_key": "key-1",
+        }
+        responses = [self.client.post(self.url, data) for _ in range(2)]
+        for response in responses:
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            0,
+        )
+
+    @override_settings(ORDER_GROUP_COMMIT=True)
+    def test_create_order_group_commit(self):
+        """
+        Test for placing orders through the group commit writer
+        """
+
+        class InlineWriter(GroupCommitOrderWriter):
+            def submit(self, user, values):
+                future = Future()
+                self.commit([(user, values, future)])
+                return future
+
+        self.client.force_authenticate(user=self.user)
+        with mock.patch(
+            "trading.serializers.get_group_commit_writer",
+            return_value=InlineWriter(),
+        ):
+            response = self.client.post(
+                self.url,
+                {
+                    "stock": self.stock.id,
+                    "quantity": 4,
+                    "order_type": Order.SELL,
+                    "idempotency_key": "key-1",
+                },
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.json()["quantity"], -4)
+
+            response = self.client.post(
+                self.url,
+                {
+                    "stock": self.stock.id,
+                    "quantity": 7,
+                    "order_type": Order.SELL,
+                    "idempotency_key": "key-2",
+                },
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(
+                "Not enough stock balance. Stock available: 6",
+                response.json(),
+            )
+
+    @override_settings(ORDER_GROUP_COMMIT=True)
+    def test_create_order_group_commit_unavailable(self):
+        self.client.force_authenticate(user=self.user)
+        with mock.patch(
+            "trading.serializers.get_group_commit_writer"
+        ) as get_writer:
+            get_writer.return_value.place.side_effect = OrderIntakeUnavailable
+            response = self.client.post(
+                self.url,
+                {
+                    "stock": self.stock.id,
+                    "quantity": 4,
+                    "order_type": Order.BUY,
+                    "idempotency_key": "key-1",
+                },
+            )
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    @override_settings(ORDER_GROUP_COMMIT=True)
+    def test_create_order_group_commit_idempotency_key_required(self):
+        """
+        Test for rejecting group commit orders without an idempotency key
+        """
+        self.client.force_authenticate(user=self.user)
+        with mock.patch(
+            "trading.serializers.get_group_commit_writer"
+        ) as get_writer:
+            response = self.client.post(
+                self.url,
+                {
+                    "stock": self.stock.id,
+                    "quantity": 4,
+                    "order_type": Order.BUY,
+                },
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("idempotency_key", response.json())
+        get_writer.return_value.place.assert_not_called()
+
     def test_create_sell_order(self):
         """
         Test for create sell order
@@ -154,6 +398,68 @@ class TestOrderViewSet(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_buy_order_invalid_stock(self):
+        """
+        Test for create buy order with a stock that doesn't exist
+        """
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            self.url,
+            {
+                "stock": self.stock.id + 1,
+                "quantity": 10,
+                "order_type": Order.BUY,
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("stock", response.json())
+
+    def test_create_batch(self):
+        """
+        Test for placing a batch of orders with per order results
+        """
+        self.client.force_authenticate(user=self.user)
+        batch = [
+            {"stock": self.stock.id, "quantity": 5, "order_type": 1},
+            {"stock": self.stock.id, "quantity": 15, "order_type": 2},
+            {"stock": self.stock.id, "quantity": 0, "order_type": 1},
+            {"stock": self.stock.id, "quantity": 16, "order_type": 2},
+        ]
+        with mock.patch.object(
+            stock_symbols, "refresh", wraps=stock_symbols.refresh
+        ) as refresh:
+            response = self.client.post(
+                reverse("order-batch"), {"orders": batch}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # once per request, not per order
+        refresh.assert_called_once_with()
+
+        results = response.json()["results"]
+        orders = Order.objects.filter(user=self.user).order_by("id")
+        self.assertEqual(results[0]["id"], orders[1].id)
+        self.assertEqual(results[1]["id"], orders[2].id)
+        self.assertEqual(results[1]["quantity"], -15)
+        self.assertIn("quantity", results[2]["errors"])
+        self.assertEqual(
+            results[3]["errors"]["non_field_errors"],
+            ["Not enough stock balance. Stock available: 0"],
+        )
+        self.assertEqual(orders.count(), 3)
+        self.assertEqual(
+            Order.objects.get_available_balance(
+                stock=self.stock, user=self.user
+            ),
+            0,
+        )
+
+    def test_create_batch_invalid(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            reverse("order-batch"), {"orders": []}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 class TestTradeDataFileViewSet(CSVBuilderMixin, APITestCase):
@@ -236,6 +542,101 @@ class TestTradeDataFileViewSet(CSVBuilderMixin, APITestCase):
         self.assertEqual(trade_data_file.status, TradeDataFile.NEW)
         self.assertIsNone(trade_data_file.uploaded_by_user)
 
+    def test_get_status(self):
+        """Retrieving a trade data file shows its processing progress"""
+        filename, content = self.write_csv()
+        with mock.patch("django.db.transaction.on_commit", lambda t: t()):
+            response = self.client.post(
+                self.url,
+                {
+                    "uploaded_file": SimpleUploadedFile(
+                        filename, content.encode("utf-8")
+                    )
+                },
+                format="multipart",
+            )
+        trade_data_file = TradeDataFile.objects.get(pk=response.json()["id"])
+
+        response = self.client.get(
+            reverse("tradedatafile-detail", args=[trade_data_file.pk])
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data["id"], trade_data_file.pk)
+        self.assertEqual(data["status"], "Processed")
+        self.assertIsNotNone(data["completed_at"])
+        self.assertEqual(data["progress"]["rows"], 1)
+        self.assertEqual(
+            data["progress"]["total_bytes"], trade_data_file.uploaded_file.size
+        )
+
+    def test_post_duplicate(self):
+        """Uploading the same content again returns the existing file"""
+        filename, content = self.write_csv()
+
+        with mock.patch(
+            "trading.serializers.process_trade_data_file"
+        ) as process_task:
+            responses = [
+                self.client.post(
+                    self.url,
+                    {
+                        "uploaded_file": SimpleUploadedFile(
+                            filename, content.encode("utf-8")
+                        )
+                    },
+                    format="multipart",
+                )
+                for _ in range(2)
+            ]
+
+        trade_data_file = TradeDataFile.objects.get()
+        for response in responses:
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.json()["id"], trade_data_file.id)
+        self.assertIsNotNone(trade_data_file.content_digest)
+        process_task.delay_on_commit.assert_called_once_with(trade_data_file.id)
+
+    def test_post_duplicate_failed(self):
+        """Content of a failed file can be uploaded again"""
+        filename, content = self.write_csv()
+        data = {
+            "uploaded_file": SimpleUploadedFile(
+                filename, content.encode("utf-8")
+            )
+        }
+        response = self.client.post(self.url, data, format="multipart")
+        TradeDataFile.objects.update(status=TradeDataFile.FAILED)
+
+        data["uploaded_file"].seek(0)
+        response2 = self.client.post(self.url, data, format="multipart")
+        self.assertNotEqual(response.json()["id"], response2.json()["id"])
+        self.assertEqual(TradeDataFile.objects.count(), 2)
+
+    def test_post_dry_run(self):
+        """A dry run reports invalid rows without creating anything"""
+        self.add_data(OrderData(self.user.id, self.stock.symbol, "20", "SELL"))
+        self.add_data(OrderData(self.user.id, "INVALID", "1", "BUY"))
+        filename, content = self.write_csv()
+
+        response = self.client.post(
+            reverse("tradedatafile-dry-run"),
+            {
+                "uploaded_file": SimpleUploadedFile(
+                    filename, content.encode("utf-8")
+                )
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data = response.json()
+        self.assertEqual(data["rows"], 3)
+        self.assertEqual(data["error_count"], 2)
+        self.assertEqual([error["row"] for error in data["errors"]], [2, 3])
+        self.assertFalse(TradeDataFile.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
 
 class TestInvestmentViewSet(APITestCase):
     def setUp(self):
@@ -252,7 +653,7 @@ class TestInvestmentViewSet(APITestCase):
         self.order6 = OrderFactory(user=self.user2, stock=self.stock2)
         self.url = reverse("investment-list")
 
-    def assert_total_value(self, response_data: dict):
+    def assert_total_value(self, response_data: list[dict]):
         for item in response_data:
             stock = Stock.objects.get(symbol=item["stock_symbol"])
             orders = Order.objects.filter(user_id=item["user_id"], stock=stock)
@@ -272,7 +673,7 @@ class TestInvestmentViewSet(APITestCase):
         response = self.client.get(self.url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        data = response.json()
+        data = response.json()["results"]
 
         self.assertEqual(len(data), 4)
         self.assert_total_value(data)
@@ -284,7 +685,7 @@ class TestInvestmentViewSet(APITestCase):
         response = self.client.get(self.url, {"user": self.user.id})
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        data = response.json()
+        data = response.json()["results"]
         self.assertEqual(len(data), 2)
         self.assert_total_value(data)
 
@@ -297,7 +698,7 @@ class TestInvestmentViewSet(APITestCase):
         )
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        data = response.json()
+        data = response.json()["results"]
         self.assertEqual(len(data), 2)
         self.assert_total_value(data)
 
@@ -307,6 +708,120 @@ class TestInvestmentViewSet(APITestCase):
         )
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        data = response.json()
+        data = response.json()["results"]
         self.assertEqual(len(data), 1)
         self.assert_total_value(data)
+
+    def test_pages(self):
+        response = self.client.get(self.url, {"page_size": 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(len(data["results"]), 3)
+        self.assertIsNotNone(data["next"])
+
+        response = self.client.get(data["next"])
+        data = response.json()
+        self.assertEqual(len(data["results"]), 1)
+        self.assertIsNone(data["next"])
+
+    def test_stock_price_change(self):
+        """The rollup value follows stock price changes"""
+        self.stock.price = self.stock.price * 2
+        self.stock.save()
+
+        response = self.client.get(
+            self.url, {"stock__symbol": self.stock.symbol}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assert_total_value(response.json()["results"])
+
+
+class TestInvestmentHistory(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.stock = StockFactory()
+        self.now = timezone.now()
+        self.create_order(10, hours_ago=5)
+        HoldingsSnapshot.objects.take(self.now - timedelta(hours=4))
+        self.create_order(-4, hours_ago=3)
+        self.url = reverse("investment-history")
+
+    def create_order(self, quantity: int, hours_ago: int):
+        order = OrderFactory(
+            user=self.user, stock=self.stock, quantity=quantity
+        )
+        Order.objects.filter(pk=order.pk).update(
+            created=self.now - timedelta(hours=hours_ago)
+        )
+
+    def test_point_in_time(self):
+        response = self.client.get(
+            self.url,
+            {
+                "user": self.user.id,
+                "at": (self.now - timedelta(hours=2)).isoformat(),
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        points = response.json()["points"]
+        self.assertEqual(len(points), 1)
+        self.assertEqual(
+            points[0]["holdings"],
+            [
+                {
+                    "stock_id": self.stock.id,
+                    "stock_symbol": self.stock.symbol,
+                    "quantity": 6,
+                }
+            ],
+        )
+
+    def test_time_range(self):
+        response = self.client.get(
+            self.url,
+            {
+                "user": self.user.id,
+                "start": (self.now - timedelta(hours=6)).isoformat(),
+                "end": self.now.isoformat(),
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        points = response.json()["points"]
+        self.assertEqual(
+            [
+                [holding["quantity"] for holding in point["holdings"]]
+                for point in points
+            ],
+            [[], [10], [6]],
+        )
+
+    def test_invalid_query(self):
+        response = self.client.get(self.url, {"user": self.user.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            self.url,
+            {
+                "user": self.user.id,
+                "start": self.now.isoformat(),
+                "end": (self.now - timedelta(hours=1)).isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("end", response.json())
+
+    @override_settings(HOLDINGS_HISTORY_MAX_POINTS=2)
+    def test_time_range_too_long(self):
+        response = self.client.get(
+            self.url,
+            {
+                "user": self.user.id,
+                "start": (self.now - timedelta(hours=6)).isoformat(),
+                "end": self.now.isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
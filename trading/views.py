@@ -1,24 +1,45 @@
-from django.db.models import (
-    F,
-    QuerySet,
-)
+from django.db.models import QuerySet
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets
+from rest_framework import (
+    mixins,
+    status,
+    viewsets,
+)
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from trading.caching import (
+    FILES_SCOPE,
+    STOCKS_SCOPE,
+    USERS_SCOPE,
+    CachedListMixin,
+    get_user_scope,
+)
 from trading.models import (
     Order,
+    Position,
     Stock,
     TradeDataFile,
 )
+from trading.pagination import (
+    InvestmentCursorPagination,
+    OrderCursorPagination,
+)
 from trading.serializers import (
+    InvestmentHistorySerializer,
     InvestmentSerializer,
+    OrderBatchSerializer,
     OrderSerializer,
     StockSerializer,
+    TradeDataFileDryRunSerializer,
     TradeDataFileSerializer,
+    TradeDataFileStatusSerializer,
 )
+from trading.services import stock_symbols
 
 
-class StockViewSet(viewsets.ModelViewSet):
+class StockViewSet(CachedListMixin, viewsets.ModelViewSet):
     """View set for listing available stocks"""
 
     queryset = Stock.objects.all()
@@ -27,8 +48,11 @@ class StockViewSet(viewsets.ModelViewSet):
         "get",
     ]
 
+    def get_response_scopes(self) -> list[str]:
+        return [STOCKS_SCOPE]
+
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(CachedListMixin, viewsets.ModelViewSet):
     """View set for orders"""
 
     queryset = Order.objects.all()
@@ -36,33 +60,101 @@ class OrderViewSet(viewsets.ModelViewSet):
     permission_classes = [
         IsAuthenticated,
     ]
+    pagination_class = OrderCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ["stock", "order_type"]
     http_method_names = [
         "get",
         "post",
     ]
 
+    def initial(self, request: Request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # checked once per request instead of for every stock in a batch
+        stock_symbols.refresh()
+
     def get_queryset(self, *args, **kwargs) -> QuerySet:
-        return self.queryset.filter(user=self.request.user).select_related(
-            "stock"
-        )
+        return self.queryset.filter(user=self.request.user)
+
+    def get_response_scopes(self) -> list[str]:
+        return [get_user_scope(self.request.user.pk), FILES_SCOPE]
 
+    def get_serializer_class(self):
+        if self.action == "batch":
+            return OrderBatchSerializer
+        return super().get_serializer_class()
 
-class TradeDataFileViewSet(viewsets.ModelViewSet):
-    """View set for Trade Data Files"""
+    @action(detail=False, methods=["post"])
+    def batch(self, request: Request) -> Response:
+        """Place a list of orders in one request and transaction"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class TradeDataFileViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """View set for uploading Trade Data Files and following their
+    processing progress
+    """
 
     queryset = TradeDataFile.objects.all()
     serializer_class = TradeDataFileSerializer
-    http_method_names = ["post"]
 
+    def get_serializer_class(self):
+        if self.action == "retrieve":
+            return TradeDataFileStatusSerializer
+        if self.action == "dry_run":
+            return TradeDataFileDryRunSerializer
+        return super().get_serializer_class()
 
-class InvestmentViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+    @action(detail=False, methods=["post"], url_path="dry-run")
+    def dry_run(self, request: Request) -> Response:
+        """Validate a file against current holdings without processing it"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+
+class InvestmentViewSet(CachedListMixin, viewsets.ModelViewSet):
+    """Per user and stock quantity and value served from the positions
+    rollup, filtered on the indexed user and stock symbol columns
+    """
+
+    queryset = Position.objects.all()
     serializer_class = InvestmentSerializer
+    pagination_class = InvestmentCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ["user", "stock__symbol"]
     http_method_names = ["get"]
 
     def get_queryset(self):
-        return self.queryset.annotate_total_quantity_user_stock().annotate(
-            total_value=F("total_quantity") * F("stock__price")
+        return self.queryset.values(
+            "id", "user_id", "stock__symbol", "quantity", "value"
         )
+
+    def get_serializer_class(self):
+        if self.action == "history":
+            return InvestmentHistorySerializer
+        return super().get_serializer_class()
+
+    @action(detail=False)
+    def history(self, request: Request) -> Response:
+        """Holdings of a user at a past point in time or over a time range,
+        read from the nearest snapshots and the orders created after them
+        """
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+    def get_response_scopes(self) -> list[str]:
+        user_id = self.request.query_params.get("user", "")
+        if user_id.isdigit():
+            return [get_user_scope(int(user_id)), FILES_SCOPE, STOCKS_SCOPE]
+        return [USERS_SCOPE, STOCKS_SCOPE]